@@ -0,0 +1,59 @@
+// renders the compact diagram graphs of fullProcess.jointDiagramGraph:
+//   {"title", "width", "height", "nodes": [[shape, x, y, width, height, label], ..], "links": [[source, target, style], ..]}
+// shape 0: hydraulic name, 1: interface text label, 2: control block
+// style 0: hydraulic - interface, 1: interface - control block, 2: control block - control block
+// The cells are added to the graph in batches, one batch per animation frame, and the paper renders them asynchronously.
+
+function renderDiagramGraph(data, paperElement, batchSize) {
+    batchSize = batchSize || 500;
+    var namespace = joint.shapes;
+    var title = document.getElementById('title');
+    if (title) { title.innerText = data.title; }
+
+    var graph = new joint.dia.Graph({}, { cellNamespace: namespace });
+    var paper = new joint.dia.Paper({
+        el: paperElement,
+        model: graph,
+        width: data.width,
+        height: data.height,
+        gridSize: 1,
+        async: true,
+        frozen: true,
+        cellViewNamespace: namespace
+    });
+
+    var ellipse = new joint.shapes.standard.Ellipse();
+    ellipse.attr('body/fill', 'lightblue');
+    var textLabel = new joint.shapes.standard.Rectangle();
+    textLabel.attr({ body: { fill: 'blue' }, label: { fill: '#AAAAAA' } });
+    var ctrlBlock = new joint.shapes.standard.Rectangle();
+    ctrlBlock.attr({ body: { fill: '#11BB11' }, label: { fill: '#441155' } });
+    var shapes = [ellipse, textLabel, ctrlBlock];
+
+    var nodes = data.nodes.map(function (n) {
+        var el = shapes[n[0]].clone();
+        el.position(n[1], n[2]);
+        el.resize(n[3], n[4]);
+        el.attr('label/text', n[5]);
+        return el;
+    });
+    var links = data.links.map(function (l) {
+        var link = new joint.shapes.standard.Link();
+        link.source(nodes[l[0]]);
+        link.target(nodes[l[1]]);
+        if (l[2] > 0) { link.connector('smooth'); }
+        if (l[2] === 2) { link.attr('line/stroke', '#AA2244'); }
+        return link;
+    });
+
+    var cells = nodes.concat(links);
+    var next = 0;
+    function addBatch() {
+        graph.addCells(cells.slice(next, next + batchSize));
+        next += batchSize;
+        if (next < cells.length) { window.requestAnimationFrame(addBatch); }
+    }
+    addBatch();
+    paper.unfreeze();
+    return paper;
+}
@@ -0,0 +1,349 @@
+#  Copyright (c) 2023.   Adam Buruzs
+## Command line entry point: process the pages of one or more WSCAD pdf documents in parallel.
+## The pages are independent, they are spread over a pool of worker processes, and each worker opens its own
+## fitz document. The results are written in completion order.
+##
+## usage: python -m src.baschema2model schema1.pdf schema2.pdf --jobs 8 --pages 1-5,9 --outdir ./results
+##        add --cache ./cache to reuse the results of unchanged pages, see resultCache
+##        add --calibration ./calib to calibrate the gray threshold per document, see thresholdProfile
+##        add --trace trace.json to record the time of the processing stages, see spanTrace
+##        add --format ndjson to write one compact record per page to a NDJSON file per document, see ndjsonWriter
+
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import time
+
+import fitz
+
+from src import fullProcess, ndjsonWriter
+from src.readpdf import getSchemaNumber
+from src.resultCache import ResultCache, pageKey
+from src.spanTrace import PageTrace, NULL_TRACE, stageSummary, formatSummary, writeChromeTrace
+from src.thresholdProfile import ThresholdProfile, recordShared
+
+## documents opened by this (worker) process, keyed by the file path
+_openDocs = {}
+## result cache of this (worker) process, see setCache
+_cache = None
+## directory of the threshold calibration profiles, see setCalibration
+_calibrationDir = None
+## calibration profiles of the documents processed by this process, keyed by the file path
+_profiles = {}
+## record the time of the processing stages in this process, see setTracing
+_tracing = False
+## output format of this process: "txt" (json text of each page) or "ndjson" (compact record), see setOutputFormat
+_outputFormat = "txt"
+## keep the debug fields in the ndjson records
+_debugFields = True
+## parameters of fullProcess.processPage, they are part of the cache key
+PAGE_PARAMS = {"pixThreshold": 200, "zoom_factor": 3, "minRctglLen": 30, "precision": 0, "minLegth": 20}
+
+
+def parsePages(spec, pageCount):
+    """ parse a page selection like "1-5,8,10-"
+    :param spec: comma separated page numbers or ranges, starting from 1. None selects all the pages.
+    :param pageCount: number of pages of the document
+    :return: sorted list of page numbers (starting from 1)
+    """
+    if spec is None:
+        return list(range(1, pageCount + 1))
+    pages = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if part == "":
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            first = int(first) if first else 1
+            last = int(last) if last else pageCount
+            pages.update(range(first, last + 1))
+        else:
+            pages.add(int(part))
+    return sorted(p for p in pages if 1 <= p <= pageCount)
+
+
+def getDocument(inpfile):
+    """ open the pdf once per process """
+    if inpfile not in _openDocs:
+        _openDocs[inpfile] = fitz.open(inpfile)
+    return _openDocs[inpfile]
+
+
+def setCache(cacheDir, maxBytes=1 << 30):
+    """ use a ResultCache in this process. cacheDir = None switches the cache off """
+    global _cache
+    _cache = None if cacheDir is None else ResultCache(cacheDir, maxBytes=maxBytes)
+
+
+def setCalibration(calibrationDir):
+    """ calibrate the gray threshold per document, and keep the profiles in calibrationDir. None switches it off """
+    global _calibrationDir
+    _calibrationDir = calibrationDir
+    _profiles.clear()
+
+
+def pathHash(inpfile):
+    """ short hash of the absolute path of a file, it tells apart the files of the same name """
+    return hashlib.sha1(os.path.abspath(inpfile).encode()).hexdigest()[:8]
+
+
+def profilePath(inpfile):
+    """ file of the calibration profile of a document """
+    return os.path.join(_calibrationDir, f"{fileTagOf(inpfile)}_{pathHash(inpfile)}.json")
+
+
+def setTracing(tracing):
+    """ record a spanTrace.PageTrace of every page processed in this process """
+    global _tracing
+    _tracing = tracing
+
+
+def setOutputFormat(outputFormat, debugFields=True):
+    """ serialize the pages of this process to the json text ("txt") or to compact ndjson records ("ndjson")
+    :param debugFields: keep the debug fields in the ndjson records, see ndjsonWriter.compactRecord
+    """
+    global _outputFormat, _debugFields
+    _outputFormat, _debugFields = outputFormat, debugFields
+
+
+def getProfile(inpfile):
+    """ the threshold calibration profile of the document, None if the calibration is switched off.
+    Until it is calibrated, the profile is loaded again before every page, it has the pages of the other workers
+    and of the earlier runs """
+    if _calibrationDir is None:
+        return None
+    if (inpfile not in _profiles) or not _profiles[inpfile].calibrated:
+        _profiles[inpfile] = ThresholdProfile.load(profilePath(inpfile))
+    return _profiles[inpfile]
+
+
+def serializePage(ifaces, controls, pagenum, diagramNumber, outputFormat="txt", debugFields=True):
+    """ serialize the output of fullProcess.processPage, see processPageText """
+    if outputFormat == "ndjson":
+        return ndjsonWriter.toLine(ndjsonWriter.compactRecord(ifaces, controls, pagenum, diagramNumber,
+                                                              debug=debugFields))
+    return json.dumps({"diagramNumber": diagramNumber, "interfaces": ifaces, "controlBlocks": controls},
+                      cls=fullProcess.DataEncoder)
+
+
+def processPageText(doc, pagenum, cache=None, profile=None, trace=None, outputFormat="txt", debugFields=True):
+    """ process one page, and serialize the result to json text
+    :param pagenum: page number starting from 1
+    :param cache: ResultCache, if the page content is found in it, the page is not processed again
+    :param profile: thresholdProfile.ThresholdProfile of the document
+    :param trace: spanTrace.PageTrace, the time of the processing stages is recorded in it
+    :param outputFormat: "txt": json text with all the fields, "ndjson": one line compact record
+    :param debugFields: keep the debug fields of the compact record
+    """
+    trace = NULL_TRACE if trace is None else trace
+    page = doc[pagenum - 1]
+    params = PAGE_PARAMS if profile is None else dict(PAGE_PARAMS, thresholds=profile.candidates())
+    if outputFormat != "txt":
+        params = dict(params, outputFormat=outputFormat, debugFields=debugFields)
+    if cache is not None:
+        with trace.span("cache lookup"):
+            key = pageKey(page, params)
+            outText = cache.get(key)
+        if outText is not None:
+            return outText
+    ifaces, controls = fullProcess.processPage(doc, pagenum=pagenum, doplot=False, thresholdProfile=profile,
+                                               trace=trace, **PAGE_PARAMS)
+    zeichungsNummer = getSchemaNumber(page)
+    with trace.span("serialization"):
+        outText = serializePage(ifaces, controls, pagenum, zeichungsNummer, outputFormat=outputFormat,
+                                debugFields=debugFields)
+    if cache is not None:
+        cache.put(key, outText)
+    return outText
+
+
+def processPageTask(inpfile, pagenum):
+    """ worker task: process page pagenum of inpfile
+    :return: (inpfile, pagenum, json text (or ndjson line) or None, error message or None, trace dict or None)
+        the trace is a spanTrace.PageTrace.toDict(), if the tracing is switched on (see setTracing)
+    """
+    trace = PageTrace(f"{fileTagOf(inpfile)} p{pagenum}") if _tracing else NULL_TRACE
+    try:
+        profile = getProfile(inpfile)
+        wasCalibrated = (profile is None) or profile.calibrated
+        pagesBefore = 0 if profile is None else profile.pages
+        outText = processPageText(getDocument(inpfile), pagenum, cache=_cache, profile=profile, trace=trace,
+                                  outputFormat=_outputFormat, debugFields=_debugFields)
+        if (not wasCalibrated) and (profile.pages > pagesBefore):
+            ## add the page to the shared profile file, not a cached result
+            _profiles[inpfile] = recordShared(profilePath(inpfile), profile.lastThreshold)
+        return inpfile, pagenum, outText, None, trace.toDict()
+    except Exception as e:
+        logging.exception(f"error on page {pagenum} of {inpfile}")
+        return inpfile, pagenum, None, f"{type(e).__name__}: {e}", trace.toDict()
+
+
+def initWorker(verbose, cacheDir=None, cacheMaxBytes=1 << 30, calibrationDir=None, tracing=False, outputFormat="txt",
+               debugFields=True):
+    """ silence the print and debug output of the processing modules in the worker processes, open the cache,
+    set the calibration directory, switch the tracing on or off and set the output format"""
+    setCache(cacheDir, cacheMaxBytes)
+    setCalibration(calibrationDir)
+    setTracing(tracing)
+    setOutputFormat(outputFormat, debugFields)
+    logging.basicConfig(stream=sys.stdout)
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+        logging.getLogger().setLevel(logging.WARNING)
+
+
+def fileTagOf(inpfile):
+    return os.path.basename(inpfile).replace(".pdf", "")
+
+
+def uniqueTags(files):
+    """ make the output tags of the documents unique. A tag that is already used by an other file gets the
+    "_<path hash>" suffix (see pathHash). The first file keeps its tag, so the tags stay the same when files are
+    added to the end of the inputs.
+    :param files: list of (pdf file, tag)
+    :return: list of (pdf file, unique tag), the same file (absolute path) always gets the same tag
+    """
+    owners = {}  # tag -> absolute path
+    pathTags = {}  # absolute path -> tag
+    out = []
+    for inpfile, tag in files:
+        path = os.path.abspath(inpfile)
+        if path not in pathTags:
+            if tag in owners:
+                newTag = f"{tag}_{pathHash(path)}"
+                logging.warning(f"{inpfile} has the same output name as {owners[tag]}, its outputs are named {newTag}")
+                tag = newTag
+            owners[tag] = path
+            pathTags[path] = tag
+        out.append((inpfile, pathTags[path]))
+    return out
+
+
+def writeResult(outdir, inpfile, pagenum, outText, fileTag=None):
+    """ write the json text of a page to outdir/schemaText/<fileTag>_p<pagenum>.txt"""
+    fileTag = fileTagOf(inpfile) if fileTag is None else fileTag
+    outfile = os.path.join(outdir, "schemaText", f"{fileTag}_p{pagenum}.txt")
+    with open(outfile, "w") as f:
+        f.write(outText)
+    return outfile
+
+
+def ndjsonPath(outdir, inpfile, fileTag=None):
+    """ NDJSON file of a document: outdir/schemaText/<fileTag>.ndjson """
+    fileTag = fileTagOf(inpfile) if fileTag is None else fileTag
+    return os.path.join(outdir, "schemaText", f"{fileTag}.ndjson")
+
+
+def writeTraces(traceFile, traces):
+    """ write the page traces to a Chrome trace file, and log the summary of the stages """
+    writeChromeTrace(traceFile, traces)
+    logging.info(f"stage timing of {len(traces)} pages, trace written to {traceFile}\n"
+                 f"{formatSummary(stageSummary(traces))}")
+
+
+def runDocuments(inpfiles, outdir, jobs=None, pages=None, verbose=False, cacheDir=None, cacheMaxBytes=1 << 30,
+                 calibrationDir=None, traceFile=None, outputFormat="txt", debugFields=True):
+    """ process the pages of the pdf documents with a process pool
+    :param inpfiles: list of pdf files
+    :param outdir: output directory, results are written to outdir/schemaText. The files of the same name get
+        unique output names, see uniqueTags
+    :param jobs: number of worker processes, default: number of cpus
+    :param pages: page selection, see parsePages
+    :param cacheDir: directory of the result cache, None: no caching
+    :param cacheMaxBytes: size limit of the result cache
+    :param calibrationDir: directory of the gray threshold calibration profiles, None: no calibration
+    :param traceFile: record the time of the processing stages, and write it to this Chrome trace json file
+    :param outputFormat: "txt": a json file per page, "ndjson": a compact record per page, appended to the
+        NDJSON file of the document (see ndjsonPath) as soon as the page is finished
+    :param debugFields: keep the debug fields of the ndjson records
+    :return: list of (inpfile, pagenum, error message) of the failed pages
+    """
+    os.makedirs(os.path.join(outdir, "schemaText"), exist_ok=True)
+    tags = dict(uniqueTags([(inpfile, fileTagOf(inpfile)) for inpfile in inpfiles]))
+    tasks = []
+    for inpfile in inpfiles:
+        with fitz.open(inpfile) as doc:
+            tasks += [(inpfile, p) for p in parsePages(pages, doc.page_count)]
+    jobs = jobs or os.cpu_count()
+    logging.info(f"processing {len(tasks)} pages of {len(inpfiles)} documents with {jobs} workers")
+    t0 = time()
+    failed = []
+    traces = []
+    writer = ndjsonWriter.NdjsonWriter() if outputFormat == "ndjson" else None
+
+    def collect(result):
+        inpfile, pagenum, outText, error, trace = result
+        if trace is not None:
+            traces.append(trace)
+        if error is None:
+            if writer is None:
+                outfile = writeResult(outdir, inpfile, pagenum, outText, fileTag=tags[inpfile])
+            else:
+                outfile = ndjsonPath(outdir, inpfile, fileTag=tags[inpfile])
+                writer.write(outfile, outText)
+            logging.info(f"page {pagenum} of {inpfile} processed, wrote {outfile}")
+        else:
+            failed.append((inpfile, pagenum, error))
+            logging.error(f"page {pagenum} of {inpfile} failed: {error}")
+
+    try:
+        if jobs == 1:
+            setCache(cacheDir, cacheMaxBytes)
+            setCalibration(calibrationDir)
+            setTracing(traceFile is not None)
+            setOutputFormat(outputFormat, debugFields)
+            with open(os.devnull, "w") as devnull, \
+                    contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+                for task in tasks:
+                    collect(processPageTask(*task))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=initWorker,
+                                     initargs=(verbose, cacheDir, cacheMaxBytes, calibrationDir,
+                                               traceFile is not None, outputFormat, debugFields)) as pool:
+                futures = [pool.submit(processPageTask, *task) for task in tasks]
+                for fut in as_completed(futures):
+                    collect(fut.result())
+    finally:
+        if writer is not None:
+            writer.close()
+    logging.info(f"{len(tasks) - len(failed)} of {len(tasks)} pages processed in {round(time() - t0, 2)} sec")
+    if traceFile is not None:
+        writeTraces(traceFile, traces)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="baschema2model",
+                                     description="convert VDI 3814 BACS schema pdf files to machine readable format")
+    parser.add_argument("pdf", nargs="+", help="input pdf files")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="number of worker processes (default: all cpus)")
+    parser.add_argument("--pages", "-p", default=None, help='pages to process, for example "1-5,8" (default: all)')
+    parser.add_argument("--outdir", "-o", default="output", help="output directory")
+    parser.add_argument("--verbose", "-v", action="store_true", help="keep the debug output of the workers")
+    parser.add_argument("--cache", default=None, help="result cache directory, unchanged pages are not processed again")
+    parser.add_argument("--cache-size", type=int, default=1024, help="size limit of the result cache in MB")
+    parser.add_argument("--calibration", default=None,
+                        help="directory of the per document gray threshold calibration profiles")
+    parser.add_argument("--trace", default=None,
+                        help="record the time of the processing stages to this Chrome trace json file")
+    parser.add_argument("--format", default="txt", choices=["txt", "ndjson"],
+                        help="txt: a json file per page, ndjson: a compact record per page in a file per document")
+    parser.add_argument("--no-debug", action="store_true", help="leave out the debug fields of the ndjson records")
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stdout)
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.INFO)
+    failed = runDocuments(args.pdf, args.outdir, jobs=args.jobs, pages=args.pages, verbose=args.verbose,
+                          cacheDir=args.cache, cacheMaxBytes=args.cache_size << 20,
+                          calibrationDir=args.calibration, traceFile=args.trace, outputFormat=args.format,
+                          debugFields=not args.no_debug)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+#  Copyright (c) 2023.   Adam Buruzs
+## Batch mode for a whole corpus of WSCAD pdf files.
+## The completion of every page is recorded in a journal file (one json record per line), so an interrupted
+## run can be resumed, and the failed pages are retried up to a maximum number of attempts.
+##
+## usage: python -m src.batch ./corpus_dir --outdir ./output --jobs 16
+##        python -m src.batch manifest.txt --outdir ./output --max-attempts 3
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from time import time
+
+import fitz
+
+from src import baschema2model, ndjsonWriter
+
+
+class Journal:
+    """ append-only record of the page results. Each line is a json record
+    {"file": .., "page": .., "status": "done" or "failed", "error": .., "time": ..}
+    The records can be written from several threads (the ndjson writer records the pages it has written).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()  # (file, page) keys of the finished pages
+        self.attempts = {}  # (file, page) -> number of failed attempts
+        if os.path.exists(path):
+            with open(path) as f:
+                for row in f:
+                    try:
+                        rec = json.loads(row)
+                    except json.JSONDecodeError:  # last line of a crashed run can be incomplete
+                        continue
+                    self._count(rec)
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def _count(self, rec):
+        key = (rec["file"], rec["page"])
+        if rec["status"] == "done":
+            self.done.add(key)
+        else:
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+
+    def record(self, inpfile, pagenum, error=None):
+        """ write the result of a page to the journal, and flush it to the disk"""
+        rec = {"file": inpfile, "page": pagenum, "status": "done" if error is None else "failed",
+               "error": error, "time": time()}
+        with self._lock:
+            self._count(rec)
+            self._file.write(json.dumps(rec) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def collectInputs(inputs):
+    """ list the pdf files of the input
+    :param inputs: list of pdf files, directories (searched recursively) or manifest files (one pdf path per line)
+    :return: list of (pdf file path, file tag) tuples, every file once. The file tag is unique over all the
+        inputs (see baschema2model.uniqueTags), it is used to name the outputs
+    """
+    pdfs = []
+    for inp in inputs:
+        if os.path.isdir(inp):
+            for root, dirs, files in os.walk(inp):
+                dirs.sort()
+                for fn in sorted(files):
+                    if fn.lower().endswith(".pdf"):
+                        path = os.path.join(root, fn)
+                        rel = os.path.relpath(path, inp)
+                        pdfs.append((os.path.abspath(path), os.path.splitext(rel)[0].replace(os.sep, "_")))
+        elif inp.lower().endswith(".pdf"):
+            pdfs.append((os.path.abspath(inp), baschema2model.fileTagOf(inp)))
+        else:  # manifest file
+            basedir = os.path.dirname(os.path.abspath(inp))
+            with open(inp) as f:
+                for row in f:
+                    row = row.strip()
+                    if row and not row.startswith("#"):
+                        path = os.path.join(basedir, row)
+                        pdfs.append((os.path.abspath(path), baschema2model.fileTagOf(path)))
+    unique = {}
+    for path, tag in baschema2model.uniqueTags(pdfs):
+        unique.setdefault(path, tag)  # a file listed in more than one input is processed once
+    return list(unique.items())
+
+
+def formatProgress(ndone, ntotal, t0):
+    """ progress message with pages per second and the estimated remaining time"""
+    elapsed = time() - t0
+    rate = ndone / elapsed if elapsed > 0 else 0.0
+    if ndone >= ntotal:
+        eta = "0 s"
+    elif rate > 0:
+        eta = f"{(ntotal - ndone) / rate:.0f} s"
+    else:
+        eta = "unknown"
+    return f"{ndone}/{ntotal} pages, {rate:.2f} pages/s, remaining {eta}"
+
+
+def runBatch(inputs, outdir, jobs=None, journalPath=None, maxAttempts=3, verbose=False, reportEvery=10.0,
+             cacheDir=None, cacheMaxBytes=1 << 30, calibrationDir=None, traceFile=None, outputFormat="txt",
+             debugFields=True):
+    """ process a corpus of pdf documents with checkpointing.
+    Pages that are already done in the journal are skipped, failed pages are retried until maxAttempts failures.
+
+    :param inputs: pdf files, directories or manifest files, see collectInputs
+    :param outdir: output directory
+    :param journalPath: journal file, default: outdir/journal.jsonl
+    :param maxAttempts: maximum number of attempts per page
+    :param reportEvery: seconds between the progress reports
+    :param cacheDir, cacheMaxBytes: result cache, see baschema2model.runDocuments
+    :param calibrationDir: gray threshold calibration profiles, see baschema2model.runDocuments
+    :param traceFile: Chrome trace file of the processing stages, see baschema2model.runDocuments
+    :param outputFormat, debugFields: see baschema2model.runDocuments. The ndjson records are appended to the
+        files of the earlier runs, a page is recorded as done in the journal when its record is written.
+    :return: list of (file, page) of the pages that failed maxAttempts times
+    """
+    os.makedirs(os.path.join(outdir, "schemaText"), exist_ok=True)
+    journal = Journal(journalPath or os.path.join(outdir, "journal.jsonl"))
+    tags = {}
+    pending = []
+    for inpfile, tag in collectInputs(inputs):
+        tags[inpfile] = tag
+        try:
+            with fitz.open(inpfile) as doc:
+                pageCount = doc.page_count
+        except Exception:
+            logging.exception(f"cannot open {inpfile}")
+            continue
+        pending += [(inpfile, p) for p in range(1, pageCount + 1)
+                    if ((inpfile, p) not in journal.done) and (journal.attempts.get((inpfile, p), 0) < maxAttempts)]
+    ntotal = len(pending)
+    logging.info(f"{ntotal} pages to process, {len(journal.done)} pages already done according to {journal.path}")
+    jobs = jobs or os.cpu_count()
+    pending.reverse()  # pop() from the end keeps the document order
+    ndone = 0
+    t0 = lastReport = time()
+    traces = []
+    writer = ndjsonWriter.NdjsonWriter(mode="a") if outputFormat == "ndjson" else None
+
+    def collect(inpfile, pagenum, outText, error, trace=None):
+        nonlocal ndone
+        if trace is not None:
+            traces.append(trace)
+        if (error is None) and (writer is not None):
+            writer.write(baschema2model.ndjsonPath(outdir, inpfile, fileTag=tags[inpfile]), outText,
+                         callback=lambda: journal.record(inpfile, pagenum))
+        else:
+            if error is None:
+                baschema2model.writeResult(outdir, inpfile, pagenum, outText, fileTag=tags[inpfile])
+            journal.record(inpfile, pagenum, error)
+        if error is None:
+            ndone += 1
+        elif journal.attempts[(inpfile, pagenum)] < maxAttempts:
+            logging.warning(f"page {pagenum} of {inpfile} failed ({error}), retrying")
+            pending.insert(0, (inpfile, pagenum))
+        else:
+            ndone += 1
+            logging.error(f"page {pagenum} of {inpfile} failed {maxAttempts} times, giving up: {error}")
+
+    try:
+        if jobs == 1:
+            baschema2model.setCache(cacheDir, cacheMaxBytes)
+            baschema2model.setCalibration(calibrationDir)
+            baschema2model.setTracing(traceFile is not None)
+            baschema2model.setOutputFormat(outputFormat, debugFields)
+            with open(os.devnull, "w") as devnull, \
+                    contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+                while pending:
+                    collect(*baschema2model.processPageTask(*pending.pop()))
+                    if time() - lastReport > reportEvery:
+                        lastReport = time()
+                        logging.info(formatProgress(ndone, ntotal, t0))
+        else:
+            suspects = set()  # pages that were in progress when a worker crashed, they are run one by one
+            while pending:
+                inflight = {}
+                try:
+                    with ProcessPoolExecutor(max_workers=jobs, initializer=baschema2model.initWorker,
+                                             initargs=(verbose, cacheDir, cacheMaxBytes, calibrationDir,
+                                                       traceFile is not None, outputFormat, debugFields)) as pool:
+                        while pending or inflight:
+                            ## keep a limited number of tasks in the queue of the pool
+                            while pending and (len(inflight) < 2 * jobs) and not (suspects & set(inflight.values())):
+                                if (pending[-1] in suspects) and inflight:
+                                    break  # wait until the suspect page can run alone
+                                task = pending.pop()
+                                try:
+                                    inflight[pool.submit(baschema2model.processPageTask, *task)] = task
+                                except BrokenProcessPool:
+                                    pending.append(task)
+                                    raise
+                            finished, _ = wait(inflight, timeout=reportEvery, return_when=FIRST_COMPLETED)
+                            for fut in finished:
+                                result = fut.result()
+                                inflight.pop(fut)
+                                collect(*result)
+                            if time() - lastReport > reportEvery:
+                                lastReport = time()
+                                logging.info(formatProgress(ndone, ntotal, t0))
+                except BrokenProcessPool:
+                    ## a worker died (for example a crash in the pdf library). If only one page was in progress
+                    ## it failed, otherwise the affected pages are rerun alone to find the one that crashes.
+                    logging.error(f"worker process crashed, restarting the pool. {len(inflight)} pages affected")
+                    if len(inflight) == 1:
+                        collect(*next(iter(inflight.values())), None, "worker process crashed")
+                    else:
+                        suspects.update(inflight.values())
+                        pending.extend(inflight.values())
+    finally:
+        if writer is not None:
+            writer.close()
+        journal.close()
+    logging.info(formatProgress(ndone, ntotal, t0))
+    if traceFile is not None:
+        baschema2model.writeTraces(traceFile, traces)
+    gaveUp = [key for key, n in journal.attempts.items() if (n >= maxAttempts) and (key not in journal.done)]
+    return gaveUp
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="baschema2model-batch",
+                                     description="process a corpus of BACS schema pdf files with checkpointing")
+    parser.add_argument("inputs", nargs="+", help="pdf files, directories or manifest files (one pdf per line)")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="number of worker processes (default: all cpus)")
+    parser.add_argument("--outdir", "-o", default="output", help="output directory")
+    parser.add_argument("--journal", default=None, help="journal file (default: <outdir>/journal.jsonl)")
+    parser.add_argument("--max-attempts", type=int, default=3, help="maximum number of attempts per page")
+    parser.add_argument("--verbose", "-v", action="store_true", help="keep the debug output of the workers")
+    parser.add_argument("--cache", default=None, help="result cache directory, unchanged pages are not processed again")
+    parser.add_argument("--cache-size", type=int, default=1024, help="size limit of the result cache in MB")
+    parser.add_argument("--calibration", default=None,
+                        help="directory of the per document gray threshold calibration profiles")
+    parser.add_argument("--trace", default=None,
+                        help="record the time of the processing stages to this Chrome trace json file")
+    parser.add_argument("--format", default="txt", choices=["txt", "ndjson"],
+                        help="txt: a json file per page, ndjson: a compact record per page in a file per document")
+    parser.add_argument("--no-debug", action="store_true", help="leave out the debug fields of the ndjson records")
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stdout)
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.INFO)
+    gaveUp = runBatch(args.inputs, args.outdir, jobs=args.jobs, journalPath=args.journal,
+                      maxAttempts=args.max_attempts, verbose=args.verbose,
+                      cacheDir=args.cache, cacheMaxBytes=args.cache_size << 20,
+                      calibrationDir=args.calibration, traceFile=args.trace, outputFormat=args.format,
+                      debugFields=not args.no_debug)
+    return 1 if gaveUp else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
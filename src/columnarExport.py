@@ -0,0 +1,223 @@
+#  Copyright (c) 2023.   Adam Buruzs
+## Columnar export of the extracted geometry and graphs of many pages, for analytics over a whole corpus.
+## The compact page records (see ndjsonWriter.compactRecord) are split into typed tables, every row has the document
+## and page keys:
+##   documents:  doc, name
+##   pages:      doc, page, diagramNumber
+##   lines:      doc, page, source ("control", "interface", "hydraulic"), index, x0, y0, x1, y1, style
+##   blocks:     doc, page, block, x0, y0, x1, y1, labels
+##   terminals:  doc, page, block, terminal, x, y, line, label
+##   interfaces: doc, page, interface, x, y, header, label, type, hydraulic, hydraulicX, hydraulicY
+##   edges:      doc, page, kind ("ctrl2ctrl", "iface2ctrl"), source, sourceLabel, target, targetLabel
+## The control lines are only in the records with the debug fields.
+##
+## Formats: "npy" (default) a directory with one .npy file per column, that is read memory-mapped;
+## "npz" a single (compressed) file; "parquet" a directory with one Parquet file per table (needs pyarrow).
+##
+## usage: python -m src.columnarExport ./output/corpus.columns ./output/schemaText/*.ndjson
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+import numpy as np
+
+from src import ndjsonWriter
+
+## columns and types of the tables. The strings are stored as fixed width unicode, so they can be memory-mapped
+TABLES = {
+    "documents": [("doc", "i4"), ("name", "U")],
+    "pages": [("doc", "i4"), ("page", "i4"), ("diagramNumber", "U")],
+    "lines": [("doc", "i4"), ("page", "i4"), ("source", "U"), ("index", "i4"),
+              ("x0", "f4"), ("y0", "f4"), ("x1", "f4"), ("y1", "f4"), ("style", "U")],
+    "blocks": [("doc", "i4"), ("page", "i4"), ("block", "i4"),
+               ("x0", "f4"), ("y0", "f4"), ("x1", "f4"), ("y1", "f4"), ("labels", "U")],
+    "terminals": [("doc", "i4"), ("page", "i4"), ("block", "i4"), ("terminal", "i4"),
+                  ("x", "f4"), ("y", "f4"), ("line", "i4"), ("label", "U")],
+    "interfaces": [("doc", "i4"), ("page", "i4"), ("interface", "i4"), ("x", "f4"), ("y", "f4"),
+                   ("header", "U"), ("label", "U"), ("type", "U"), ("hydraulic", "U"),
+                   ("hydraulicX", "f4"), ("hydraulicY", "f4")],
+    "edges": [("doc", "i4"), ("page", "i4"), ("kind", "U"), ("source", "i4"), ("sourceLabel", "U"),
+              ("target", "i4"), ("targetLabel", "U")],
+}
+
+
+def joinLabels(labels):
+    """ one string of a list of text labels: the stripped labels separated by "|" """
+    if labels is None:
+        return ""
+    if isinstance(labels, str):
+        return labels.strip()
+    return "|".join(lab.strip() for lab in labels)
+
+
+class ColumnarTables:
+    """ collects the rows of the tables. Usage:
+        tables = ColumnarTables()
+        tables.addRecord("schema", record)  # or tables.addPage("schema", pagenum, ifaces, controls)
+        tables.save("corpus.columns")
+    """
+
+    def __init__(self):
+        self.columns = {table: {col: [] for col, dtype in cols} for table, cols in TABLES.items()}
+        self._docIds = {}
+
+    def _row(self, table, *values):
+        for (col, dtype), val in zip(TABLES[table], values):
+            self.columns[table][col].append(val)
+
+    def docId(self, name):
+        """ the integer key of a document, a new row of the documents table for a new name """
+        if name not in self._docIds:
+            self._docIds[name] = len(self._docIds)
+            self._row("documents", self._docIds[name], name)
+        return self._docIds[name]
+
+    def addRecord(self, docName, record):
+        """ add a page record as written to the NDJSON files (plain json types) """
+        doc, page = self.docId(docName), record["page"]
+        self._row("pages", doc, page, joinLabels(record.get("diagramNumber")))
+        for ifa in record["interfaces"]:
+            ii = ifa["index"]
+            hydr = ifa.get("hydraulic") or {}
+            top = hydr.get("topPoint") or [np.nan, np.nan]
+            self._row("interfaces", doc, page, ii, ifa["terminalPoint"][0], ifa["terminalPoint"][1],
+                      joinLabels(ifa.get("labelHeader")), joinLabels(ifa.get("matchingLabels")),
+                      joinLabels(ifa.get("type")), joinLabels(hydr.get("label")), top[0], top[1])
+            for source, ln in [("interface", ifa.get("line")), ("hydraulic", hydr.get("line"))]:
+                if ln is not None:
+                    self._row("lines", doc, page, source, ii, *ln)
+        controls = record.get("controlBlocks")
+        if controls is None:
+            return
+        labels = controls.get("labels") or []
+        for bi, rect in enumerate(controls["rectangles"]):
+            self._row("blocks", doc, page, bi, *rect, joinLabels(labels[bi] if bi < len(labels) else None))
+        for bi, terms in enumerate(controls["terminals"]):
+            for ti, (point, lineIndex, label) in enumerate(terms):
+                lineIndex = -1 if lineIndex is None else lineIndex
+                self._row("terminals", doc, page, bi, ti, point[0], point[1], lineIndex, joinLabels(label))
+        for li, ln in enumerate(controls.get("lines") or []):
+            self._row("lines", doc, page, "control", li, *ln)
+        for source, sourceLabel, target, targetLabel in controls.get("connections") or []:
+            self._row("edges", doc, page, "ctrl2ctrl", source, joinLabels(sourceLabel), target,
+                      joinLabels(targetLabel))
+        for iface, blocks in (controls.get("iface2ctrl") or {}).items():
+            for block, label in blocks:
+                self._row("edges", doc, page, "iface2ctrl", int(iface), "", block, joinLabels(label))
+
+    def addPage(self, docName, pagenum, ifaces, controls, diagramNumber=None):
+        """ add the output of fullProcess.processPage, with all the debug fields """
+        record = ndjsonWriter.compactRecord(ifaces, controls, pagenum, diagramNumber, debug=True)
+        self.addRecord(docName, json.loads(ndjsonWriter.toLine(record)))
+
+    def addNdjson(self, path, docName=None):
+        """ add the records of a NDJSON file of ndjsonWriter
+        :param docName: name of the document, default: the file name without extension
+        """
+        docName = os.path.splitext(os.path.basename(path))[0] if docName is None else docName
+        for pagenum, record in sorted(ndjsonWriter.readRecords(path).items()):
+            self.addRecord(docName, record)
+
+    def arrays(self):
+        """ :return: dict table -> dict column -> typed numpy array """
+        out = {}
+        for table, cols in TABLES.items():
+            out[table] = {}
+            for col, dtype in cols:
+                values = self.columns[table][col]
+                if dtype == "U":
+                    width = max((len(v) for v in values), default=1)
+                    out[table][col] = np.array(values, dtype=f"U{max(width, 1)}")
+                else:
+                    out[table][col] = np.array(values, dtype=dtype)
+        return out
+
+    def save(self, path, format="npy"):
+        """ write the tables
+        :param path: output directory ("npy", "parquet") or file ("npz")
+        :param format: "npy", "npz" or "parquet", see the module description
+        :return: the written path, see saveTables
+        """
+        return saveTables(path, self.arrays(), format=format)
+
+
+def npzPath(path):
+    """ the npz file name: numpy adds the .npz extension if it is missing """
+    return path if path.endswith(".npz") else f"{path}.npz"
+
+
+def saveTables(path, tables, format="npy"):
+    """ write the tables of ColumnarTables.arrays
+    :return: the written path, for "npz" it ends with .npz
+    """
+    if format == "npz":
+        path = npzPath(path)
+        np.savez_compressed(path, **{f"{table}.{col}": arr for table, cols in tables.items()
+                                     for col, arr in cols.items()})
+    elif format == "npy":
+        for table, cols in tables.items():
+            os.makedirs(os.path.join(path, table), exist_ok=True)
+            for col, arr in cols.items():
+                np.save(os.path.join(path, table, f"{col}.npy"), arr)
+        with open(os.path.join(path, "schema.json"), "w") as f:
+            json.dump({table: [col for col, dtype in cols] for table, cols in TABLES.items()}, f, indent=1)
+    elif format == "parquet":
+        import pyarrow
+        import pyarrow.parquet
+        os.makedirs(path, exist_ok=True)
+        for table, cols in tables.items():
+            pyarrow.parquet.write_table(pyarrow.table(cols), os.path.join(path, f"{table}.parquet"))
+    else:
+        raise ValueError(f"unknown format {format}")
+    return path
+
+
+def loadTables(path, mmap=True):
+    """ read the tables written by saveTables
+    :param path: npy or parquet directory, or npz file (the .npz extension can be left out, as in saveTables)
+    :param mmap: memory-map the .npy files, the columns are only read from the disk when they are used
+    :return: dict table -> dict column -> numpy array (npy, npz) or pyarrow.Table (parquet)
+    """
+    if (not os.path.exists(path)) and os.path.isfile(npzPath(path)):
+        path = npzPath(path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"no tables at {path}")
+    if os.path.isfile(path):
+        tables = {}
+        with np.load(path) as npz:
+            for key in npz.files:
+                table, col = key.split(".", 1)
+                tables.setdefault(table, {})[col] = npz[key]
+        return tables
+    if os.path.exists(os.path.join(path, "schema.json")):
+        with open(os.path.join(path, "schema.json")) as f:
+            schema = json.load(f)
+        return {table: {col: np.load(os.path.join(path, table, f"{col}.npy"), mmap_mode="r" if mmap else None)
+                        for col in cols} for table, cols in schema.items()}
+    if not glob.glob(os.path.join(path, "*.parquet")):
+        raise ValueError(f"{path} has no schema.json and no parquet files, it is not a table directory")
+    import pyarrow.parquet
+    return {os.path.basename(fn)[:-len(".parquet")]: pyarrow.parquet.read_table(fn, memory_map=mmap)
+            for fn in sorted(glob.glob(os.path.join(path, "*.parquet")))}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="convert the NDJSON page records to columnar tables")
+    parser.add_argument("outpath", help="output directory (npy, parquet) or file (npz)")
+    parser.add_argument("ndjson", nargs="+", help="NDJSON files of ndjsonWriter, one per document")
+    parser.add_argument("--format", default="npy", choices=["npy", "npz", "parquet"], help="output format")
+    args = parser.parse_args(argv)
+    tables = ColumnarTables()
+    for path in args.ndjson:
+        tables.addNdjson(path)
+    outpath = tables.save(args.outpath, format=args.format)
+    counts = ", ".join(f"{len(cols[TABLES[table][0][0]])} {table}" for table, cols in tables.columns.items())
+    print(f"{counts} written to {outpath}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,44 @@
-## take the javascript diagram files, and generate standalone html files from them
+## take the javascript diagram files, and generate standalone html files from them.
+## makeBundle writes all the diagrams of a document to one html file: the libraries are included once, and the
+## script of a page is only run when the page is selected.
+## The diagrams are either generated scripts (fullProcess.jointDiagramScript) or json graphs
+## (fullProcess.jointDiagramGraph) that the static renderer joint_dia/templates/graphRenderer.js draws.
+##
+## usage: python -m src.diagram2html schema.pdf --outdir ./output --pages 1-20
+
+import argparse
+import contextlib
+import html
+import json
+import logging
 import os.path
+import sys
+
+import fitz
+
+## the css and javascript libraries of the diagrams
+styleAssets = """    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css" integrity="sha384-1BmE4kWBq78iYhFldvKuhfTAU6auU8tT94WrHftjDbrCEXSU1oBoqyl2QvZ6jIW3" crossorigin="anonymous">
+    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js" integrity="sha384-ka7Sk0Gln4gmtz2MlQnikT1wXgYsOg+OMhuP+IlRH9sENBO0LRn5q+8nbTov4+1p" crossorigin="anonymous"></script>
+"""
+scriptAssets = """<script src="https://cdnjs.cloudflare.com/ajax/libs/jquery/3.6.0/jquery.js"></script>
+<script src="https://cdnjs.cloudflare.com/ajax/libs/lodash.js/4.17.21/lodash.js"></script>
+<script src="https://cdnjs.cloudflare.com/ajax/libs/backbone.js/1.4.0/backbone.js"></script>
+<script src="https://cdnjs.cloudflare.com/ajax/libs/jointjs/3.5.5/joint.js"></script>
+"""
 
 header = """ <!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
     <title>Digiaktiv Model Processing Demo</title>
-    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css" integrity="sha384-1BmE4kWBq78iYhFldvKuhfTAU6auU8tT94WrHftjDbrCEXSU1oBoqyl2QvZ6jIW3" crossorigin="anonymous">
-    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js" integrity="sha384-ka7Sk0Gln4gmtz2MlQnikT1wXgYsOg+OMhuP+IlRH9sENBO0LRn5q+8nbTov4+1p" crossorigin="anonymous"></script>
-</head>
+""" + styleAssets + """</head>
 <body>
 
     <div class = "w-120 container-fluid">
         <h3 id = "title"> Title of the diagram </h3>
         <div class="w-75" id="paper"> </div>
     </div>
-<script src="https://cdnjs.cloudflare.com/ajax/libs/jquery/3.6.0/jquery.js"></script>
-<script src="https://cdnjs.cloudflare.com/ajax/libs/lodash.js/4.17.21/lodash.js"></script>
-<script src="https://cdnjs.cloudflare.com/ajax/libs/backbone.js/1.4.0/backbone.js"></script>
-<script src="https://cdnjs.cloudflare.com/ajax/libs/jointjs/3.5.5/joint.js"></script>
-
+""" + scriptAssets + """
 <script>"""
 
 footer = """ </script>
@@ -35,11 +54,141 @@ def makeHtml(jsfile = "C:/Users/BuruzsA/PycharmProjects/diagram2model/webapp/sta
     with open(outfile, "w") as text_file:
         text_file.write(htmltext)
 
-if __name__ == "__main__":
-    diagpath = "C:/Users/BuruzsA/PycharmProjects/diagram2model/webapp/static/uploads/diagrams/"
-    jsfilens = os.listdir(diagpath)
-    for jsfile in jsfilens:
-        jsfilep = os.path.join(diagpath, jsfile)
-        makeHtml(jsfilep)
+_renderer = None
 
+def rendererScript():
+    """ the static renderer of the diagram graphs, renderDiagramGraph(data, paperElement) """
+    global _renderer
+    if _renderer is None:
+        from src.fullProcess import RENDERER_SCRIPT
+        with open(RENDERER_SCRIPT, encoding="utf-8") as f:
+            _renderer = f.read()
+    return _renderer
 
+def graphJson(graph):
+    """ json text of a diagram graph that can be put in a script element """
+    return json.dumps(graph, separators=(",", ":")).replace("</", "<\\/")
+
+def graphHtml(graph):
+    """ standalone html page of a diagram graph of fullProcess.jointDiagramGraph """
+    return (header + rendererScript() + "\nrenderDiagramGraph(" + graphJson(graph) +
+            ", document.getElementById('paper'));\n" + footer)
+
+bundleHeader = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>{title}</title>
+""" + styleAssets + """</head>
+<body>
+    <div class = "w-120 container-fluid">
+        <select class="form-select w-25 my-2" id="pageSelect">
+{options}
+        </select>
+        <h3 id = "title"> Title of the diagram </h3>
+        <div class="w-75" id="paper"> </div>
+    </div>
+""" + scriptAssets
+
+## shows the selected page: the paper element is replaced by an empty one, and the script of the page is run,
+## or its graph is rendered
+bundleLoader = """<script>
+    function showPage(id) {
+        var old = document.getElementById('paper');
+        var paper = old.cloneNode(false);
+        old.parentNode.replaceChild(paper, old);
+        var chunk = document.getElementById(id);
+        if (chunk.type === 'application/json') {
+            renderDiagramGraph(JSON.parse(chunk.textContent), paper);
+        } else {
+            new Function(chunk.textContent)();
+        }
+    }
+    var select = document.getElementById('pageSelect');
+    select.addEventListener('change', function () { showPage(select.value); });
+    if (select.value) { showPage(select.value); }
+</script>
+</body>
+</html>
+"""
+
+
+def makeBundle(diagrams, outfile, title="Diagrams"):
+    """ write the diagrams of a document to one html file. The script of a page is kept as a data chunk
+    (a script element that the browser does not run), and run when the page is selected.
+    :param diagrams: list of (page name, jointjs script or diagram graph), see fullProcess.jointDiagramScript and
+        fullProcess.jointDiagramGraph
+    :param outfile: the html file
+    """
+    options = "\n".join(f'            <option value="diagram-{i}">{html.escape(name)}</option>'
+                        for i, (name, diagram) in enumerate(diagrams))
+    chunks = []
+    for i, (name, diagram) in enumerate(diagrams):
+        if isinstance(diagram, dict):
+            chunks.append(f'<script type="application/json" id="diagram-{i}">{graphJson(diagram)}</script>\n')
+        else:
+            script = diagram.replace("</", "<\\/")  # the chunk must not close its script element
+            chunks.append(f'<script type="application/x-diagram" id="diagram-{i}">\n{script}\n</script>\n')
+    with open(outfile, "w", encoding="utf-8") as f:
+        f.write(bundleHeader.format(title=html.escape(title), options=options))
+        if any(isinstance(diagram, dict) for name, diagram in diagrams):
+            f.write(f"<script>\n{rendererScript()}</script>\n")
+        f.writelines(chunks)
+        f.write(bundleLoader)
+    return outfile
+
+
+def renderBundle(doc, outfile, pages=None, title="Diagrams", format="json", **params):
+    """ process the pages of a document, and write their diagrams to one html bundle
+    :param doc: fitz document
+    :param pages: list of page numbers (starting from 1), default: all
+    :param format: "json": diagram graphs drawn by the static renderer, "js": generated diagram scripts
+    :param params: parameters of fullProcess.processPage
+    :return: list of (page number, error message) of the pages without diagram
+    """
+    from src import fullProcess
+    diagrams = []
+    failed = []
+    for pagenum in (pages or range(1, doc.page_count + 1)):
+        try:
+            ifaces, controls = fullProcess.processPage(doc, pagenum=pagenum, doplot=False, **params)
+            toDiagram = fullProcess.jointDiagramGraph if format == "json" else fullProcess.jointDiagramScript
+            diagrams.append((f"page {pagenum}", toDiagram(ifaces, controls, title=f"page {pagenum}")))
+        except Exception as e:
+            logging.exception(f"no diagram of page {pagenum}")
+            failed.append((pagenum, f"{type(e).__name__}: {e}"))
+    makeBundle(diagrams, outfile, title=title)
+    return failed
+
+
+def main(argv=None):
+    from src import baschema2model
+    parser = argparse.ArgumentParser(description="write the JointJS diagrams of the pages of BACS schema pdf files to "
+                                                 "one html file per document")
+    parser.add_argument("pdf", nargs="+", help="input pdf files")
+    parser.add_argument("--outdir", "-o", default="output", help="output directory, the bundles are written to "
+                                                                 "<outdir>/diagramHTML/<file>.html")
+    parser.add_argument("--pages", "-p", default=None, help='pages to render, for example "1-5,8" (default: all)')
+    parser.add_argument("--format", default="json", choices=["json", "js"],
+                        help="json: diagram graphs drawn by one static renderer, js: a generated script per page")
+    parser.add_argument("--verbose", "-v", action="store_true", help="keep the debug output of the processing")
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stdout)
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    os.makedirs(os.path.join(args.outdir, "diagramHTML"), exist_ok=True)
+    nfailed = 0
+    for inpfile in args.pdf:
+        fileTag = baschema2model.fileTagOf(inpfile)
+        outfile = os.path.join(args.outdir, "diagramHTML", f"{fileTag}.html")
+        with fitz.open(inpfile) as doc, open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            pages = baschema2model.parsePages(args.pages, doc.page_count)
+            failed = renderBundle(doc, outfile, pages=pages, title=fileTag, format=args.format,
+                                  **baschema2model.PAGE_PARAMS)
+        nfailed += len(failed)
+        print(f"{len(pages) - len(failed)} diagrams of {inpfile} written to {outfile}")
+    return 1 if nfailed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,10 +2,9 @@
 # from src import ALineReader
 from src import lineReader
 from src import readpdf
+from src.pageContext import getPageContext
+from src import plot_tools
 import fitz
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use("Qt5Agg")
 import math
 
 
@@ -17,34 +16,19 @@ def findWords(page, word):      #Returns a list of all rectangles that contain t
 
 def getSectionStrYLims(page, sectionString ="Regelstruktur", xmax = 1000, usemid = True):
     """ get the y coordinates for the Reglerstruktur part
+    :param page: fitz page or PageContext
     :param sectionString: the name of the section to search for, for example "Regelstruktur"
-    finds the y coordinates of the closest horizontal lines
+    finds the y coordinates of the closest horizontal lines.
+    The separators are indexed once per page, see sectionLayout.SectionLayout
+    :return: Y_before, Y_after and the sorted y values of all the separators
     """
-    allfinds = page.search_for(sectionString)
-    if allfinds.__len__() == 1:
-        label_Regel_coords = allfinds[0]
-    else :
-        print(f"multiple match found for {sectionString}:\n {allfinds}")
-        allfinds.sort(key=lambda r: r[0])
-        label_Regel_coords = [af for af in allfinds if af[0] < xmax][0]
-
-    print(f"coordinates of label {sectionString} : {label_Regel_coords}")
-    paths = page.get_drawings()
-    lines = lineReader.findLines(paths)
-    print
-    ## horizontal section divider lines
-    HSlines = [li for li in lines if (abs(li.endPoint[0] - li.startPoint[0]) > 25) & (min(li.startPoint[0] ,li.endPoint[0]) < 30)  ]
-    HSY = [li.startPoint[1] for li in HSlines]
-    if usemid : ## the pivot Y point: extracted from the label
-        Ylabel =  (label_Regel_coords[1] + label_Regel_coords[3])/2.0
-    else: # use the bottom-right point
-        Ylabel = label_Regel_coords[-1]
-    Y_after_Regel = min([yi for yi in HSY if yi > Ylabel])
-    Y_before_Regel = max([yi for yi in HSY if yi < Ylabel])
-    return Y_before_Regel, Y_after_Regel, HSY
+    layout = getPageContext(page).sectionLayout
+    Y_before_Regel, Y_after_Regel = layout.band(sectionString, xmax=xmax, usemid=usemid)
+    return Y_before_Regel, Y_after_Regel, layout.separatorsY
 
 
 if __name__ == "__main__":
+    plt = plot_tools.pyplot()
     file = "C:/Users/BuruzsA/Documents/projects/Digiaktiv/220621_Beispielschemen digiaktiv.pdf"
     pdf_file = fitz.open(file)
     print(f"opened a file with {pdf_file.page_count} pages")
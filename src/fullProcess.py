@@ -4,49 +4,92 @@
 
 import logging, sys
 
-logging.basicConfig(stream = sys.stdout, level = logging.DEBUG)
 import fitz
 
 # from src import ALineReader as lineReader
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use("Qt5Agg")
+from src import plot_tools
 from src import lineReader
 from src import hydraulicProcess
 from src import textlabels
 from src import lineConnects
 from src.readpdf import getSchemaNumber
+from src.pageContext import PageContext
 import json
-import jinja2
 import os
+import shutil
 
 
 class DataEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, np.ndarray):
             return obj.tolist()
+        if isinstance(obj, lineReader.LineArray):
+            return list(obj)
         if isinstance(obj, lineReader.line):
             return f"line: {np.round(np.array(obj.startPoint),4)} - {np.round(np.array(obj.endPoint),4)} s:{obj.style}"
         if isinstance(obj, np.int64):
             return int(obj)
         return json.JSONEncoder.default(self, obj)
 
-def processPage(doc, pagenum = 16, doplot= True):
+def processPage(doc, pagenum = 16, doplot= True, pixThreshold = 200, zoom_factor = 3, minRctglLen = 30,
+                precision = 0, minLegth = 20, rect_engine = "raster", thresholdProfile = None, trace = None):
     """ merge all functions for page processing
     :param pagenum: page number starting from 1
+    :param pixThreshold, zoom_factor, minRctglLen, rect_engine, thresholdProfile: parameters of the control diagram processing,
+     see lineConnects.processControlDiagram
+    :param precision, minLegth: parameters of the hydraulic schema processing, see hydraulicProcess.hydraulicConnections
+    :param trace: spanTrace.PageTrace, the time of the processing stages is recorded in it
 
     :returns:  ## interfaces : terminal points on top of the Regelstruktur part.
      all information extracted from the "Bezeichnung" and "Anlage" sections
       ## controls: the information extracted from the Regelstruktur part (block diagrams and connections)
     """
-    page = doc[pagenum-1]
-    controls = lineConnects.processControlDiagram(page, pixThreshold=200, zoom_factor=3, minRctglLen=30)
-    # controls["ctrlTerminals"] = lineConnects.label2ControlTerminals(controls["ctrlTerminals"], page)
-    hydrau = hydraulicProcess.hydraulicConnections(page, doplot= doplot, title =f"page {pagenum}",
-                                                   precision= 0, minLegth=20)
-    textLabels =  textlabels.getTextBlocks( page, section_label = "ezeichnung")
-    types = textlabels.getTextBlocksInSection(page, section_label= "Typ")
+    ## drawings, lines and text are extracted once, and shared by all the stages
+    ctx = PageContext(doc[pagenum-1], trace=trace)
+    trace = ctx.trace
+    with trace.span("page", page=pagenum):
+        stages = processStages(ctx, pagenum=pagenum, doplot=doplot, pixThreshold=pixThreshold,
+                               zoom_factor=zoom_factor, minRctglLen=minRctglLen, precision=precision,
+                               minLegth=minLegth, rect_engine=rect_engine, thresholdProfile=thresholdProfile)
+        with trace.span("interface matching"):
+            return matchInterfaces(stages["control diagram"], stages["hydraulics"], *stages["labelling"])
+
+## the independent processing stages of a page, their outputs are merged by matchInterfaces
+STAGES = ["control diagram", "hydraulics", "labelling"]
+
+def processStages(ctx, pagenum = 16, stages = STAGES, doplot= True, pixThreshold = 200, zoom_factor = 3,
+                  minRctglLen = 30, precision = 0, minLegth = 20, rect_engine = "raster", thresholdProfile = None):
+    """ run some of the processing stages of a page. The parameters are the same as of processPage
+    :param ctx: PageContext of the page
+    :param stages: names of the stages to run, see STAGES
+    :return: dict stage name -> output. "control diagram": the controls of lineConnects.processControlDiagram,
+     "hydraulics": the output of hydraulicProcess.hydraulicConnections, "labelling": (textLabels, types)
+    """
+    trace = ctx.trace
+    out = {}
+    if "control diagram" in stages:
+        with trace.span("control diagram"):
+            out["control diagram"] = lineConnects.processControlDiagram(ctx, pixThreshold=pixThreshold,
+                                                                        zoom_factor=zoom_factor,
+                                                                        minRctglLen=minRctglLen,
+                                                                        rect_engine=rect_engine,
+                                                                        thresholdProfile=thresholdProfile)
+    if "hydraulics" in stages:
+        with trace.span("hydraulics"):
+            out["hydraulics"] = hydraulicProcess.hydraulicConnections(ctx, doplot= doplot, title =f"page {pagenum}",
+                                                                      precision= precision, minLegth=minLegth)
+    if "labelling" in stages:
+        with trace.span("labelling", kind="sections"):
+            textLabels =  textlabels.getTextBlocks( ctx, section_label = "ezeichnung")
+            types = textlabels.getTextBlocksInSection(ctx, section_label= "Typ")
+            out["labelling"] = (textLabels, types)
+    return out
+
+def matchInterfaces(controls, hydrau, textLabels, types):
+    """ add the text labels, types and hydraulic connections to the interface terminals of the control diagram
+    :return: ifaces, controls
+    """
     ifaces = controls["interfaceTerminals"]
     ## The x positions of the vertical hydraulic Connectors
     hydraX = np.array([hi["lines"].startPoint[0] for hi in hydrau])
@@ -78,7 +121,7 @@ def processPage(doc, pagenum = 16, doplot= True):
 def plotControls(ifaces, controls, page):
     """ make a plot about extracted control blocks"""
     Xm, Ym = page.mediabox_size
-    fig, ax = plt.subplots(2, 1, gridspec_kw={'height_ratios': [3, 1]})
+    fig, ax = plot_tools.pyplot().subplots(2, 1, gridspec_kw={'height_ratios': [3, 1]})
     lineConnects.plotRectangles(ax[0], controls["rectangles"], Ymax=Ym, alpha=0.97)
     termPoints = np.array([ctp[0] for sublist in controls["ctrlTerminals"] for ctp in sublist])
     ax[0].scatter(termPoints[:, 0], Ym - termPoints[:, 1], s=8 ** 2, linewidths=3, marker="o", color="#111111",
@@ -106,10 +149,43 @@ def toText(ifaces, controls):
                          cls=DataEncoder)
     return outText
 
-def toJointDiagram(ifaces, controls, title = "", outfile = "../joint_dia/output/diagram.js"):
-    """create jointjs diagram from the interfaces and control blocks"""
-    environment = jinja2.Environment(loader=jinja2.FileSystemLoader("../joint_dia/templates/"))
-    template = environment.get_template("HMSRDiagram.j2") ## jinja template
+## directory of the jinja templates of the JointJS diagrams
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "joint_dia", "templates")
+
+## the jinja environment, created on the first use. It keeps the compiled templates
+_jinjaEnvironment = None
+
+def getTemplate(name = "HMSRDiagram.j2"):
+    """ the compiled jinja template. It is loaded and compiled once per process, the template files are not checked
+    for changes """
+    global _jinjaEnvironment
+    if _jinjaEnvironment is None:
+        import jinja2
+        _jinjaEnvironment = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATE_DIR), auto_reload=False)
+    return _jinjaEnvironment.get_template(name)
+
+## the static renderer of the diagram graphs of jointDiagramGraph
+RENDERER_SCRIPT = os.path.join(TEMPLATE_DIR, "graphRenderer.js")
+
+def toJointDiagram(ifaces, controls, title = "", outfile = "../joint_dia/output/diagram.js", format = "js"):
+    """create jointjs diagram from the interfaces and control blocks, and write it to outfile
+    :param format: "js": the generated diagram script, "json": the diagram graph of jointDiagramGraph, the renderer
+        script graphRenderer.js is copied next to it
+    """
+    if format == "json":
+        content = json.dumps(jointDiagramGraph(ifaces, controls, title = title), separators=(",", ":"))
+        renderer = os.path.join(os.path.dirname(os.path.abspath(outfile)), os.path.basename(RENDERER_SCRIPT))
+        ## copied every time: a renderer of an older version may not draw the current graph format
+        shutil.copyfile(RENDERER_SCRIPT, renderer)
+    else:
+        content = jointDiagramScript(ifaces, controls, title = title)
+    #outfile = f"./joint_dia/output/{outfile}"
+    with open(outfile, mode="w", encoding="utf-8") as message:
+        message.write(content)
+        print(f"... wrote {outfile}")
+
+def diagramInputs(ifaces, controls):
+    """ the inputs of the diagram template: hydroNames, textLabels, ctrlBlocks, IBconnects, IBLcon, CCconnects """
     hydroNames =  [ " ".join( ifa["hydraulic"]["mergedFirstLabels"]  ).replace("\n", ":") for ifa in ifaces]
     textLabels =  [ "<" + " ".join(ifa["labelHeader"]).replace("\n", " ") + ">\\n" +
                     " ".join(ifa["matchingLabels"]).replace("\n", "\\n") + "\\n" +
@@ -136,21 +212,44 @@ def toJointDiagram(ifaces, controls, title = "", outfile = "../joint_dia/output/
     # CCconnects = [vl for sublist in conTmp for vl in sublist]
     CCconnects = [(coni[0], coni[2]) for coni in controls['ctrl2ctrlConnections'] if
                   (coni[1][0] == "y") or (coni[3][0] in ["x", "w"])]  # input label is only x.. or w..
-    content = template.render(hydroNames = hydroNames, textLabels = textLabels,
-                              ctrlBlocks = ctrlBlocks,
-                              IBconnects = IBconnects,
-                              IBLcon = IBLCoded,
-                              CCconnects = CCconnects,
-                              title = title)
+    return dict(hydroNames = hydroNames, textLabels = textLabels,
+                ctrlBlocks = ctrlBlocks,
+                IBconnects = IBconnects,
+                IBLcon = IBLCoded,
+                CCconnects = CCconnects)
 
-    #outfile = f"./joint_dia/output/{outfile}"
-    with open(outfile, mode="w", encoding="utf-8") as message:
-        message.write(content)
-        print(f"... wrote {outfile}")
+def jointDiagramScript(ifaces, controls, title = ""):
+    """ the jointjs diagram script of the interfaces and control blocks """
+    template = getTemplate("HMSRDiagram.j2") ## jinja template
+    return template.render(title = title, **diagramInputs(ifaces, controls))
 
+def jointDiagramGraph(ifaces, controls, title = ""):
+    """ the diagram of jointDiagramScript as data, for the static renderer graphRenderer.js. The size of the graph
+    grows with the number of elements, not with the code to create them.
+    :return: {"title", "width", "height", "nodes": [[shape, x, y, width, height, label], ..],
+              "links": [[source node, target node, style], ..]}
+        shape 0: hydraulic name, 1: interface text label, 2: control block.
+        style 0: hydraulic - interface, 1: interface - control block, 2: control block - control block
+    """
+    inputs = diagramInputs(ifaces, controls)
+    hydroNames, textLabels = inputs["hydroNames"], inputs["textLabels"]
+    ## same positions and sizes as in HMSRDiagram.j2, the shapes start at (100, 100)
+    nodes = [[0, 100 + 100 * i, 100, 100, 70, hn] for i, hn in enumerate(hydroNames)]
+    nodes += [[1, 100 + 100 * i, 350] + ([120, 140] if len(tl) > 60 else [90, 120]) + [tl.replace("\\n", "\n")]
+              for i, tl in enumerate(textLabels)]
+    nodes += [[2, round(110 + 600 * float(bx), 1), round(550 + 100 * float(by), 1), 50, 40, f"Cont_{i}: {lab}"]
+              for i, (bx, by, lab) in enumerate(inputs["ctrlBlocks"])]
+    firstLabel, firstBlock = len(hydroNames), len(hydroNames) + len(textLabels)
+    links = [[i, firstLabel + i, 0] for i in range(len(textLabels))]
+    for iface, block, direction in inputs["IBLcon"]:
+        ends = [firstLabel + int(iface), firstBlock + int(block)]
+        links.append((ends if direction == "IN" else ends[::-1]) + [1])
+    links += [[firstBlock + int(c0), firstBlock + int(c1), 2] for c0, c1 in inputs["CCconnects"]]
+    return {"title": title, "width": 200 * len(hydroNames), "height": 800, "nodes": nodes, "links": links}
 
-if __name__ == "__main__":
 
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stdout, level = logging.DEBUG)
     loop = False
     #inpfile = "C:/Users/BuruzsA/Documents/projects/Digiaktiv/WSCAD_Examples/220621_Beispielschemen digiaktiv.pdf"
     #inpfile = "C:/Users/BuruzsA/PycharmProjects/diagram2model/webapp/static/uploads/pages/2022-12-15-2123.pdf"
@@ -192,6 +291,5 @@ if __name__ == "__main__":
                 mat = fitz.Matrix(0.2,0.2)
                 pix = page.get_pixmap(matrix=mat)  # render page to an image
                 pix.save(f"./webapp/static/uploads/icons/{fileTag}-p{pagenum}.png")
-            except:
-                logging.error(f"Error on page {pagenum }")
-                logging.error(sys.exc_info() )
+            except Exception:
+                logging.exception(f"Error on page {pagenum }")
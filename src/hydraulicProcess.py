@@ -3,40 +3,33 @@
 
 import logging, sys
 
-from src import exportRegelStruktur
+from src import exportRegelStruktur, plot_tools
 
-logging.basicConfig(stream = sys.stdout, level = logging.DEBUG)
 import fitz
 import src.lineReader as lineReader
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use("Qt5Agg")
 from time import time
 from src import lineConnects
+from src.pageContext import getPageContext
+from src.textIndex import TextIndex
 
 
 def text2Points(page, pointsXY: np.array, ymin = None, ymax = None, Nret = 3  ):
-    """ Get closest text-boxes to points
-    :param pointsXY: a numpy array with points X and Y coordinates.
+    """ Get closest text-boxes to points. All points are queried at once from a textIndex.TextIndex of the text-boxes.
+    :param page: fitz page or PageContext
+    :param pointsXY: a numpy array (or list) with points X and Y coordinates.
     :param ymin- max: filter the text-boxes to this range
     :param Nret: the number of closest points to return
-    :return: for each point return the closest text-boxes
+    :return: for each point return the closest text-boxes, list of (text, distance) tuples
     """
-    paths = page.get_drawings()
-    textBlocks0 = page.get_text("blocks")
-    textBlocks = [tb for tb in textBlocks0 if (tb[1] >= ymin) & (tb[1] < ymax) & (
-        any(i.isalnum() for i in tb[4].replace("\n", " ")))]
-    # center points of the text-boxes
-    textCorners = np.array([tb[0:4] for tb in  textBlocks])
-    textCenters = np.stack( (textCorners[:,[0,2]].mean(axis = 1), textCorners[:,[1,3]].mean(axis = 1)), axis = 1 )
-    closestLabels = []
-    for xy in pointsXY:
-        distance = np.linalg.norm( np.abs(textCenters - xy), axis = 1)
-        closest_ix = np.where( distance == min(distance))[0]
-        closestN = np.argsort(distance) [0:Nret]
-        closestLabels.append( [ ( textBlocks[ix][4], distance[ix] ) for ix in  closestN ])
-    return closestLabels
+    textBlocks0 = getPageContext(page).textBlocks
+    textIndex = TextIndex([tb for tb in textBlocks0 if (tb[1] >= ymin) & (tb[1] < ymax) & (
+        any(i.isalnum() for i in tb[4].replace("\n", " ")))])
+    pointsXY = np.array(pointsXY, dtype=float).reshape(-1, 2)
+    dist, closestN = textIndex.nearest(pointsXY, k=Nret)
+    # distances of the selected text-box centers
+    distance = np.linalg.norm(textIndex.centers[closestN] - pointsXY[:, None, :], axis=2)
+    return [[(textIndex.items[ix][4], di) for ix, di in zip(ixs, dis)] for ixs, dis in zip(closestN, distance)]
 
 
 def hydraulicConnections(page, doplot = True, title = "page xy", precision= 3,
@@ -46,7 +39,9 @@ def hydraulicConnections(page, doplot = True, title = "page xy", precision= 3,
 
     :param vhconTol: tolerance of vertical-horizontal line connections
     :param minLegth: minimum length of the vertical dashed lines, otherwise the line is omitted
-    :param precision: used for vertical/horizontal dashed line detection.´
+    :param page: fitz page or PageContext
+    :param precision: used for vertical/horizontal dashed line detection: lines closer than 0.5 * 10^-precision
+     are aligned. see lineReader.mergeDashedLines
     :param doplot: if true, a visualization of the detected components and keypoints are visualized. useful for debugging
     :return: topPoints: the top endpoint of the big vertical lines. THe component might be here.
     VerticalMatchpoint : the vertical line might continue in an elbow and end in an other point (vertical matchpoint),
@@ -54,30 +49,26 @@ def hydraulicConnections(page, doplot = True, title = "page xy", precision= 3,
     """
 
     ## TODO: process rectangular corners, and vertical dashed lines, and build up connections with the vertical dashed lines
-    Xm, Ym = page.mediabox_size
-    paths = page.get_drawings()
-    lineList = lineReader.findLines(paths) #lines from pdf
+    ctx = getPageContext(page)
+    Xm, Ym = ctx.mediabox_size
+    paths = ctx.drawings
+    lineList = ctx.lines #lines from pdf
 
     ## todo: filter the lines of the Hydraulic schema:
-    Y_before, Y_after, HSY = exportRegelStruktur.getSectionStrYLims(page, "Anlage", xmax = 200)
+    Y_before, Y_after = ctx.sectionLayout.band("Anlage", xmax = 200)
     ## page.search_for(sectionString)
     print(f"Hydraulic schema in range y = [{Y_before} - {Y_after}]")
-    linesOfSchema = [li for li in lineList if (li.startPoint[1] > Y_before) & (li.startPoint[1] < Y_after) ]
+    linesOfSchema = lineList[lineList.bandMask(Y_before, Y_after)]
 
-    ## get the vertical lines:
-    verticalLDict = lineReader.convertLines(
-                    lineReader.sortDict(
-                        lineReader.findCorrespondingLines(
-                            linesOfSchema, xOrY=False, precision= precision)), xOrY=False, spacing = 22)
-    horizontalLDict = lineReader.convertLines(
-                    lineReader.sortDict(
-                        lineReader.findCorrespondingLines(
-                            linesOfSchema, xOrY=True, precision= precision)), xOrY=True)
+    ## get the vertical and horizontal lines, short aligned lines are merged:
+    alignTol = 0.5 * 10 ** (-precision)
+    verticalRuns, vDashes = lineReader.mergeDashedLines(linesOfSchema, xOrY=False, spacing=22, tol=alignTol)
+    horizontalRuns, hDashes = lineReader.mergeDashedLines(linesOfSchema, xOrY=True, tol=alignTol)
     ### selecting the dashed vertical lines
-    #[vi.startPoint[0] == vi.endPoint[0] for ki, vi in verticalDictx.items()]
-    dashedV_lines = list({ ki:vi for (ki, vi) in verticalLDict.items() if vi.style == "dashed"}.values() )
+    isDashed = lineReader.LineArray.STYLES.index("dashed")
+    dashedV_lines = list(verticalRuns[verticalRuns.style == isDashed])
     ## TODO: detect horizontal lines, and check if endpoints are close to Top-Popints of the vertical lines. if yes they are candidates of connections
-    dashedH_lines = list({ki: vi for (ki, vi) in horizontalLDict.items() if vi.style == "dashed"}.values())
+    dashedH_lines = list(horizontalRuns[horizontalRuns.style == isDashed])
 
     ## TODO: sometimes paths in the pdf are dashed lines itself!
     biglen = 70
@@ -96,7 +87,7 @@ def hydraulicConnections(page, doplot = True, title = "page xy", precision= 3,
     dashedH_lines = dashedH_lines + [dh for dh in dashedLongLines if abs(dh.endPoint[1] - dh.startPoint[1]) < tol]
 
     if doplot:
-        fig, ax = plt.subplots(2,1, gridspec_kw={'height_ratios': [6, 1]})
+        fig, ax = plot_tools.pyplot().subplots(2,1, gridspec_kw={'height_ratios': [6, 1]})
         #fig, ax = plt.subplots(1, 1 )
         lineConnects.plotLines(ax[0], linesOfSchema, Ymax=Ym, col="#333333", alpha=0.4, annotate=False)
         lineConnects.plotLines(ax[0], dashedV_lines, Ymax=Ym, col="#BB1111", alpha=0.8, annotate=True)
@@ -148,8 +139,14 @@ def hydraulicConnections(page, doplot = True, title = "page xy", precision= 3,
         for tp in range(len(topPoints)):
             xmid, ymid = topPoints[tp]
             ax[0].text(xmid, Ym - ymid, f"TopPoint_{tp}", style='italic', alpha=0.7, color="#333399")
-    labels2TopPoints = text2Points(page, topPoints, ymin = Y_before, ymax = Y_after )
-    labels2VertPoints = [ None if vmp is None else text2Points(page, [vmp], ymin = Y_before, ymax = Y_after )[0] for vmp in verticalMatchPoints]
+    ## one query for the top points and the vertical match points
+    vertIx = [i for i, vmp in enumerate(verticalMatchPoints) if vmp is not None]
+    labels2Points = text2Points(ctx, list(topPoints) + [verticalMatchPoints[i] for i in vertIx],
+                                ymin = Y_before, ymax = Y_after )
+    labels2TopPoints = labels2Points[:len(topPoints)]
+    labels2VertPoints = [None] * len(verticalMatchPoints)
+    for i, labels in zip(vertIx, labels2Points[len(topPoints):]):
+        labels2VertPoints[i] = labels
     ## look for closest label with "-" character starting
     mergedFirstLabels = []
     for i in range(len(labels2VertPoints)):
@@ -169,7 +166,8 @@ def hydraulicConnections(page, doplot = True, title = "page xy", precision= 3,
     return out
 
 if __name__ == "__main__":
-
+    logging.basicConfig(stream = sys.stdout, level = logging.DEBUG)
+    plt = plot_tools.pyplot()
     inpfile = "C:/Users/BuruzsA/Documents/projects/Digiaktiv/WSCAD_Examples/220621_Beispielschemen digiaktiv.pdf"
     doc = fitz.open(inpfile) #Opens the document from a given path
     # pnr = 3        #Page number (page 1 has index 0)
@@ -9,38 +9,38 @@
 
 # 4a define terminal points: inputTerminal : for the top vertical lines receiving inputs
 # 4b terminals for the control blocks (recognized rectangles). And remove lines within the rectangles.
-# find path (recursive function over the dict(line, [connected lines]) ) between terminals.
+# find path between terminals: the connected components (nets) of the line graph, see lineNets.
 import logging, sys
 
 from src import exportRegelStruktur
 
-logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 import fitz
 import src.lineReader as lineReader
 import math
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
-
-matplotlib.use("Qt5Agg")
 from src import straightLines
 from src import readpdf
-import cv2 as cv
+from src import plot_tools
+from src.pageContext import getPageContext
+from src.textIndex import TextIndex
 from time import time
 
 
 def regelstrukturY(page):
-    """Extract y coordinates of the Reglerstruktur part of the WSCAD pdf page """
-    label_Typ_coords = page.search_for("Typ")
-    Y_before_Regel, Y_after_Regel, HSY = exportRegelStruktur.getSectionStrYLims(page, "Regelstruktur")
+    """Extract y coordinates of the Reglerstruktur part of the WSCAD pdf page
+    :param page: fitz page or PageContext
+    """
+    ctx = getPageContext(page)
+    label_Typ_coords = ctx.search_for("Typ")
+    Y_before_Regel, Y_after_Regel = ctx.sectionLayout.band("Regelstruktur")
     y_top = math.ceil(label_Typ_coords[0].bottom_right.y) + 1
     try:
         print(f"Index position {Y_after_Regel}")
         y_bottom = math.floor(Y_after_Regel)
     except:
         print(f" anchor labels not found")
-        y_bottom = page.mediabox_size[1] - 67
-    print(f"medbox size {page.mediabox_size[1]}, Regelstruktur section between {y_top} - {y_bottom}")
+        y_bottom = ctx.mediabox_size[1] - 67
+    print(f"medbox size {ctx.mediabox_size[1]}, Regelstruktur section between {y_top} - {y_bottom}")
     return y_top, y_bottom
 
 
@@ -51,8 +51,9 @@ def plotLines(ax, lines, Ymax, col="#BB2355", alpha=0.5, annotate=False):
     :param Ym: mediabox size, max Y
     """
     t0 = time()
-    xvals = np.array([[li.startPoint[0], li.endPoint[0]] for li in lines]).transpose()
-    yvals = np.array([[Ymax - li.startPoint[1], Ymax - li.endPoint[1]] for li in lines]).transpose()
+    startPoints, endPoints = lineReader.endPointArrays(lines)
+    xvals = np.stack((startPoints[:, 0], endPoints[:, 0]))
+    yvals = Ymax - np.stack((startPoints[:, 1], endPoints[:, 1]))
     ax.plot(xvals, yvals, c=col, alpha=alpha)
     logging.info(f"{len(lines)} lines were plotted in {round(time() - t0, 3)} sec")
     if annotate:
@@ -68,7 +69,7 @@ def plotLines(ax, lines, Ymax, col="#BB2355", alpha=0.5, annotate=False):
     # if plotlabels:
     #     plt.text(np.array(xv).mean(),np.array(yv).mean(), li['seqno'],style='italic', alpha= 0.5, color = "grey" )
     # ax.invert_yaxis()
-    plt.tight_layout()
+    ax.figure.tight_layout()
 
 
 def plotRectangles(ax, rectangles: np.array, Ymax, col="#11AA55", alpha=0.7, showIx=True):
@@ -84,7 +85,7 @@ def plotRectangles(ax, rectangles: np.array, Ymax, col="#11AA55", alpha=0.7, sho
     if showIx:
         for ir in range(rectangles.shape[0]):
             ax.text(yinp[ir, 0] + 10, yinp[ir, 1] + 5, f"rect_{ir}", style='italic', alpha=0.5, color=col)
-    plt.tight_layout()
+    ax.figure.tight_layout()
 
 
 def getConnections(lines, tol=0.3):
@@ -108,34 +109,96 @@ def getConnections(lines, tol=0.3):
     return lineConnects, connectArr
 
 
+def getConnectionsCSR(lines, tol=0.3):
+    """ line connectivity as a sparse adjacency matrix in CSR format.
+    Two lines are connected, if one endpoint of them is closer than tol to one endpoint of the other.
+    The endpoints are hashed into a grid with tol sized cells, and only the points in the neighbouring cells
+    are compared, so it is not O(n^2) like the all-pairs distance calculation.
+
+    :param lines: LineArray or list of lines
+    :param tol: distance tolerance of the connecting endpoints
+    :return: indptr, indices integer arrays. The neighbours of line i are indices[indptr[i]:indptr[i+1]] (sorted)
+    """
+    nlines = len(lines)
+    if nlines == 0:
+        return np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    points = np.concatenate(lineReader.endPointArrays(lines))
+    owner = np.tile(np.arange(nlines), 2)  # the line index of each endpoint
+    cellSize = tol if tol > 0 else 1.0
+    cells = np.floor(points / cellSize).astype(np.int64)
+    cells -= cells.min(axis=0) - 1  # cell indices >= 1, so the neighbour cells are >= 0
+    K = cells[:, 1].max() + 2
+    keys = cells[:, 0] * K + cells[:, 1]
+    order = np.argsort(keys, kind="stable")
+    sortedKeys = keys[order]
+    rows, cols = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            ## range of the points in the neighbour cell (dx, dy) of each point
+            neighbourKeys = keys + dx * K + dy
+            lo = np.searchsorted(sortedKeys, neighbourKeys, side="left")
+            counts = np.searchsorted(sortedKeys, neighbourKeys, side="right") - lo
+            total = counts.sum()
+            if total == 0:
+                continue
+            a = np.repeat(np.arange(len(points)), counts)
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            b = order[np.repeat(lo, counts) + offsets]
+            close = np.linalg.norm(points[a] - points[b], axis=1) <= tol
+            rows.append(owner[a[close]])
+            cols.append(owner[b[close]])
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    pairs = np.unique(rows[rows != cols] * nlines + cols[rows != cols])  # sorted by row, then by column
+    indices = pairs % nlines
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(pairs // nlines, minlength=nlines))))
+    return indptr, indices
+
+
+def csr2ConnectDict(indptr, indices):
+    """ dictionary view of the CSR connectivity: {"l_<line index>": [connected line indices]}
+    only the lines with connections are in the dictionary
+    """
+    neighbours = np.split(indices, indptr[1:-1])
+    return {f"l_{i}": neighbours[i].tolist() for i in np.nonzero(np.diff(indptr))[0]}
+
+
+def lineNets(indptr, indices):
+    """ label the connected components (nets) of the line graph with union-find.
+    Two lines are on the same net, if they are connected through a chain of lines.
+
+    :param indptr, indices: CSR connectivity from getConnectionsCSR
+    :return: integer array with the net ID of every line (the index of a representative line of the net).
+        A line without connections is a net of its own.
+    """
+    nlines = len(indptr) - 1
+    parent = list(range(nlines))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]  # path halving
+            i = parent[i]
+        return i
+
+    rows = np.repeat(np.arange(nlines), np.diff(indptr))
+    upper = rows < indices  # every edge is stored in both directions
+    for a, b in zip(rows[upper].tolist(), indices[upper].tolist()):
+        ra, rb = root(a), root(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return np.array([root(i) for i in range(nlines)], dtype=np.int64)
+
+
 def getConnectionsFast(lines, tol=0.3):
     """ make a dictionary of line connections
     Two lines are connected, if they have common points.
     (TODO : what if 4 lines connects in a cross?) - it usually does not happen.
+    The connections are calculated by getConnectionsCSR.
+    :return: dictionary {"l_<line index>": [connected line indices]}, and list of connected line indices for each line
     """
-    t0 = time()
-    # if tol == 0:
-    #     return getConnections(lines, tol= 0)
-    # lineDict = dict(zip(range(lines.__len__),lines))
-    lineConnects = {}
-    connectArr = []
-    startPoints = np.array([li.startPoint for li in lines])
-    endPoints = np.array([li.endPoint for li in lines])
-    for li in range(len(lines)):
-        # lineConnects[li] = []
-        connectArr.append([])
-        start_dist = np.linalg.norm(startPoints - lines[li].startPoint, axis=1)
-        se_dist = np.linalg.norm(endPoints - lines[li].startPoint, axis=1)
-        es_dist = np.linalg.norm(startPoints - lines[li].endPoint, axis=1)
-        end_dist = np.linalg.norm(endPoints - lines[li].endPoint, axis=1)
-        smalldist = (start_dist <= tol) | (se_dist <= tol) | (es_dist <= tol) | (end_dist <= tol)
-        matching_index = [ix for ix in np.where(smalldist)[0] if ix != li]
-        for ki in matching_index:
-            if f"l_{li}" not in lineConnects:
-                lineConnects[f"l_{li}"] = []
-            lineConnects[f"l_{li}"].append(ki)
-            connectArr[-1].append(ki)
-    print(f"connections calculated in {time() - t0} sec")
+    indptr, indices = getConnectionsCSR(lines, tol=tol)
+    lineConnects = csr2ConnectDict(indptr, indices)
+    connectArr = [nb.tolist() for nb in np.split(indices, indptr[1:-1])] if len(lines) > 0 else []
     return lineConnects, connectArr
 
 
@@ -145,19 +208,12 @@ def interfaceTerminals(lines, topy):
     :return: lines crossing the topy, and it's indices in the lines list
     """
     horiz_tolerance = 5  # pixels
-    verticalLines = [li for li in lines if abs(li.startPoint[0] - li.endPoint[0]) < horiz_tolerance]
-    interfacemask = [(min(vi.startPoint[1], vi.endPoint[1]) < topy) & (max(vi.startPoint[1], vi.endPoint[1]) > topy) for
-                     vi in verticalLines]
-    vIx = np.where(interfacemask)[0]
-    verticalMask = [abs(li.startPoint[0] - li.endPoint[0]) < horiz_tolerance for li in lines]
-    cross_topy_mask = [(min(vi.startPoint[1], vi.endPoint[1]) < topy) & (max(vi.startPoint[1], vi.endPoint[1]) > topy)
-                       for vi in lines]
-    totalmask = np.array(verticalMask) & cross_topy_mask
-    totIx = np.where(totalmask)[0]
-    ## TODO: index in the total input
-    interfaceLines = [vi for vi in verticalLines if
-                      (min(vi.startPoint[1], vi.endPoint[1]) < topy) & (max(vi.startPoint[1], vi.endPoint[1]) > topy)]
-    interfaceLines = np.array(verticalLines)[interfacemask]
+    startPoints, endPoints = lineReader.endPointArrays(lines)
+    verticalMask = abs(startPoints[:, 0] - endPoints[:, 0]) < horiz_tolerance
+    cross_topy_mask = (np.minimum(startPoints[:, 1], endPoints[:, 1]) < topy) & (
+            np.maximum(startPoints[:, 1], endPoints[:, 1]) > topy)
+    totIx = np.where(verticalMask & cross_topy_mask)[0]
+    interfaceLines = [lines[ix] for ix in totIx]
     ## Top is the endpoint with the lower y value
     topPoint = lambda line: line.startPoint if (line.startPoint[1] < line.endPoint[1]) else line.endPoint
     interfacePoints = [topPoint(li) for li in interfaceLines]
@@ -201,175 +257,190 @@ def lineInRect(rect, line, tol):
         return True
 
 
-def controlTerminals(page, lines, rectangles=None, pixThr=250):
+def closeToRectangles(rects, points, tol=10):
+    """ closeToRectangle for all rectangle - point pairs at once
+    :param rects: array of rectangles, shape (R, 4)
+    :param points: array of points, shape (N, 2)
+    :return: boolean array of shape (R, N)
+    """
+    rectX_b, rectX_t = np.minimum(rects[:, 0], rects[:, 2])[:, None], np.maximum(rects[:, 0], rects[:, 2])[:, None]
+    rectY_b, rectY_t = np.minimum(rects[:, 1], rects[:, 3])[:, None], np.maximum(rects[:, 1], rects[:, 3])[:, None]
+    px, py = points[None, :, 0], points[None, :, 1]
+    ## point is close to a vertical side
+    close2vert = (py > rectY_b - tol) & (py < rectY_t + tol) & (
+                (abs(px - rectX_b) < tol) | (abs(px - rectX_t) < tol))
+    ## point is close to a horizontal side
+    close2hor = (px > rectX_b - tol) & (px < rectX_t + tol) & (
+                (abs(py - rectY_b) < tol) | (abs(py - rectY_t) < tol))
+    return close2hor | close2vert
+
+
+def linesInRects(rects, startPoints, endPoints, tol):
+    """ lineInRect for all rectangle - line pairs at once
+    :param rects: array of rectangles, shape (R, 4)
+    :param startPoints, endPoints: arrays of the line endpoints, shape (N, 2)
+    :return: boolean array of shape (R, N)
+    """
+    lo = np.minimum(startPoints, endPoints)[None, :, :]
+    hi = np.maximum(startPoints, endPoints)[None, :, :]
+    rectLo = np.minimum(rects[:, [0, 1]], rects[:, [2, 3]])[:, None, :]
+    rectHi = np.maximum(rects[:, [0, 1]], rects[:, [2, 3]])[:, None, :]
+    return np.all(lo >= rectLo - tol, axis=2) & np.all(hi <= rectHi + tol, axis=2)
+
+
+def controlTerminals(page, lines, rectangles=None, pixThr=250, compact=False):
     """Identify control blocks as rectangles, and extract line terminals.
+    All line endpoints are tested against all rectangles at once.
+    :param compact: return index arrays instead of the list of tuples
     :return: lines and endpoints which connects to a detected rectangle
      A list of lists for each rectangle for each terminal. For each terminal a tuple with
      (the point, the line- index, and the line object itself, and the rectangle )
+     With compact=True: a tuple of integer arrays (rectangle index, line index, endpoint: 0 = start, 1 = end),
+     in the same order as the tuples.
     """
     if rectangles is None:
         rectangles, rinfo = extractRectangles(page, pixThr=pixThr)
-    rectTerminals = []
     tol = 5
-    ## TODO remove lines that are inside rectangles!
-    for ri in rectangles:
-        rectTerminals.append([])
-        counter = 0
-        # print(f"ri to close2rect {ri}")
-        for li in lines:
-            if closeToRectangle(ri, li.startPoint, tol):
-                if not lineInRect(ri, li, tol=3):
-                    rectTerminals[-1].append((li.startPoint, counter, li, ri))
-                else:
-                    logging.debug(f"line is close {li}, but inside the rectangle, point skipped {ri}")
-            if closeToRectangle(ri, li.endPoint, tol):
-                if not lineInRect(ri, li, tol=3):
-                    rectTerminals[-1].append((li.endPoint, counter, li, ri))
-                else:
-                    logging.debug(f"line is close {li}, but inside the rectangle, point skipped {ri}")
-
-            counter += 1
+    rects = np.asarray(rectangles, dtype=float).reshape(-1, 4)
+    startPoints, endPoints = lineReader.endPointArrays(lines)
+    ## lines that are inside the rectangle are not terminals
+    inside = linesInRects(rects, startPoints, endPoints, tol=3)
+    ## shape (R, N, 2): rectangle, line, start/end point
+    close = np.stack((closeToRectangles(rects, startPoints, tol), closeToRectangles(rects, endPoints, tol)), axis=2)
+    isTerminal = close & ~inside[:, :, None]
+    logging.debug(f"{np.count_nonzero(close & inside[:, :, None])} line endpoints are close to a rectangle, "
+                  f"but inside it, skipped")
+    rectIx, lineIx, endIx = np.nonzero(isTerminal)
+    if compact:
+        return (rectIx, lineIx, endIx), rectangles
+    rectTerminals = [[] for ri in rectangles]
+    for r, l, e in zip(rectIx.tolist(), lineIx.tolist(), endIx.tolist()):
+        li = lines[l]
+        rectTerminals[r].append((li.endPoint if e else li.startPoint, l, li, rectangles[r]))
     return rectTerminals, rectangles
 
 def label2ControlTerminals(ctrlTerminals, page ):
     """ take the rectangle/control terminals, and find the closest text-boxes (labels) corresponding to the terminals
 
     :param ctrTerminals: control terminals, the "rectTerminals" output of controlTerminals function
-    :param page: fitz page
+    :param page: fitz page or PageContext
     :return: the controlterminals list with the label appended to each tuple
     """
-    Y_before, Y_after, HSY = exportRegelStruktur.getSectionStrYLims(page, "egelstruktur", xmax=150)
+    ctx = getPageContext(page)
+    Y_before, Y_after = ctx.sectionLayout.band("egelstruktur", xmax=150)
     # textBlocks0 = page.get_text("blocks")
     # textBlocks = [tb for tb in textBlocks0 if (tb[1] > Y_before) & (tb[1] < Y_after) & (
     #     any(i.isalnum() for i in tb[4].replace("\n", " ")))]
     # textDict0 = page.get_text("rawdict")
     # textDict = [tb for tb in textDict0["blocks"] if (tb['bbox'][1] > Y_before) & (tb['bbox'][1] < Y_after)]
-    textWords0 = page.get_text("words")
-    textWords = [tb for tb in textWords0 if (tb[1] > Y_before) & (tb[1] < Y_after)]
+    textIndex = ctx.wordIndex.inBand(Y_before, Y_after)
     ### TODO : from the textDict words could be extracted
-    textCenters = np.array([ [(tb[0]+tb[2])/2.0, (tb[1]+tb[3])/2.0]  for tb in textWords])
+    terminalPoints = np.array([cti[0] for ctBl in ctrlTerminals for cti in ctBl], dtype=float).reshape(-1, 2)
+    dist, matchix = textIndex.nearest(terminalPoints, k=1)
+    k = 0
     for kb, ctBl in enumerate(ctrlTerminals):
-        for kt , cti in enumerate(ctBl):
-            print(f"block {kb}, terminal position = {cti[0]}.")
-            dist2Text = np.linalg.norm(textCenters -cti[0], axis = 1)
-            matchix = np.argmin(dist2Text)
-            label = textWords[matchix][4]
-            print(f"found label {label}")
+        labels = []
+        for kt, cti in enumerate(ctBl):
+            label = textIndex.items[matchix[k, 0]][4] if matchix.shape[1] > 0 else None
             ctrlTerminals[kb][kt] = cti + (label,)
+            labels.append(label)
+            k += 1
+        logging.debug(f"block {kb} terminal labels {labels}")
     return ctrlTerminals
 
 
 
-def getTerminals(page, lines, connectDict, rectangles, topy):
+def interfaceNet(lineNet, ix):
+    """ net ID of the interface terminal line ix, or None if the line is not connected to other lines """
+    net = lineNet[ix]
+    if np.count_nonzero(lineNet == net) < 2:
+        return None
+    return net
+
+
+def getTerminals(page, lines, lineNet, rectangles, topy, pixThreshold=200):
     """ get interface and control terminals, and searching for connection
+    :param lineNet: net ID of each line, see lineNets
     :return : a dict with interfaceterminals as keys, and list of control blocks that are connected to this interface.
     """
     ifaceTerminals = interfaceTerminals(lines, topy)
-    ifaceConnections = []
     ctrlTerminals, rectangles = controlTerminals(page, lines, rectangles=rectangles, pixThr=pixThreshold)
-    iface2ctrl = {}
-    for fi, ifT in enumerate(ifaceTerminals):
-        print(f"terminal {ifT['terminalPoint']} connections are searched")
-        lMatch = []
-        ccls = findConnectedLines(connectDict, ix=ifT["index"], listMatches=lMatch)
-        ifaceConnections.append((ifT['terminalPoint'], lMatch))
-        iface2ctrl[fi] = []
-        for ii, cterm in enumerate(ctrlTerminals):
-            ctermLines = [ci[1] for ci in cterm]
-            isec = set(lMatch).intersection(set(ctermLines))
-            if isec.__len__() > 0:
-                iface2ctrl[fi].append(ii)
+    iface2ctrl = terminalConnections(ifaceTerminals, ctrlTerminals, lineNet)
     return iface2ctrl, ifaceTerminals, ctrlTerminals
 
-def terminalConnections(ifaceTerminals, ctrlTerminals, connectDict):
-    """ match interface terminals (input variable points) with control terminals"""
-    ifaceConnections = []
+def terminalConnections(ifaceTerminals, ctrlTerminals, lineNet):
+    """ match interface terminals (input variable points) with control terminals
+    :param lineNet: net ID of each line, see lineNets
+    """
     iface2ctrl = {}
     for fi, ifT in enumerate(ifaceTerminals):
         print(f"terminal {ifT['terminalPoint']} connections are searched")
-        lMatch = []
-        ccls = findConnectedLines(connectDict, ix=ifT["index"], listMatches=lMatch)
-        ifaceConnections.append((ifT['terminalPoint'], lMatch))
+        net = interfaceNet(lineNet, ifT["index"])
         iface2ctrl[fi] = []
         for ii, cterm in enumerate(ctrlTerminals):
-            ctermLines = [ci[1] for ci in cterm]
-            isec = set(lMatch).intersection(set(ctermLines))
-            if isec.__len__() > 0:
+            if any(lineNet[ci[1]] == net for ci in cterm):
                 iface2ctrl[fi].append(ii)
     return iface2ctrl
 
-def terminalConnectionsLabelled(ifaceTerminals, ctrlTerminals, connectDict):
+def terminalConnectionsLabelled(ifaceTerminals, ctrlTerminals, lineNet):
     """ match interface terminals (input variable points) with control terminals
     Also add the labels of the control terminals for example (x,y or w ). this is useful to determine if connection is
     input or output
+    :param lineNet: net ID of each line, see lineNets
     :return: for each interface a list of connected control terminals. & labels of the terminal connections
     """
-    ifaceConnections = []
     iface2ctrl = {}
     for fi, ifT in enumerate(ifaceTerminals):
         print(f"terminal {ifT['terminalPoint']} connections are searched")
-        lMatch = []
-        ccls = findConnectedLines(connectDict, ix=ifT["index"], listMatches=lMatch)
-        ifaceConnections.append((ifT['terminalPoint'], lMatch))
-        ## lMatch = index of the lines which are connected to the interface
+        net = interfaceNet(lineNet, ifT["index"])
         iface2ctrl[fi] = []
         for ii, cBlock in enumerate(ctrlTerminals):
             for cTerminal  in cBlock:
-                if cTerminal[1] in set(lMatch): # the index of the line of one of the terminals is matching the interface lines
+                if lineNet[cTerminal[1]] == net: # the line of the terminal is on the net of the interface
                     iface2ctrl[fi].append((ii, cTerminal[4])) ## append the Block index, and the terminal label
     return iface2ctrl
 
 
-def ctrl2ctrlConnections( ctrlTerminals, connectDict):
+def ctrl2ctrlConnections( ctrlTerminals, lineNet):
     """ find connections between control terminals
     :param ctrlTerminals: control block terminal points
-    :param connectDict: dictionary with lines as keys, and indices of connected lines (graph of the line-connections)
+    :param lineNet: net ID of each line, see lineNets
     """
-    # ifaceConnections = []
     ctrl2ctrl = []
     ## indices of lines connected to control blocks (one list per each ctrl block):
     linesOfBlocks = [ [ti[1] for ti in  cT] for cT in ctrlTerminals ]
+    ## nets of the terminal lines of each block
+    netsOfBlocks = [ set(lineNet[li] for li in lines) for lines in linesOfBlocks ]
     for fi, cB in enumerate(linesOfBlocks):
         logging.info(f"block {fi} connections are searched")
 
         ctrl2ctrl.append(np.array([]).astype(np.int64))
         for cT in cB: # cycle over all lines connected to block fi
-            lMatch = []
-            ccls = findConnectedLines(connectDict, ix=cT, listMatches=lMatch)
-            # ifaceConnections.append((ifT['terminalPoint'], lMatch))
-            ## the connected Blocks
-            lMatch.append(cT) ## add the line itself
             ## list of connected blocks
-            conBlocks = np.where([ set(lMatch).intersection(set(others)).__len__() for others in linesOfBlocks ])[0]
+            conBlocks = np.where([ lineNet[cT] in others for others in netsOfBlocks ])[0]
             conBlocks = conBlocks [ conBlocks != fi] # list of other block indices
             logging.info(f"block {fi} line {cT} connected to blocks {conBlocks} ")
             ctrl2ctrl[fi] = np.unique( np.concatenate((ctrl2ctrl[fi],conBlocks), axis = None))
     return ctrl2ctrl
 
-def ctrl2ctrlConnectionsLabelled( ctrlTerminals, connectDict):
+def ctrl2ctrlConnectionsLabelled( ctrlTerminals, lineNet):
     """ find connections between control terminals, and also store the labels of the terminals, that are used to determine the
     information flow direction
 
     :param ctrlTerminals: control block terminal points
-    :param connectDict: dictionary with lines as keys, and indices of connected lines (graph of the line-connections)
+    :param lineNet: net ID of each line, see lineNets
     """
-    # ifaceConnections = []
     ctrl2ctrlL = []
-    ## indices of lines connected to control blocks (one list per each ctrl block):
-    linesOfBlocks = [ [ti[1] for ti in  cT] for cT in ctrlTerminals ]
+    ## nets of the terminal lines of each block
+    netsOfBlocks = [ set(lineNet[ti[1]] for ti in cT) for cT in ctrlTerminals ]
     for fi, cB in enumerate(ctrlTerminals): # cycle over control blocks
         logging.info(f"block {fi} connections are searched")
         ctrl2ctrlL.append([])
         for cteri in cB: # cycle over all terminals of block fi
             cT = cteri[1] # the line of the control terminal
             termiLabel = cteri[4] # label of the terminal (x,y,w etc.)
-            lMatch = []
-            ccls = findConnectedLines(connectDict, ix=cT, listMatches=lMatch)
-            # ifaceConnections.append((ifT['terminalPoint'], lMatch))
-            ## the connected Blocks
-            lMatch.append(cT) ## add the line itself
             ## list of connected blocks
-            conBlocks = np.where([ set(lMatch).intersection(set(others)).__len__() for others in linesOfBlocks ])[0]
+            conBlocks = np.where([ lineNet[cT] in others for others in netsOfBlocks ])[0]
             conBlocks = conBlocks [ conBlocks != fi] # list of other block indices
             logging.info(f"block {fi} line {cT} connected to blocks {conBlocks} ")
             #ctrl2ctrlL[fi] = np.concatenate((ctrl2ctrlL[fi],(conBlocks, termiLabel) ), axis = None)
@@ -382,60 +453,91 @@ def text2Rectangles_old(page, rectangles, maxdist=50):
     """ find closest text boxes to the rectangles
     :return: a list of tuples for each rectangle: (rectangle-coords, list of matching text-boxes)
     """
-    textBlocks = page.get_text("blocks")
-    # textBlocks = [(ti['lines'], ti["bbox"]) for ti in textdict["blocks"]]
-    textMidpoints = [np.array([(tb[0] + tb[2]) / 2.0, (tb[1] + tb[3]) / 2.0]) for tb in textBlocks]
-    out = []
-    for ri in rectangles:
-        rimid = np.array([(ri[0] + ri[2]) / 2.0, (ri[1] + ri[3]) / 2.0])
-        width = abs(ri[2] - ri[0])
-        distances = ((textMidpoints - rimid) ** 2.0).sum(axis=1) ** 0.5
-        reldist = np.maximum(distances - width, 0)
-        closeTextIX = np.where(reldist < maxdist)[0]
-        # print(f"rectangle {ri} texts : \n {closeTextIX}")
-        matchingblocks = [textBlocks[i] for i in closeTextIX] if (closeTextIX.__len__() > 0) else []
-        # print(f"matching blocks {matchingblocks}")
-        out.append((ri, matchingblocks))
-    return out
+    textIndex = getPageContext(page).blockIndex
+    rects = np.array(rectangles, dtype=float).reshape(-1, 4)
+    rimids = np.column_stack(((rects[:, 0] + rects[:, 2]) / 2.0, (rects[:, 1] + rects[:, 3]) / 2.0))
+    widths = np.abs(rects[:, 2] - rects[:, 0])
+    ## max(distance - width, 0) < maxdist  <=>  distance < maxdist + width
+    closeTextIXs = textIndex.within(rimids, maxdist + widths)
+    return [(ri, [textIndex.items[i] for i in closeTextIX]) for ri, closeTextIX in zip(rectangles, closeTextIXs)]
 
 def text2Rectangles(page, rectangles, maxdist=50):
     """ find closest text boxes to the rectangles
-    :return: a list of tuples for each rectangle: (rectangle-coords, list of matching text-boxes)
+    :return: a list of tuples for each rectangle: (rectangle-coords, list of matching text-boxes,
+        list of the text-boxes inside the rectangle)
     """
-    textBlocks = page.get_text("words")
-    # textBlocks = [(ti['lines'], ti["bbox"]) for ti in textdict["blocks"]]
-    textMidpoints = [np.array([(tb[0] + tb[2]) / 2.0, (tb[1] + tb[3]) / 2.0]) for tb in textBlocks]
+    textIndex = getPageContext(page).wordIndex
+    rects = np.array(rectangles, dtype=float).reshape(-1, 4)
+    rimids = np.column_stack(((rects[:, 0] + rects[:, 2]) / 2.0, (rects[:, 1] + rects[:, 3]) / 2.0))
+    widths = np.abs(rects[:, 2] - rects[:, 0])
+    ## max(distance - width, 0) < maxdist  <=>  distance < maxdist + width
+    closeTextIXs = textIndex.within(rimids, maxdist + widths)
+    ## which textboxes are inside the rectangles?
+    insideIXs = textIndex.inside(rects)
     out = []
-    for ri in rectangles:
-        rimid = np.array([(ri[0] + ri[2]) / 2.0, (ri[1] + ri[3]) / 2.0])
-        width = abs(ri[2] - ri[0])
-        distances = ((textMidpoints - rimid) ** 2.0).sum(axis=1) ** 0.5
-        reldist = np.maximum(distances - width, 0)
-        closeTextIX = np.where(reldist < maxdist)[0]
-        # print(f"rectangle {ri} texts : \n {closeTextIX}")
-        matchingblocks = [textBlocks[i] for i in closeTextIX] if (closeTextIX.__len__() > 0) else []
-        # print(f"matching blocks {matchingblocks}")
-        ## which textboxes are inside the rectangle (r)?
-        textInside = lambda tb : (max(ri[0], ri[2]) > max(tb[0], tb[2])) & (min(ri[0],ri[2]) < min(tb[0], tb[2])) & \
-                                 (max(ri[1], ri[3]) > max(tb[1], tb[3])) & (min(ri[1],ri[3]) < min(tb[1], tb[3]))
-        textBlockInside = [tb for tb in textBlocks if textInside(tb)]
+    for ri, closeTextIX, insideIX in zip(rectangles, closeTextIXs, insideIXs):
+        matchingblocks = [textIndex.items[i] for i in closeTextIX]
+        textBlockInside = [textIndex.items[i] for i in insideIX]
         ## alternative: sort by distance
         out.append((ri, matchingblocks, textBlockInside))
     return out
 
 
-def extractRectangles(page, pixThr=250, minlen=30, tol=5, zoom_factor=3):
-    """ extract rectangles from the Regelstruktur based on pixel graphics representation"""
-    y_top, y_bottom = regelstrukturY(page)
-    im_pil, im_np = readpdf.extractPage2Pixels(pdfdoc=None, pagenum=None, page=page,
-                                               y_from=y_top / page.mediabox_size[1],
-                                               y_to=y_bottom / page.mediabox_size[1], zoom=zoom_factor)
-    gray = cv.cvtColor(im_np, cv.COLOR_BGR2GRAY)
+def extractRectangles(page, pixThr=250, minlen=30, tol=5, zoom_factor=3, line_engine="runs", antialias=True):
+    """ extract rectangles from the Regelstruktur based on pixel graphics representation
+    :param page: fitz page or PageContext
+    :param line_engine: extraction of the straight lines from the binary image, see straightLines.getLines
+    :param antialias: render the page with anti-aliasing, see readpdf.renderGray
+    """
+    gray, y_top = renderRegelstruktur(page, zoom_factor=zoom_factor, antialias=antialias)
+    return rectanglesFromGray(gray, y_top, pixThr=pixThr, minlen=minlen, tol=tol, zoom_factor=zoom_factor,
+                              line_engine=line_engine)
+
+
+def extractRectanglesSweep(page, thresholds=(200, 245), minlen=30, tol=5, zoom_factor=3, line_engine="runs",
+                           antialias=True):
+    """ extractRectangles with several gray thresholds: the page is rendered once, and the thresholds are tried
+    in the given order, until rectangles are found.
+    :param thresholds: pixel gray thresholds to try
+    :return: rectangles (None if not found with any threshold), info dict. info["pixThreshold"] is the threshold
+        that found the rectangles (None if not found)
+    """
+    gray, y_top = renderRegelstruktur(page, zoom_factor=zoom_factor, antialias=antialias)
+    trace = getPageContext(page).trace
+    for pixThr in thresholds:
+        with trace.span("rectangle detection", pixThreshold=pixThr):
+            rectangles, info = rectanglesFromGray(gray, y_top, pixThr=pixThr, minlen=minlen, tol=tol,
+                                                  zoom_factor=zoom_factor, line_engine=line_engine)
+        if rectangles is not None:
+            info["pixThreshold"] = pixThr
+            return rectangles, info
+        logging.error(f"no rectangles have been found with threshold= {pixThr}")
+    info["pixThreshold"] = None
+    return None, info
+
+
+def renderRegelstruktur(page, zoom_factor=3, antialias=True):
+    """ render the Regelstruktur section of the page to a grayscale image
+    :return: gray image, the y coordinate of the top of the image on the page
+    """
+    ctx = getPageContext(page)
+    y_top, y_bottom = regelstrukturY(ctx)
+    with ctx.trace.span("rasterization", zoom=zoom_factor):
+        gray = readpdf.renderGray(ctx, y_from=y_top / ctx.mediabox_size[1], y_to=y_bottom / ctx.mediabox_size[1],
+                                  zoom=zoom_factor, antialias=antialias)
+    return gray, y_top
+
+
+def rectanglesFromGray(gray, y_top, pixThr=250, minlen=30, tol=5, zoom_factor=3, line_engine="runs"):
+    """ rectangles of the rendered Regelstruktur image, see extractRectangles
+    :param gray: grayscale image from renderRegelstruktur
+    :param y_top: the y coordinate of the top of the image on the page
+    """
     edges = gray < pixThr
     # plt.figure()
     # plt.imshow(edges)
-    rectangles, slines = straightLines.getRectangles(edges, minlen=minlen,
-                                                     tol=tol)  # bottom_left, top_right corners in image coordinates
+    rectangles, slines = straightLines.getRectangles(edges, minlen=minlen, tol=tol,
+                                                     engine=line_engine)  # bottom_left, top_right corners in image coordinates
     print(f"rectangles from straightlines \n: {rectangles}")
     if rectangles.__len__() == 0:
         logging.info("no rectangle found")
@@ -452,32 +554,93 @@ def extractRectangles(page, pixThr=250, minlen=30, tol=5, zoom_factor=3):
     return rectScale, {'gray': gray, 'binedges': edges, 'straightLines': slines}
 
 
+def vectorRectangles(page, minlen=10, tol=1.0):
+    """ extract rectangles from the Regelstruktur based on the vector paths of the pdf, without rendering the page.
+    The control blocks are drawn as "re" or "qu" items, or as 4 lines (see straightLines.detecRectangles).
+
+    :param page: fitz page or PageContext
+    :param minlen: minimum side length of a rectangle in page units
+    :param tol: tolerance of the corner points in page units
+    :return: rectangles in the same format as extractRectangles: rows of [x_left, y_bottom, x_right, y_top]
+        (y_bottom > y_top), None if no rectangle found. And an info dict with the horizontal/vertical lines.
+    """
+    ctx = getPageContext(page)
+    y_top, y_bottom = regelstrukturY(ctx)
+    rects = []
+    for path in ctx.drawings:
+        if path.get("color") is None:  # only filled, no outline
+            continue
+        for item in path["items"]:
+            if item[0] == "re":
+                rects.append(tuple(item[1]))
+            elif (item[0] == "qu") and item[1].is_rectangular:
+                rects.append(tuple(item[1].rect))
+    ## rectangles drawn as separate lines
+    lines = ctx.lines
+    hvMask = (lines.horizontalMask() | lines.verticalMask()) & lines.lengthMask(minlen - tol)
+    hvMask &= (np.minimum(lines.y0, lines.y1) > y_top - tol) & (np.maximum(lines.y0, lines.y1) < y_bottom + tol)
+    hvLines = lines[hvMask]
+    ## left to right and top to bottom direction
+    hvCoords = np.column_stack((np.minimum(hvLines.x0, hvLines.x1), np.minimum(hvLines.y0, hvLines.y1),
+                                np.maximum(hvLines.x0, hvLines.x1), np.maximum(hvLines.y0, hvLines.y1)))
+    rects += [tuple(ri) for ri in straightLines.detecRectangles(hvCoords, tol=tol)]
+    rects = np.array(rects, dtype=float).reshape(-1, 4)
+    rects = np.column_stack((np.minimum(rects[:, 0], rects[:, 2]), np.minimum(rects[:, 1], rects[:, 3]),
+                             np.maximum(rects[:, 0], rects[:, 2]), np.maximum(rects[:, 1], rects[:, 3])))
+    ## inside the Regelstruktur band and the page (the rendered image is clipped to them)
+    keep = (rects[:, 1] > y_top - tol) & (rects[:, 3] < y_bottom + tol) & (rects[:, 0] > -tol) & (
+            rects[:, 2] < ctx.mediabox_size[0] + tol) & (
+            rects[:, 2] - rects[:, 0] > minlen) & (rects[:, 3] - rects[:, 1] > minlen)
+    rects = rects[keep]
+    rects = rects[np.lexsort((rects[:, 0], rects[:, 1]))]
+    ## remove the duplicates (the same block as an item and as lines)
+    keep_mask = np.ones(rects.shape[0], dtype=bool)
+    for i in range(1, rects.shape[0]):
+        if abs(rects[0:i, :][keep_mask[0:i]] - rects[i, :]).sum(axis=1).min(initial=np.inf) < 4 * tol:
+            keep_mask[i] = False
+    rects = rects[keep_mask]
+    print(f" {rects.shape[0]} rectangles from the vector paths \n: {rects}")
+    if rects.__len__() == 0:
+        logging.info("no rectangle found")
+        return None, {'straightLines': hvCoords}
+    return rects[:, [0, 3, 2, 1]], {'straightLines': hvCoords}
+
+
 def findMatchingLabel(textBlocks, xval, seplines=None):
-    """ find textblock (in Bezeichnung section) that matches an x value"""
-    textBlocks.sort(key=lambda tb: tb[0])  # sort by the starting x value
-    text_left = [tb for tb in textBlocks if tb[0] < xval]
+    """ find textblock (in Bezeichnung section) that matches an x value: the one starting last before xval
+    :param textBlocks: textIndex.TextIndex or list of text blocks
+    """
+    textIndex = textBlocks if isinstance(textBlocks, TextIndex) else TextIndex(textBlocks)
+    ix = textIndex.lastStartingBefore([xval])[0]
     ## TODO find the section string also (based on separation lines, dashed or solid!!)
-    return text_left[-1]
+    if ix < 0:
+        raise IndexError(f"no text block starts before x = {xval}")
+    return textIndex.items[ix]
 
 
-def findConnectedLines(connectDict, ix, listMatches=[]):
-    """ find elements that are connected with the one with index ix. using a recursion.
+def findConnectedLines(connectDict, ix, listMatches=None):
+    """ find elements that are connected with the one with index ix (depth first search).
+    To query many lines, label the nets once with lineNets instead.
 
     :param connectDict: a dictionary of line connections
-    :param ix: array of indices. find the connections to the elements with these indices.
-    :return: returns nothing, but fills the listMatches argument with the lines connected to line ix
-    """
-    ixkey = f'l_{ix}'
-    if not ixkey in connectDict:
-        return
-    neigbors = connectDict[f'l_{ix}']
-    if not neigbors:
-        print("no more neighbors")
-        return
-    for nix in neigbors:  # run over neighbor indices:
-        if not nix in listMatches:
-            listMatches.append(nix)
-            findConnectedLines(connectDict, nix, listMatches)
+    :param ix: find the connections to the element with this index.
+    :param listMatches: the lines connected to line ix are appended to this list
+    :return: listMatches
+    """
+    if listMatches is None:
+        listMatches = []
+    visited = set(listMatches)
+    stack = [iter(connectDict.get(f'l_{ix}', []))]
+    while stack:
+        for nix in stack[-1]:  # run over neighbor indices:
+            if nix not in visited:
+                visited.add(nix)
+                listMatches.append(nix)
+                stack.append(iter(connectDict.get(f'l_{nix}', [])))
+                break
+        else:
+            stack.pop()
+    return listMatches
 
 
 def getTextBlocks(lineList, section_label="ezeichnung"):
@@ -498,43 +661,60 @@ def getTextBlocks(lineList, section_label="ezeichnung"):
                  (li.endPoint[1] > (Y_after_bez - 10))]
 
 
-def processControlDiagram(page, pixThreshold=200, zoom_factor=3, minRctglLen=30):
+def processControlDiagram(page, pixThreshold=200, zoom_factor=3, minRctglLen=30, rect_engine="raster",
+                          thresholdProfile=None):
     """ The main function to do the Control diagram (= BACS function structure diagram see
     VDI 3814 Blatt 4.3 / Figure 1 / section 6.) processing at once
 
-    :param page: fitz page
+    :param page: fitz page or PageContext
     :param pixThreshold: used as threshold for the pixelgraphical processing to extract rectangles
     values between (white) 0 -255 (black)
     :param zoom_factor: used by converting the document from pdf to pixel image.
     It controls the resolution of the pixel-image.
     :param minRctglLen: minimum rectangle side length to be recognized as rectangle.
+    :param rect_engine: "raster": find the rectangles on the rendered image (extractRectanglesSweep),
+        "vector": from the vector paths of the pdf (vectorRectangles), the page is not rendered
+    :param thresholdProfile: thresholdProfile.ThresholdProfile of the document. If given, the gray thresholds of the
+        raster engine are taken from it, and the result of the page is recorded in it.
+        Otherwise pixThreshold is tried first, then 245.
     """
-    t0 = time()
-    Xm, Ym = page.mediabox_size
-    paths = page.get_drawings()
-    lineList = lineReader.findLines(paths)  # lines from pdf
+    ctx = getPageContext(page)
+    trace = ctx.trace
+    Xm, Ym = ctx.mediabox_size
+    lineList = ctx.lines  # lines from pdf
     # fLines, wLines = readpdf.getlines(doc, pnr)
     ## select lines of regelstruktur part:
-    y_top, y_bottom = regelstrukturY(page)
+    y_top, y_bottom = regelstrukturY(ctx)
     # startPoints = np.array([li.startPoint for li in lineList])
     ## lines of the Control block:
-    linesControl = [li for li in lineList if
-                    (li.startPoint[1] > y_top - 10) & (li.startPoint[1] < y_bottom) & (li.endPoint[1] < y_bottom + 10)]
+    linesControl = lineList[lineList.bandMask(y_top - 10, y_bottom) & (lineList.y1 < y_bottom + 10)]
     # lines45degree = [li for li in linesControl if abs(abs(
     #     (li.startPoint[0] - li.endPoint[0]) / (li.startPoint[1] - li.endPoint[1] + 1e-6)) - 1) < 0.1]
-    logging.info(f"lines loaded from pdf {round(time() - t0, 2)}s")
-    connectDict, connArr = getConnectionsFast(linesControl, tol=0.3)
-    logging.info(f"connections calculated {round(time() - t0, 2)}s")
-    ifaceTerminals = interfaceTerminals(linesControl, topy=y_top)
-    ## pixel image based straight line and rectangle detection
-    rectangles, info = extractRectangles(page, pixThr=pixThreshold, minlen=minRctglLen, tol=5, zoom_factor=zoom_factor)
-    if rectangles is None:
-        ## try again with higher pixel grayscale threshold:
-        logging.error(f"no rectangles have been found wth threshold= {pixThreshold}, "
-                      f"let's try with a higher threshold of {245}!")
-        rectangles, info = extractRectangles(page, pixThr=245, tol=5, zoom_factor=zoom_factor)
+    with trace.span("connectivity", lines=len(linesControl)):
+        indptr, indices = getConnectionsCSR(linesControl, tol=0.3)
+        connectDict = csr2ConnectDict(indptr, indices)
+        lineNet = lineNets(indptr, indices)
+    with trace.span("terminals", kind="interface"):
+        ifaceTerminals = interfaceTerminals(linesControl, topy=y_top)
+    if rect_engine == "vector":
+        ## minRctglLen is given in pixels of the zoomed image
+        with trace.span("rectangle detection", engine="vector"):
+            rectangles, info = vectorRectangles(ctx, minlen=minRctglLen / zoom_factor)
+    elif rect_engine == "raster":
+        ## pixel image based straight line and rectangle detection. The page is rendered once, if no rectangles are
+        ## found, a higher pixel grayscale threshold is tried on the same image
+        thresholds = list(dict.fromkeys([pixThreshold, 245])) if thresholdProfile is None \
+            else thresholdProfile.candidates()
+        rectangles, info = extractRectanglesSweep(ctx, thresholds=thresholds, minlen=minRctglLen, tol=5,
+                                                  zoom_factor=zoom_factor)
+        if thresholdProfile is not None:
+            thresholdProfile.record(info["pixThreshold"])
+    else:
+        raise ValueError(f"unknown rectangle engine {rect_engine}")
     if rectangles is not None:
-        ctrlTerminals, rectangles = controlTerminals(page, linesControl, rectangles=rectangles, pixThr=pixThreshold)
+        with trace.span("terminals", kind="control"):
+            ctrlTerminals, rectangles = controlTerminals(ctx, linesControl, rectangles=rectangles,
+                                                         pixThr=pixThreshold)
         # termPoints = np.array([ctp[0] for sublist in ctrlTerminals for ctp in sublist])
         # ax[0].scatter(termPoints[:, 0], Ym - termPoints[:, 1], s=8 ** 2, linewidths=3, marker="o", color="#111111",
         #               alpha=0.8)
@@ -542,23 +722,27 @@ def processControlDiagram(page, pixThreshold=200, zoom_factor=3, minRctglLen=30)
         # ax[0].scatter(ifTermPoints[:, 0], Ym - ifTermPoints[:, 1], s=7 ** 2, linewidths=3, marker="o",
         #               facecolors='none', edgecolor="#111199",
         #               alpha=0.8)
-        txt2rect = text2Rectangles(page, rectangles, maxdist=10)
-        txt2rect_filtered = []
-        for tr in txt2rect:
-            filteredTxtBlocks = [ti for ti in tr[1] if (ti[1] > y_top) & (ti[3] > y_top)]
-            txt2rect_filtered.append((tr[0], filteredTxtBlocks, tr[2])) # rectangles, labels around, and labels inside
-        textlabels = [ [ins[4] for ins in tf[2] ] + [tt[4].replace("\n", "") for tt in tf[1]] for tf in txt2rect_filtered]
+        with trace.span("labelling", kind="control blocks"):
+            txt2rect = text2Rectangles(ctx, rectangles, maxdist=10)
+            txt2rect_filtered = []
+            for tr in txt2rect:
+                filteredTxtBlocks = [ti for ti in tr[1] if (ti[1] > y_top) & (ti[3] > y_top)]
+                txt2rect_filtered.append((tr[0], filteredTxtBlocks, tr[2])) # rectangles, labels around, and labels inside
+            textlabels = [ [ins[4] for ins in tf[2] ] + [tt[4].replace("\n", "") for tt in tf[1]] for tf in txt2rect_filtered]
         logging.info(f"recognized text labels \n {textlabels}")
-        iface2ctrl = terminalConnections( ifaceTerminals, ctrlTerminals, connectDict)
-        ctrl2ctrl =  ctrl2ctrlConnections(ctrlTerminals, connectDict) ## connections between control blocks
-        ctrlTerminals = label2ControlTerminals(ctrlTerminals, page)
+        with trace.span("connections"):
+            iface2ctrl = terminalConnections( ifaceTerminals, ctrlTerminals, lineNet)
+            ctrl2ctrl =  ctrl2ctrlConnections(ctrlTerminals, lineNet) ## connections between control blocks
+        with trace.span("labelling", kind="control terminals"):
+            ctrlTerminals = label2ControlTerminals(ctrlTerminals, ctx)
         ## after labelled the terminals, get the connections and labels for directions:
-        ctrl2ctrlLabelled = ctrl2ctrlConnectionsLabelled(ctrlTerminals,
-                                                         connectDict)  ## connections between control blocks
-        iface2ctrlLabelled = terminalConnectionsLabelled(ifaceTerminals,
-                                                               ctrlTerminals,
-                                                               connectDict )
-        ctrl2ctrlCons = c2cConnections(ctrl2ctrlLabelled)
+        with trace.span("connections", kind="labelled"):
+            ctrl2ctrlLabelled = ctrl2ctrlConnectionsLabelled(ctrlTerminals,
+                                                             lineNet)  ## connections between control blocks
+            iface2ctrlLabelled = terminalConnectionsLabelled(ifaceTerminals,
+                                                                   ctrlTerminals,
+                                                                   lineNet )
+            ctrl2ctrlCons = c2cConnections(ctrl2ctrlLabelled)
         logging.info(f"interface-control block connections: \n{iface2ctrl}")
         return {"rectangles": rectangles, "text2rectangles": textlabels, "ctrlTerminals": ctrlTerminals,
                 "interfaceTerminals": ifaceTerminals, "linesOfControl" : linesControl,
@@ -585,7 +769,9 @@ def c2cConnections(ctrl2ctrlLabelled):
 
 
 if __name__ == "__main__":
-
+    import cv2 as cv
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    plt = plot_tools.pyplot()
     inpfile = "C:/Users/BuruzsA/Documents/projects/Digiaktiv/WSCAD_Examples/220621_Beispielschemen digiaktiv.pdf"
     doc = fitz.open(inpfile)  # Opens the document from a given path
     # pnr = 3        #Page number (page 1 has index 0)
@@ -624,6 +810,7 @@ if __name__ == "__main__":
                      abs(li.startPoint[1] - li.endPoint[1]) + abs(li.startPoint[0] - li.endPoint[0]) > 200]
         # connectDict_old, connArr_old = getConnections(linesControl)
         connectDict, connArr = getConnectionsFast(linesControl, tol=0.3)
+        lineNet = lineNets(*getConnectionsCSR(linesControl, tol=0.3))
         print(f"connections calculated {round(time() - t0, 2)}s")
         ## use the connectDict to find the connections between terminals!
         ## TODO: remove lines from connectDict, that are inside the rectangles!!
@@ -634,8 +821,8 @@ if __name__ == "__main__":
         textBlocks = page.get_text("blocks")
         textBlocks_filt = [tb for tb in textBlocks if (tb[1] > Y_before_bez) & (tb[1] < Y_after_bez) & (
             any(i.isalnum() for i in tb[4].replace("\n", " ")))]
-        textBlocks_filt.sort(key=lambda tb: tb[0])
-        iTermStrings = [findMatchingLabel(textBlocks_filt, it['terminalPoint'][0]) for it in ifaceTerminals]
+        bezIndex = TextIndex(textBlocks_filt)
+        iTermStrings = [findMatchingLabel(bezIndex, it['terminalPoint'][0]) for it in ifaceTerminals]
         [tb[4] for tb in textBlocks_filt]
         ###
         ifaceConnections = []
@@ -693,8 +880,8 @@ if __name__ == "__main__":
                 txt2rect_filtered.append((tr[0], filteredTxtBlocks))
             textlabels = [[tt[4].replace("\n", "") for tt in tf[1]] for tf in txt2rect_filtered]
             print(f"recognized text labels \n {textlabels}")
-            iface2ctrl = terminalConnections(ifaceTerminals, ctrlTerminals, connectDict)
-            iface2ctrlB, ifaceTerminals, ctrlTerminals = getTerminals(page, linesControl, connectDict, rectangles,
+            iface2ctrl = terminalConnections(ifaceTerminals, ctrlTerminals, lineNet)
+            iface2ctrlB, ifaceTerminals, ctrlTerminals = getTerminals(page, linesControl, lineNet, rectangles,
                                                                      topy=y_top)
             print(f"interface-control block connections: \n{iface2ctrl}")
         else:
@@ -140,18 +140,189 @@ class line:
             return self
 
 
-def findLines(paths) -> list:
+class LineArray:
+    """A set of lines stored column-wise in numpy arrays (struct of arrays).
+    Filters are vectorized boolean masks, and indexing with a mask or an index array returns a new LineArray.
+    Indexing with an integer, or iterating, returns line objects, for the code that works with single lines."""
+
+    ## the possible values of the line style, the style column stores the index in this tuple
+    STYLES = ("full", "dashed")
+
+    def __init__(self, x0, y0, x1, y1, width=None, color=None, style=None) -> None:
+        """Builds a LineArray from the coordinate columns
+
+        :param x0, y0, x1, y1: coordinates of the start and end points
+        :param width: line widths, NaN if unknown
+        :param color: array of shape (N, 3) with the [R, G, B] colors, NaN if unknown
+        :param style: array of style codes, index in LineArray.STYLES"""
+
+        self.x0 = np.asarray(x0, dtype=np.float64)
+        self.y0 = np.asarray(y0, dtype=np.float64)
+        self.x1 = np.asarray(x1, dtype=np.float64)
+        self.y1 = np.asarray(y1, dtype=np.float64)
+        n = len(self.x0)
+        self.width = np.full(n, np.nan) if width is None else np.asarray(width, dtype=np.float64)
+        self.color = np.full((n, 3), np.nan) if color is None else np.asarray(color, dtype=np.float64).reshape(n, 3)
+        self.style = np.zeros(n, dtype=np.uint8) if style is None else np.asarray(style, dtype=np.uint8)
+
+    @classmethod
+    def fromLines(cls, lines: list):
+        """Builds a LineArray from a list of line objects
+
+        :param lines: List of line objects
+        :return: LineArray"""
+
+        return cls([li.startPoint[0] for li in lines], [li.startPoint[1] for li in lines],
+                   [li.endPoint[0] for li in lines], [li.endPoint[1] for li in lines],
+                   [np.nan if li.width is None else li.width for li in lines],
+                   [[np.nan] * 3 if li.color is None else li.color for li in lines],
+                   [cls.STYLES.index(li.style) for li in lines])
+
+    @property
+    def startPoints(self) -> np.ndarray:
+        """:return: Array of the starting points, shape (N, 2)"""
+        return np.column_stack((self.x0, self.y0))
+
+    @property
+    def endPoints(self) -> np.ndarray:
+        """:return: Array of the ending points, shape (N, 2)"""
+        return np.column_stack((self.x1, self.y1))
+
+    def lineLengths(self) -> np.ndarray:
+        """:return: Array of the line lengths"""
+        return np.hypot(self.x1 - self.x0, self.y1 - self.y0)
+
+    def horizontalMask(self, tol: float = 0.0) -> np.ndarray:
+        """:param tol: maximum difference of the y coordinates (0: exactly horizontal, like line.isHorizontal)
+        :return: Boolean mask of the horizontal lines"""
+        return np.abs(self.y1 - self.y0) <= tol
+
+    def verticalMask(self, tol: float = 0.0) -> np.ndarray:
+        """:param tol: maximum difference of the x coordinates (0: exactly vertical, like line.isVertical)
+        :return: Boolean mask of the vertical lines"""
+        return np.abs(self.x1 - self.x0) <= tol
+
+    def lengthMask(self, minLength: float) -> np.ndarray:
+        """:return: Boolean mask of the lines longer than minLength"""
+        return self.lineLengths() > minLength
+
+    def bandMask(self, ymin: float, ymax: float) -> np.ndarray:
+        """:return: Boolean mask of the lines starting between the y values ymin and ymax (exclusive)"""
+        return (self.y0 > ymin) & (self.y0 < ymax)
+
+    def line(self, i: int) -> line:
+        """:return: Line object with the data of the i-th line"""
+        color = self.color[i]
+        width = self.width[i]
+        return line([float(self.x0[i]), float(self.y0[i])], [float(self.x1[i]), float(self.y1[i])],
+                    None if np.isnan(color).any() else tuple(color.tolist()),
+                    None if np.isnan(width) else float(width), style=self.STYLES[self.style[i]])
+
+    def toLines(self) -> list:
+        """:return: List of line objects"""
+        return [self.line(i) for i in range(len(self))]
+
+    def __len__(self) -> int:
+        return len(self.x0)
+
+    def __getitem__(self, ix):
+        """:param ix: integer -> line object. Slice, boolean mask or index array -> LineArray"""
+        if isinstance(ix, (int, np.integer)):
+            if ix < 0:
+                ix += len(self)
+            if not 0 <= ix < len(self):
+                raise IndexError(f"line index {ix} out of range")
+            return self.line(ix)
+        return LineArray(self.x0[ix], self.y0[ix], self.x1[ix], self.y1[ix], self.width[ix], self.color[ix],
+                         self.style[ix])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.line(i)
+
+
+def endPointArrays(lines):
+    """Start and end points of lines as arrays
+
+    :param lines: LineArray or list of line objects
+    :return: (start points, end points) arrays of shape (N, 2)"""
+
+    if isinstance(lines, LineArray):
+        return lines.startPoints, lines.endPoints
+    return (np.array([li.startPoint for li in lines], dtype=float).reshape(-1, 2),
+            np.array([li.endPoint for li in lines], dtype=float).reshape(-1, 2))
+
+
+def mergeDashedLines(lines: LineArray, xOrY: bool, spacing: float = 12, tol: float = 0.5, minDashes: int = 3):
+    """Merges the aligned short lines with small spacing into one line, vectorized version of the
+    findCorrespondingLines - sortDict - convertLines chain.
+    The lines are grouped by their coordinate across the line direction: sorted coordinates closer than tol belong to
+    the same group (unlike round(precision), that separates 11.14 and 11.15). Within a group the lines are sorted
+    along the line direction, and a new run starts where the gap to the previous line is not smaller than spacing.
+
+    :param lines: LineArray
+    :param xOrY: Boolean (False -> vertical / True -> horizontal)
+    :param spacing: Greater spacing allows to detect dashed lines with increased distance between the dashes
+    :param tol: maximum coordinate difference of the aligned lines
+    :param minDashes: runs with at least this number of lines get the style "dashed", the others "full"
+    :return: LineArray of the merged runs, and array with the number of lines (dashes) in each run.
+        The groups are in order of their first line in the input, the runs of a group are sorted along the group."""
+
+    sel = np.nonzero(lines.horizontalMask() if xOrY else lines.verticalMask())[0]
+    if xOrY:
+        across, along0, along1 = lines.y0[sel], lines.x0[sel], lines.x1[sel]
+    else:
+        across, along0, along1 = lines.x0[sel], lines.y0[sel], lines.y1[sel]
+    n = len(sel)
+    if n == 0:
+        return lines[sel], np.zeros(0, dtype=np.int64)
+    ## tolerance binning of the across coordinates
+    order = np.argsort(across, kind="stable")
+    groups = np.empty(n, dtype=np.int64)
+    groups[order] = np.concatenate(([0], np.cumsum(np.diff(across[order]) > tol)))
+    ## number the groups in order of their first appearance
+    firstIx = np.full(groups[order[-1]] + 1, n)
+    np.minimum.at(firstIx, groups, np.arange(n))
+    groupRank = np.argsort(np.argsort(firstIx))[groups]
+    ## sort by group, then along the line, then across
+    order = np.lexsort((across, along0, groupRank))
+    sel, groupRank, along0, along1 = sel[order], groupRank[order], along0[order], along1[order]
+    newRun = np.ones(n, dtype=bool)
+    newRun[1:] = (groupRank[1:] != groupRank[:-1]) | (np.abs(along0[1:] - along1[:-1]) >= spacing)
+    firsts = np.nonzero(newRun)[0]
+    lasts = np.append(firsts[1:] - 1, n - 1)
+    dashes = lasts - firsts + 1
+    first, last = sel[firsts], sel[lasts]
+    ## the run goes from the start of its first line to the end of the last one
+    if xOrY:
+        merged = LineArray(lines.x0[first], lines.y0[last], lines.x1[last], lines.y1[last],
+                           lines.width[last], lines.color[last])
+    else:
+        merged = LineArray(lines.x0[last], lines.y0[first], lines.x1[last], lines.y1[last],
+                           lines.width[last], lines.color[last])
+    merged.style[dashes >= minDashes] = LineArray.STYLES.index("dashed")
+    return merged, dashes
+
+
+def findLines(paths) -> LineArray:
     """This function finds all lines on a PDF.
     
     :param paths: Fitz object that stores all information about all objects on a PDF page
-    :return: List containing all lines each stored as object line """
+    :return: LineArray containing all lines """
 
-    returnList = list()
+    coords = list()
+    widths = list()
+    colors = list()
     for path in paths:
+        width = np.nan if path["width"] is None else path["width"]
+        color = [np.nan] * 3 if path["color"] is None else path["color"]
         for item in path["items"]:
             if item[0] == "l":
-                returnList.append(line([item[1].x, item[1].y], [item[2].x, item[2].y], path["color"], path["width"]))
-    return returnList
+                coords.append((item[1].x, item[1].y, item[2].x, item[2].y))
+                widths.append(width)
+                colors.append(color)
+    coords = np.array(coords, dtype=np.float64).reshape(-1, 4)
+    return LineArray(coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3], widths, colors)
 
 
 def lineFilter(lineList: list, leftTopCorner: list, rightBotCorner: list, endInclude = False, cleanPoints = False) -> list:    	
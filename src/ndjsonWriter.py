@@ -0,0 +1,179 @@
+#  Copyright (c) 2023.   Adam Buruzs
+## Streaming NDJSON output: one compact json record per page, one line per record, one file per document.
+## The record of a page is built with compactRecord (in the worker), the lines are appended to the document files
+## by the NdjsonWriter on a background thread, in the order the pages are finished.
+##
+## compact record of a page:
+##   {"page": .., "diagramNumber": ..,
+##    "interfaces": [{"index", "terminalPoint", "line", "labelHeader", "matchingLabels", "type", "ctrlBlockIndices",
+##                    "hydraulic": {"label", "topPoint", "line"}}, ..],
+##    "controlBlocks": {"rectangles", "labels", "terminals", "ctrl2ctrl", "connections", "iface2ctrl"} or null}
+## a line is [x0, y0, x1, y1, style], a terminal is [point, line index, label].
+## With debug=True the internals are kept too: interface "textLabel", "hydraulic" "labels", "labels2VertPoints",
+## "matchingVerticalLines", "verticalMatchPoints", and control "lines" (linesOfControl) and "connectDict".
+
+import json
+import logging
+import os
+import queue
+import threading
+
+import numpy as np
+
+from src import lineReader
+
+## number of decimals of the coordinates in the records
+PRECISION = 4
+
+
+def lineRecord(ln):
+    """ [x0, y0, x1, y1, style] of a lineReader.line, None stays None """
+    if ln is None:
+        return None
+    return [round(float(v), PRECISION) for v in (*ln.startPoint, *ln.endPoint)] + [ln.style]
+
+
+class CompactEncoder(json.JSONEncoder):
+    """ json encoder of the compact records: numpy arrays and numbers, lines as lists """
+    def default(self, obj):
+        if isinstance(obj, np.ndarray):
+            return np.round(obj, PRECISION).tolist() if obj.dtype.kind == "f" else obj.tolist()
+        if isinstance(obj, np.floating):
+            return round(float(obj), PRECISION)
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, lineReader.line):
+            return lineRecord(obj)
+        if isinstance(obj, lineReader.LineArray):
+            return [lineRecord(ln) for ln in obj]
+        return json.JSONEncoder.default(self, obj)
+
+
+def compactInterface(ifa, debug=False):
+    """ compact record of an interface of fullProcess.matchInterfaces """
+    hydr = ifa.get("hydraulic") or {}
+    rec = {"index": ifa.get("index"), "terminalPoint": ifa.get("terminalPoint"), "line": lineRecord(ifa.get("lines")),
+           "labelHeader": ifa.get("labelHeader", []), "matchingLabels": ifa.get("matchingLabels", []),
+           "type": ifa.get("type", []), "ctrlBlockIndices": ifa.get("ctrlBlockIndices", []),
+           "hydraulic": {"label": hydr.get("mergedFirstLabels"), "topPoint": hydr.get("topPoints"),
+                         "line": lineRecord(hydr.get("lines"))}}
+    if debug:
+        rec["textLabel"] = ifa.get("textLabel")
+        for key in ["labels", "labels2VertPoints", "matchingVerticalLines", "verticalMatchPoints"]:
+            rec["hydraulic"][key] = hydr.get(key)
+    return rec
+
+
+def compactControls(controls, debug=False):
+    """ compact record of the output of lineConnects.processControlDiagram. The terminals are
+    [point, line index, label] without the copies of the line and of the rectangle """
+    if controls is None:
+        return None
+    rec = {"rectangles": controls["rectangles"], "labels": controls.get("text2rectangles"),
+           "terminals": [[[term[0], term[1], term[4]] for term in terms] for terms in controls["ctrlTerminals"]],
+           "ctrl2ctrl": controls.get("ctrl2ctrl"), "connections": controls.get("ctrl2ctrlConnections"),
+           "iface2ctrl": controls.get("iface2ctrl_labelled")}
+    if debug:
+        rec["lines"] = controls.get("linesOfControl")
+        rec["connectDict"] = controls.get("connectDict")
+    return rec
+
+
+def compactRecord(ifaces, controls, pagenum, diagramNumber=None, debug=False):
+    """ compact record of a page
+    :param ifaces, controls: output of fullProcess.processPage
+    :param pagenum: page number starting from 1
+    :param diagramNumber: the Zeichnungsnummer of the page, see readpdf.getSchemaNumber
+    :param debug: keep the debug fields (internals of the processing)
+    """
+    return {"page": pagenum, "diagramNumber": diagramNumber,
+            "interfaces": [compactInterface(ifa, debug=debug) for ifa in ifaces],
+            "controlBlocks": compactControls(controls, debug=debug)}
+
+
+def toLine(record):
+    """ serialize a record to one NDJSON line (without the newline) """
+    return json.dumps(record, cls=CompactEncoder, separators=(",", ":"))
+
+
+def readRecords(path):
+    """ read the records of a NDJSON file. A page can be written more than once (a resumed batch run), the last
+    record of a page is kept. An incomplete last line (crashed run) is skipped.
+    :return: dict page number -> record
+    """
+    records = {}
+    with open(path) as f:
+        for row in f:
+            try:
+                rec = json.loads(row)
+            except json.JSONDecodeError:
+                logging.warning(f"incomplete record in {path} skipped")
+                continue
+            records[rec["page"]] = rec
+    return records
+
+
+class NdjsonWriter:
+    """ appends lines to NDJSON files on a background thread, so the collecting loop does not wait for the disk.
+    Every line is flushed as soon as it is written. Usage:
+        with NdjsonWriter() as writer:
+            writer.write(path, toLine(record))
+    """
+
+    def __init__(self, mode="w", maxQueue=1024):
+        """
+        :param mode: "w": a file is truncated when it gets its first line, "a": the lines are appended
+        :param maxQueue: maximum number of queued lines, write() blocks if the writer is behind
+        """
+        self.mode = mode
+        self._queue = queue.Queue(maxsize=maxQueue)
+        self._files = {}
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="NdjsonWriter", daemon=True)
+        self._thread.start()
+
+    def write(self, path, line, callback=None):
+        """ queue a line for the file path
+        :param callback: function without arguments, called on the writer thread after the line is flushed
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put((path, line, callback))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is not None:
+                continue  # drain the queue after an error
+            path, line, callback = item
+            try:
+                if path not in self._files:
+                    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                    self._files[path] = open(path, self.mode)
+                f = self._files[path]
+                f.write(line + "\n")
+                f.flush()
+                if callback is not None:
+                    callback()
+            except Exception as e:
+                logging.exception(f"cannot write {path}")
+                self._error = e
+
+    def close(self):
+        """ write the queued lines and close the files. An error of the writer thread is raised here """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
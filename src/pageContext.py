@@ -0,0 +1,91 @@
+#  Copyright (c) 2023.   Adam Buruzs
+## Per-page extraction context. The vector drawings, the line list and the text of a WSCAD page are extracted
+## only once, and shared by all processing stages (control diagram, hydraulic schema, text labels, sections).
+
+from functools import cached_property
+
+from src import lineReader
+from src.sectionLayout import SectionLayout
+from src.spanTrace import NULL_TRACE
+from src.textIndex import TextIndex
+
+
+class PageContext:
+    """ lazily extracts and memoizes the content of a fitz page.
+    Every stage accepts a PageContext instead of a raw fitz.Page, so page.get_drawings(), lineReader.findLines()
+    and page.get_text() run at most once per page.
+    """
+
+    def __init__(self, page, trace=None):
+        """
+        :param page: fitz page
+        :param trace: spanTrace.PageTrace to record the time of the processing stages, None: no recording
+        """
+        self.page = page
+        self.trace = NULL_TRACE if trace is None else trace
+        self._searches = {}
+
+    @property
+    def mediabox_size(self):
+        return self.page.mediabox_size
+
+    @property
+    def mediabox(self):
+        return self.page.mediabox
+
+    @cached_property
+    def drawings(self) -> list:
+        """ the vector paths of the page: page.get_drawings() """
+        with self.trace.span("vector extraction"):
+            return self.page.get_drawings()
+
+    @cached_property
+    def lines(self) -> lineReader.LineArray:
+        """ lineReader.LineArray of the lines extracted from the drawings """
+        drawings = self.drawings  # extracted outside of the span, it is an other stage
+        with self.trace.span("line extraction"):
+            return lineReader.findLines(drawings)
+
+    @cached_property
+    def textBlocks(self) -> list:
+        """ page.get_text("blocks") """
+        with self.trace.span("text extraction", kind="blocks"):
+            return self.page.get_text("blocks")
+
+    @cached_property
+    def words(self) -> list:
+        """ page.get_text("words") """
+        with self.trace.span("text extraction", kind="words"):
+            return self.page.get_text("words")
+
+    @cached_property
+    def wordIndex(self) -> TextIndex:
+        """ textIndex.TextIndex of the words """
+        return TextIndex(self.words)
+
+    @cached_property
+    def blockIndex(self) -> TextIndex:
+        """ textIndex.TextIndex of the text blocks """
+        return TextIndex(self.textBlocks)
+
+    @cached_property
+    def sectionLayout(self):
+        """ the sectionLayout.SectionLayout of the page: separators and section bands """
+        lines = self.lines  # extracted outside of the span, it is an other stage
+        with self.trace.span("section layout"):
+            return SectionLayout(self)
+
+    def search_for(self, text) -> list:
+        """ memoized page.search_for(text). Returns a new list, so the callers can sort it in place."""
+        if text not in self._searches:
+            self._searches[text] = self.page.search_for(text)
+        return list(self._searches[text])
+
+
+def getPageContext(page) -> PageContext:
+    """ wrap a fitz page in a PageContext. An existing PageContext is returned as it is.
+    :param page: fitz page or PageContext
+    """
+    if isinstance(page, PageContext):
+        return page
+    return PageContext(page)
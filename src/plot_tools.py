@@ -1,22 +1,35 @@
 #  Copyright (c) 2023.   Adam Buruzs
+## Optional plotting helpers. matplotlib and opencv are imported on first use only, so the processing modules
+## can be imported (and run) without them, see pyplot.
 import os, sys
-import pandas as pd
 import numpy as np
-import cv2 as cv
 import math
 
 import logging
-import matplotlib.pyplot as plt
 
-logging.basicConfig(stream = sys.stdout, level = logging.INFO)
+_plt = None
 
-logging.getLogger('matplotlib.font_manager').disabled = True
-logging.getLogger('PIL.PngImagePlugin').disabled = True
 
+def pyplot(backend = "Qt5Agg"):
+    """ import matplotlib.pyplot on the first call, with the interactive backend.
+    The MPLBACKEND environment variable overrides the backend.
+    :return: the matplotlib.pyplot module
+    """
+    global _plt
+    if _plt is None:
+        import matplotlib
+        if "MPLBACKEND" not in os.environ:
+            matplotlib.use(backend)
+        import matplotlib.pyplot as plt
+        logging.getLogger('matplotlib.font_manager').disabled = True
+        logging.getLogger('PIL.PngImagePlugin').disabled = True
+        _plt = plt
+    return _plt
 
 
 def imgResize(img, width):
     """ resizing an image"""
+    import cv2 as cv
     logging.debug(f"original image size {img.shape}")
     newheight = int(img.shape[0] * width/ img.shape[1])
     res_img = cv.resize(img, dsize = (width, newheight), interpolation = cv.INTER_AREA)
@@ -37,6 +50,7 @@ def show2Image(imgs, titles = ["left", "right"], rotate180 = False,
     :param printclick: print the coordinates of the clicked points
     :return:
     """
+    plt = pyplot()
     nimages = len(imgs)
     if horizontal:
         fig, ax = plt.subplots(1,nimages, figsize=(15, figheight), **plotops)
@@ -81,6 +95,7 @@ def showNImage(imgs, titles = ["left", "right"], ncols= 2, rotate180 = False,
     :param printclick: print the coordinates of the clicked points
     :return:
     """
+    plt = pyplot()
     nimages = len(imgs)
     nrows = math.ceil(nimages/ncols)
     fig, ax = plt.subplots(ncols , math.ceil(nimages/ncols), figsize = (ncols*5,nrows*5), **plotops)
@@ -132,6 +147,9 @@ def plotOver(imgray, img2, rgb= "r"):
 
 
 if __name__ == "__main__":
+    import cv2 as cv
+    logging.basicConfig(stream = sys.stdout, level = logging.INFO)
+    plt = pyplot()
     picdir = "../Data/Vamsis"
     imgpath = "house4.jpg"
     src = cv.imread(os.path.join(picdir, imgpath), cv.IMREAD_COLOR)
@@ -1,17 +1,17 @@
 import logging
 import sys
+import threading
 
 import fitz # PyMuPDF
 import io
-from PIL import Image
+from src.pageContext import getPageContext
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use("Qt5Agg")
+from src import plot_tools
 
 def extractPageImages(file = "C:/Users/BuruzsA/Documents/projects/Digiaktiv/220621_Beispielschemen digiaktiv.pdf",
                       pageIndex = 3):
     """ trial to extract images from a page of a pdf document. """
+    from PIL import Image
     # open the file
     pdf_file = fitz.open(file)
     page = pdf_file[pageIndex]
@@ -41,6 +41,7 @@ def extractPage2Pixels(pdfdoc: fitz.fitz.Document, pagenum = 0, page = None, for
     :param pdfdoc: pdfdoc = fitz.open(file)
     :param pagenum: the page number that you want to extract
     """
+    from PIL import Image
     if page is None:
         page = pdfdoc[pagenum]
     width,height = page.mediabox.width, page.mediabox.height
@@ -56,6 +57,56 @@ def extractPage2Pixels(pdfdoc: fitz.fitz.Document, pagenum = 0, page = None, for
     return pil_image, np_image
 
 
+class _PixmapSamples:
+    """ exposes the samples of a fitz.Pixmap to numpy without copy. The array keeps this object (and the pixmap)
+    alive as its base """
+
+    def __init__(self, pix):
+        self.pix = pix
+        self.__array_interface__ = {"shape": (pix.h, pix.w, pix.n), "typestr": "|u1", "version": 3,
+                                    "data": (pix.samples_ptr, False), "strides": (pix.stride, pix.n, 1)}
+
+
+def pixmap2array(pix):
+    """ numpy view of the pixmap samples, shape (height, width) for single channel pixmaps,
+    (height, width, channels) otherwise"""
+    arr = np.asarray(_PixmapSamples(pix))
+    return arr[:, :, 0] if pix.n == 1 else arr
+
+
+## the anti-aliasing level of fitz.TOOLS is global to the process: renderGray holds this lock while it renders, so a
+## render without anti-aliasing in one thread does not change the level of a render in another thread
+_aaLock = threading.Lock()
+
+def renderGray(page, y_from = 0.0, y_to = 1.0, zoom = 3, antialias = True):
+    """ render a horizontal strip of a page directly to a grayscale image, without alpha channel and without
+    image encoding. Faster than extractPage2Pixels + color conversion.
+    :param page: fitz page or PageContext
+    :param y_from, y_to: the strip, relative to the page height
+    :param antialias: if False, the page is rendered without anti-aliasing (pure black and white drawings).
+        The anti-aliasing level is a global setting of PyMuPDF: it is changed and restored under a module lock, and
+        the renders of renderGray take the same lock. Other renders of the process (get_pixmap elsewhere) running
+        at the same time in another thread can still see the changed level.
+    :return: uint8 numpy array (height, width), a view of the pixmap samples
+    """
+    page = getPageContext(page).page
+    width, height = page.mediabox.width, page.mediabox.height
+    clipRect = fitz.IRect(0, y_from * height, width, y_to * height)
+    with _aaLock:
+        if antialias:
+            pix = page.get_pixmap(clip = clipRect, matrix = fitz.Matrix(zoom, zoom), colorspace = fitz.csGRAY,
+                                  alpha = False)
+        else:
+            aaLevel = fitz.TOOLS.show_aa_level()["graphics"]
+            fitz.TOOLS.set_aa_level(0)
+            try:
+                pix = page.get_pixmap(clip = clipRect, matrix = fitz.Matrix(zoom, zoom), colorspace = fitz.csGRAY,
+                                      alpha = False)
+            finally:
+                fitz.TOOLS.set_aa_level(aaLevel)
+    return pixmap2array(pix)
+
+
 def getlines(pdfdoc: fitz.fitz.Document, pagenum = 0):
     """ extract lines from pdf document"""
     page = pdfdoc[pagenum]
@@ -70,6 +121,7 @@ def getlines(pdfdoc: fitz.fitz.Document, pagenum = 0):
 
 def plotLines(lines, plotlabels = True):
     """ create matplotlib plot from lines"""
+    plt = plot_tools.pyplot()
     fig = plt.figure()
     for li in lines:
         xv = [li["items"][0][1].x, li["items"][0][2].x]
@@ -91,13 +143,16 @@ def plotLinesOfPage(pdf_file, pagenum):
     posLen = line_lengths > 0.0
     linesWithLength = np.array(allines)[posLen]
     plotLines(linesWithLength, plotlabels=True)
-    plt.title(f"page of pdf {pagenum+1}")
+    plot_tools.pyplot().title(f"page of pdf {pagenum+1}")
 
 def getSchemaNumber(page : fitz.fitz.Page):
-    """ get the diagram title, looks for the field next to the Zeichnungsnummer"""
+    """ get the diagram title, looks for the field next to the Zeichnungsnummer
+    :param page: fitz page or PageContext
+    """
+    ctx = getPageContext(page)
     try:
-        keylabel = np.array(page.search_for("Zeichnungsnummer"))[0] # coordinates of Zeichnungsummer
-        textBlocks = page.get_text("blocks")
+        keylabel = np.array(ctx.search_for("Zeichnungsnummer"))[0] # coordinates of Zeichnungsummer
+        textBlocks = ctx.textBlocks
         rightToKeyBlock = [tb for tb in textBlocks if
                       ((tb[1]+tb[3])/2 > keylabel[1]) & ((tb[1]+tb[3])/2 < keylabel[3]) & # y coordinate
                       (tb[0] > keylabel[0]) ] # x  coordinate
@@ -109,6 +164,8 @@ def getSchemaNumber(page : fitz.fitz.Page):
 
 
 if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stdout, level = logging.DEBUG)
+    plt = plot_tools.pyplot()
     file = "C:/Users/BuruzsA/Documents/projects/Digiaktiv/220621_Beispielschemen digiaktiv.pdf"
     pdf_file = fitz.open(file)
     print(f"opened a file with {pdf_file.page_count} pages")
@@ -0,0 +1,127 @@
+#  Copyright (c) 2023.   Adam Buruzs
+## On-disk cache of the processed pages. The key is a hash of the page content (content streams, XObjects, images),
+## the processing parameters and the version of the code, so unchanged pages of a new revision of a project
+## are not processed again. The cache is limited in size, the least recently used entries are evicted.
+
+import glob
+import hashlib
+import json
+import logging
+import os
+
+## bump it if the format of the cached results changes
+CACHE_FORMAT = 1
+
+_codeVersion = None
+
+
+def codeVersion():
+    """ hash of the source files of the src package. Any code change invalidates the cached results."""
+    global _codeVersion
+    if _codeVersion is None:
+        h = hashlib.sha256()
+        for fn in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+            with open(fn, "rb") as f:
+                h.update(f.read())
+        _codeVersion = h.hexdigest()
+    return _codeVersion
+
+
+def pageContentHash(page):
+    """ hash of everything drawn on the page: the content streams, the form XObjects and the images
+    :param page: fitz page
+    """
+    doc = page.parent
+    h = hashlib.sha256()
+    h.update(repr((tuple(page.mediabox), page.rotation)).encode())
+    for xref in page.get_contents():
+        h.update(doc.xref_stream(xref) or b"")
+    for xo in page.get_xobjects():
+        h.update(doc.xref_stream(xo[0]) or b"")
+    for img in page.get_images(full=True):
+        h.update(doc.xref_stream_raw(img[0]) or b"")
+    return h.hexdigest()
+
+
+def pageKey(page, params):
+    """ cache key of a page
+    :param params: dict of the processing parameters
+    """
+    h = hashlib.sha256()
+    h.update(pageContentHash(page).encode())
+    h.update(json.dumps(params, sort_keys=True).encode())
+    h.update(f"{CACHE_FORMAT}:{codeVersion()}".encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """ directory of the serialized page results, one file per key. The modification time of a file is updated on
+    every hit, and the oldest files are removed when the total size exceeds maxBytes.
+    Several processes can use the same cache directory.
+    """
+
+    def __init__(self, cachedir, maxBytes=1 << 30):
+        """
+        :param cachedir: cache directory
+        :param maxBytes: size limit of the cache
+        """
+        self.cachedir = cachedir
+        self.maxBytes = maxBytes
+        os.makedirs(cachedir, exist_ok=True)
+        self._size = sum(size for path, size, lastUsed in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.cachedir, key[:2], key + ".json")
+
+    def _entries(self):
+        """ (path, size, last use time) of all cached files. The modification time is set on every hit."""
+        for sub in os.scandir(self.cachedir):
+            if sub.is_dir():
+                for ent in os.scandir(sub.path):
+                    if ent.name.endswith(".json"):
+                        try:
+                            st = ent.stat()
+                        except FileNotFoundError:  # evicted by an other process
+                            continue
+                        yield ent.path, st.st_size, st.st_mtime
+
+    def get(self, key):
+        """ :return: the cached text, or None if the key is not in the cache"""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:  # evicted by an other process after the read, the text is still valid
+            pass
+        return text
+
+    def put(self, key, text):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)  # atomic, readers never see a partial file
+        self._size += len(text)
+        if self._size > self.maxBytes:
+            self.evict()
+
+    def evict(self, target=0.9):
+        """ remove the least recently used entries, until the size is below target * maxBytes"""
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self._size = sum(e[1] for e in entries)
+        removed = 0
+        for path, size, lastUsed in entries:
+            if self._size <= target * self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # removed by an other process
+                pass
+            self._size -= size
+            removed += 1
+        logging.info(f"cache eviction removed {removed} entries, cache size {self._size} bytes")
@@ -0,0 +1,389 @@
+#  Copyright (c) 2023.   Adam Buruzs
+## Revision mode: process a new revision of a WSCAD project, reusing the results of the previous revision.
+## The pages of the two revisions are matched by their Zeichnungsnummer (readpdf.getSchemaNumber). The vector content
+## and the words of the section bands are hashed per page, and a processing stage (see fullProcess.STAGES) is only run
+## again if one of its input bands changed:
+##   control diagram: Typ and Regelstruktur,  hydraulics: Anlage,  labelling: Bezeichnung and Typ
+## The stage outputs are kept in a revision state file, the input of the next revision. The output is the merged model
+## of the new revision (the usual page results) and a model diff of the pages (added/removed blocks, terminals,
+## connections and interfaces).
+##
+## usage: python -m src.revisionDiff old.pdf new.pdf --outdir ./output
+##        the state of old.pdf is read from <outdir>/revisions/old_<content hash>.state.pkl (or --state). If it does
+##        not exist, old.pdf is processed first.
+
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+from time import time
+
+import fitz
+import numpy as np
+
+from src import baschema2model, fullProcess, ndjsonWriter
+from src.pageContext import PageContext
+from src.readpdf import getSchemaNumber
+from src.resultCache import codeVersion
+
+## bump it if the format of the state files changes
+STATE_FORMAT = 1
+## the section bands (section label, xmax of the label) that are the inputs of the processing stages
+STAGE_SECTIONS = {
+    "control diagram": [("Typ", 150), ("Regelstruktur", 1000)],
+    "hydraulics": [("Anlage", 200)],
+    "labelling": [("ezeichnung", 150), ("Typ", 150)],
+}
+
+
+def _rounded(v, ndigits=2):
+    """ hashable, rounded form of the coordinates of a drawing item """
+    if isinstance(v, fitz.Point):
+        return round(v.x, ndigits), round(v.y, ndigits)
+    if isinstance(v, fitz.Rect):
+        return tuple(round(c, ndigits) for c in v)
+    if isinstance(v, fitz.Quad):
+        return tuple(_rounded(p, ndigits) for p in (v.ul, v.ur, v.ll, v.lr))
+    if isinstance(v, float):
+        return round(v, ndigits)
+    return v
+
+
+def bandHash(ctx, ymin, ymax):
+    """ hash of the vector paths and words of a horizontal band of the page
+    :param ctx: PageContext
+    :param ymin, ymax: y range of the band. The paths touching the band, and the words centered in it are hashed
+    """
+    h = hashlib.sha256()
+    for d in ctx.drawings:
+        r = d["rect"]
+        if (r.y1 >= ymin) and (r.y0 <= ymax):
+            items = [tuple(_rounded(v) for v in item) for item in d["items"]]
+            h.update(repr((items, d.get("color"), d.get("fill"), d.get("width"), d.get("dashes"))).encode())
+    for w in ctx.words:
+        if ymin <= (w[1] + w[3]) / 2 <= ymax:
+            h.update(repr((_rounded(w[0]), _rounded(w[1]), _rounded(w[2]), _rounded(w[3]), w[4])).encode())
+    return h.hexdigest()
+
+
+def stageHashes(ctx):
+    """ hash of the inputs of each processing stage: the page size, the section separators and the input bands
+    :return: dict stage name -> hash, None if a band of the stage is not found
+    """
+    layout = ctx.sectionLayout
+    base = repr((_rounded(ctx.mediabox), [_rounded(y) for y in layout.separatorsY])).encode()
+    hashes = {}
+    for stage, sections in STAGE_SECTIONS.items():
+        h = hashlib.sha256(base)
+        try:
+            for label, xmax in sections:
+                h.update(bandHash(ctx, *layout.band(label, xmax=xmax)).encode())
+            hashes[stage] = h.hexdigest()
+        except (ValueError, IndexError):
+            hashes[stage] = None
+    return hashes
+
+
+def newState(params):
+    """ empty revision state
+    :param params: parameters of the processing, a state is only reused with the same parameters and code
+    """
+    return {"format": STATE_FORMAT, "params": params, "code": codeVersion(), "file": None, "pages": {}}
+
+
+def loadState(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def saveState(path, state):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f)
+    os.replace(tmp, path)
+
+
+def contentHash(inpfile):
+    """ short hash of the content of a file. The revisions of a project usually have the same file name """
+    h = hashlib.sha256()
+    with open(inpfile, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:12]
+
+
+def statePath(outdir, inpfile):
+    """ default revision state file of a document: outdir/revisions/<file>_<content hash>.state.pkl """
+    return os.path.join(outdir, "revisions", f"{baschema2model.fileTagOf(inpfile)}_{contentHash(inpfile)}.state.pkl")
+
+
+def diffPath(outdir, oldfile, newfile):
+    """ model diff file of two revisions: outdir/<new file>_<old content hash>_<new content hash>.diff.json """
+    return os.path.join(outdir, f"{baschema2model.fileTagOf(newfile)}_{contentHash(oldfile)}_"
+                                f"{contentHash(newfile)}.diff.json")
+
+
+def pageModel(entry):
+    """ ifaces, controls of a page of the revision state """
+    stages = {stage: pickle.loads(data) for stage, data in entry["stages"].items()}
+    return fullProcess.matchInterfaces(stages["control diagram"], stages["hydraulics"], *stages["labelling"])
+
+
+def processRevision(doc, oldState=None, params=None):
+    """ process the pages of a document, reusing the stage outputs of the previous revision where their inputs are
+    unchanged
+    :param doc: fitz document of the new revision
+    :param oldState: revision state of the previous revision, None: all the stages are run
+    :param params: parameters of fullProcess.processPage, default: baschema2model.PAGE_PARAMS
+    :return: state, results: the revision state of doc, and a list of dicts
+        {"key", "page", "diagramNumber", "ifaces", "controls", "rerun": list of the stages that were run, "error"}
+    """
+    params = dict(baschema2model.PAGE_PARAMS if params is None else params)
+    state = newState(params)
+    oldPages = {}
+    if oldState is not None:
+        if (oldState.get("format") != STATE_FORMAT) or (oldState["params"] != params) or \
+                (oldState["code"] != codeVersion()):
+            logging.warning("the previous revision was processed with other parameters or code, it is not reused")
+        else:
+            oldPages = oldState["pages"]
+    results = []
+    for pagenum in range(1, doc.page_count + 1):
+        ctx = PageContext(doc[pagenum - 1])
+        number = getSchemaNumber(ctx)
+        key = f"p{pagenum}" if number is None else number.strip()
+        while key in state["pages"]:  # the same Zeichnungsnummer on several pages
+            key += "#"
+        res = {"key": key, "page": pagenum, "diagramNumber": number, "ifaces": None, "controls": None,
+               "rerun": [], "error": None}
+        results.append(res)
+        try:
+            hashes = stageHashes(ctx)
+            old = oldPages.get(key)
+            stages = {}
+            for stage in fullProcess.STAGES:
+                if (old is not None) and (hashes[stage] is not None) and (old["hashes"].get(stage) == hashes[stage]):
+                    stages[stage] = old["stages"][stage]
+            res["rerun"] = [stage for stage in fullProcess.STAGES if stage not in stages]
+            if res["rerun"]:
+                outputs = fullProcess.processStages(ctx, pagenum=pagenum, stages=res["rerun"], doplot=False, **params)
+                ## pickled before the matching, matchInterfaces changes the control diagram in place
+                stages.update({stage: pickle.dumps(out) for stage, out in outputs.items()})
+            entry = {"page": pagenum, "diagramNumber": number, "hashes": hashes, "stages": stages}
+            res["ifaces"], res["controls"] = pageModel(entry)
+            state["pages"][key] = entry
+        except Exception as e:
+            logging.exception(f"error on page {pagenum}")
+            res["error"] = f"{type(e).__name__}: {e}"
+    return state, results
+
+
+def _labels(labels):
+    if labels is None:
+        return ""
+    if isinstance(labels, str):
+        return labels.strip()
+    return " ".join(lab.strip() for lab in labels if lab is not None)
+
+
+def _blockLabels(controls, bi):
+    """ the distinct text labels inside and around a control block """
+    labels = controls["text2rectangles"][bi] if bi < len(controls["text2rectangles"]) else []
+    return "|".join(dict.fromkeys(lab.strip() for lab in labels if lab.strip()))
+
+
+def matchBlocks(oldRects, newRects, tol=5.0):
+    """ match the control blocks of two revisions by the distance of their centers
+    :return: dict old block index -> new block index
+    """
+    oldRects = np.asarray(oldRects, dtype=float).reshape(-1, 4)
+    newRects = np.asarray(newRects, dtype=float).reshape(-1, 4)
+    oldMid = (oldRects[:, :2] + oldRects[:, 2:]) / 2
+    newMid = (newRects[:, :2] + newRects[:, 2:]) / 2
+    dist = np.linalg.norm(oldMid[:, None, :] - newMid[None, :, :], axis=2)
+    mapping = {}
+    for flat in np.argsort(dist, axis=None):
+        io, inew = np.unravel_index(flat, dist.shape)
+        if dist[io, inew] > tol:
+            break
+        if (io not in mapping) and (inew not in mapping.values()):
+            mapping[int(io)] = int(inew)
+    return mapping
+
+
+def _addedRemoved(oldItems, newItems):
+    oldSet, newSet = set(oldItems), set(newItems)
+    return [list(it) for it in sorted(newSet - oldSet)], [list(it) for it in sorted(oldSet - newSet)]
+
+
+def modelDiff(oldModel, newModel, tol=5.0):
+    """ structured difference of the models of a page in two revisions.
+    The blocks are matched by their position (see matchBlocks), the interfaces by the x of their terminal point.
+    Block indices of the added items refer to the new revision, of the removed items to the old revision.
+    :param oldModel, newModel: (ifaces, controls) of fullProcess.processPage
+    :return: dict with "blocks", "terminals", "connections" and "interfaces", each a dict of the "added" and
+        "removed" (and "changed") items. Empty lists if the models are the same
+    """
+    oldIfaces, oldControls = oldModel
+    newIfaces, newControls = newModel
+    empty = {"rectangles": np.zeros((0, 4)), "text2rectangles": [], "ctrlTerminals": [], "ctrl2ctrlConnections": []}
+    oldControls = empty if oldControls is None else oldControls
+    newControls = empty if newControls is None else newControls
+    mapping = matchBlocks(oldControls["rectangles"], newControls["rectangles"], tol=tol)
+    oldBlocks, newBlocks = range(len(oldControls["rectangles"])), range(len(newControls["rectangles"]))
+    blocks = {"added": [{"block": bi, "rect": np.round(newControls["rectangles"][bi], 2).tolist(),
+                         "labels": _blockLabels(newControls, bi)} for bi in newBlocks if bi not in mapping.values()],
+              "removed": [{"block": bi, "rect": np.round(oldControls["rectangles"][bi], 2).tolist(),
+                           "labels": _blockLabels(oldControls, bi)} for bi in oldBlocks if bi not in mapping],
+              "changed": [{"block": inew, "oldBlock": io, "old": _blockLabels(oldControls, io),
+                           "new": _blockLabels(newControls, inew)} for io, inew in sorted(mapping.items())
+                          if _blockLabels(oldControls, io) != _blockLabels(newControls, inew)]}
+    ## terminals: (block, label). The old blocks are renumbered to the new ones where matched, the unmatched old
+    ## blocks get negative numbers
+    reverse = {inew: io for io, inew in mapping.items()}
+    oldIndex = lambda bi: -1 - bi if bi < 0 else reverse[bi]
+    oldTerms = [(mapping.get(bi, -1 - bi), _labels(t[-1])) for bi, terms in enumerate(oldControls["ctrlTerminals"])
+                for t in terms]
+    newTerms = [(bi, _labels(t[-1])) for bi, terms in enumerate(newControls["ctrlTerminals"]) for t in terms]
+    added, removed = _addedRemoved(oldTerms, newTerms)
+    terminals = {"added": [{"block": bi, "label": lab} for bi, lab in added],
+                 "removed": [{"block": oldIndex(bi), "label": lab} for bi, lab in removed]}
+    ## connections between the blocks
+    oldCons = [(mapping.get(a, -1 - a), _labels(la), mapping.get(b, -1 - b), _labels(lb))
+               for a, la, b, lb in oldControls["ctrl2ctrlConnections"]]
+    newCons = [(a, _labels(la), b, _labels(lb)) for a, la, b, lb in newControls["ctrl2ctrlConnections"]]
+    added, removed = _addedRemoved(oldCons, newCons)
+    connections = {"added": added,
+                   "removed": [[oldIndex(a), la, oldIndex(b), lb] for a, la, b, lb in removed]}
+    ## interfaces, matched by the x of the terminal point
+    fields = {"labelHeader": lambda ifa, m: _labels(ifa.get("labelHeader")),
+              "matchingLabels": lambda ifa, m: _labels(ifa.get("matchingLabels")),
+              "type": lambda ifa, m: _labels(ifa.get("type")),
+              "hydraulic": lambda ifa, m: _labels((ifa.get("hydraulic") or {}).get("mergedFirstLabels")),
+              "ctrlBlockIndices": lambda ifa, m: sorted(m.get(bi, -1 - bi) for bi in ifa.get("ctrlBlockIndices", []))}
+    identity = {bi: bi for bi in newBlocks}
+    interfaces = {"added": [], "removed": [], "changed": []}
+    unmatched = list(newIfaces)
+    for ifa in oldIfaces:
+        x = ifa["terminalPoint"][0]
+        match = min(unmatched, key=lambda nif: abs(nif["terminalPoint"][0] - x), default=None)
+        if (match is None) or (abs(match["terminalPoint"][0] - x) > tol):
+            interfaces["removed"].append({"x": round(float(x), 2), "labels": _labels(ifa.get("matchingLabels"))})
+            continue
+        unmatched.remove(match)
+        for name, get in fields.items():
+            oldVal, newVal = get(ifa, mapping), get(match, identity)
+            if oldVal != newVal:
+                interfaces["changed"].append({"x": round(float(match["terminalPoint"][0]), 2), "field": name,
+                                              "old": oldVal, "new": newVal})
+    interfaces["added"] = [{"x": round(float(ifa["terminalPoint"][0]), 2), "labels": _labels(ifa.get("matchingLabels"))}
+                           for ifa in unmatched]
+    return {"blocks": blocks, "terminals": terminals, "connections": connections, "interfaces": interfaces}
+
+
+def isEmptyDiff(diff):
+    return not any(items for part in diff.values() for items in part.values())
+
+
+def runRevision(oldfile, newfile, outdir, oldStatePath=None, outputFormat="txt", debugFields=True):
+    """ process the new revision of a document, and write the merged model, the model diff and the revision state
+    :param oldfile: pdf of the previous revision
+    :param newfile: pdf of the new revision
+    :param outdir: output directory. The page results are written as by baschema2model.runDocuments, the diff to
+        diffPath, the revision state to statePath of the new file. The file names contain the content hash, so
+        revisions of the same file name do not overwrite each other.
+    :param oldStatePath: revision state of the previous revision, default: statePath(outdir, oldfile).
+        If it does not exist, the previous revision is processed first.
+    :return: the diff dict
+    """
+    oldStatePath = statePath(outdir, oldfile) if oldStatePath is None else oldStatePath
+    if os.path.exists(oldStatePath):
+        oldState = loadState(oldStatePath)
+    else:
+        logging.warning(f"no revision state {oldStatePath}, processing {oldfile} first")
+        with fitz.open(oldfile) as oldDoc:
+            oldState, _ = processRevision(oldDoc)
+        oldState["file"] = oldfile
+        saveState(oldStatePath, oldState)
+    t0 = time()
+    with fitz.open(newfile) as doc:
+        state, results = processRevision(doc, oldState)
+    state["file"] = newfile
+    newStatePath = statePath(outdir, newfile)
+    if os.path.abspath(newStatePath) == os.path.abspath(oldStatePath):
+        ## same content as the previous revision, or --state points to the state of the new file
+        logging.warning(f"the state of {newfile} is not written, it would overwrite the previous state {oldStatePath}")
+    else:
+        saveState(newStatePath, state)
+    os.makedirs(os.path.join(outdir, "schemaText"), exist_ok=True)
+    writer = ndjsonWriter.NdjsonWriter() if outputFormat == "ndjson" else None
+    pages = {"added": [], "removed": [], "changed": [], "unchanged": [], "failed": []}
+    diffs = {}
+    try:
+        for res in results:
+            key = res["key"]
+            if res["error"] is not None:
+                pages["failed"].append(key)
+                continue
+            outText = baschema2model.serializePage(res["ifaces"], res["controls"], res["page"],
+                                                   res["diagramNumber"], outputFormat=outputFormat,
+                                                   debugFields=debugFields)
+            if writer is None:
+                baschema2model.writeResult(outdir, newfile, res["page"], outText)
+            else:
+                writer.write(baschema2model.ndjsonPath(outdir, newfile), outText)
+            if key not in oldState["pages"]:
+                pages["added"].append(key)
+                continue
+            diff = modelDiff(pageModel(oldState["pages"][key]), (res["ifaces"], res["controls"]))
+            if isEmptyDiff(diff):
+                pages["unchanged"].append(key)
+            else:
+                pages["changed"].append(key)
+                diffs[key] = diff
+    finally:
+        if writer is not None:
+            writer.close()
+    pages["removed"] = [key for key in oldState["pages"] if key not in state["pages"]]
+    reprocessed = {res["key"]: res["rerun"] for res in results if res["rerun"]}
+    nstages = sum(len(stages) for stages in reprocessed.values())
+    logging.info(f"{len(results)} pages, {nstages} of {len(results) * len(fullProcess.STAGES)} stages reprocessed "
+                 f"in {round(time() - t0, 2)} sec. pages added: {len(pages['added'])}, removed: "
+                 f"{len(pages['removed'])}, changed: {len(pages['changed'])}")
+    out = {"old": oldfile, "new": newfile, "pages": pages, "reprocessed": reprocessed, "diffs": diffs}
+    diffFile = diffPath(outdir, oldfile, newfile)
+    with open(diffFile, "w") as f:
+        json.dump(out, f, indent=1)
+    logging.info(f"model diff written to {diffFile}")
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="process a new revision of a BACS schema pdf, reusing the results "
+                                                 "of the previous revision, and write the model diff")
+    parser.add_argument("old", help="pdf of the previous revision")
+    parser.add_argument("new", help="pdf of the new revision")
+    parser.add_argument("--outdir", "-o", default="output", help="output directory")
+    parser.add_argument("--state", default=None,
+                        help="revision state of the previous revision "
+                             "(default: <outdir>/revisions/<old>_<content hash>.state.pkl)")
+    parser.add_argument("--format", default="txt", choices=["txt", "ndjson"], help="format of the page results")
+    parser.add_argument("--no-debug", action="store_true", help="leave out the debug fields of the ndjson records")
+    parser.add_argument("--verbose", "-v", action="store_true", help="keep the debug output of the processing")
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stdout)
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.INFO)
+    with open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        runRevision(args.old, args.new, args.outdir, oldStatePath=args.state, outputFormat=args.format,
+                    debugFields=not args.no_debug)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
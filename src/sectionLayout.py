@@ -0,0 +1,66 @@
+#  Copyright (c) 2023.   Adam Buruzs
+## Section layout of a WSCAD page: the horizontal frame separator lines, and the sections (Anlage, Bezeichnung, Typ,
+## Regelstruktur ...) between them, found by their labels on the left side of the page.
+
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+class SectionLayout:
+    """ index of the horizontal section separators of a page.
+    The separator y values are collected in one pass over the lines and kept sorted, so the band around a
+    section label is found with a binary search.
+    """
+
+    def __init__(self, ctx, minLength=25, maxStartX=30):
+        """
+        :param ctx: PageContext of the page
+        :param minLength: minimum horizontal extent of a separator line
+        :param maxStartX: separator lines start at the left frame, left of this x value
+        """
+        self.ctx = ctx
+        lines = ctx.lines
+        ## horizontal section divider lines
+        isSeparator = (abs(lines.x1 - lines.x0) > minLength) & (np.minimum(lines.x0, lines.x1) < maxStartX)
+        self.separatorsY = np.sort(lines.y0[isSeparator]).tolist()
+        self._labels = {}
+
+    def findLabel(self, sectionString, xmax=1000):
+        """ coordinates of a section label. If multiple matches found, the leftmost one with x < xmax is used
+        :param sectionString: the name of the section to search for, for example "Regelstruktur"
+        :return: the fitz.Rect of the label
+        """
+        key = (sectionString, xmax)
+        if key not in self._labels:
+            allfinds = self.ctx.search_for(sectionString)
+            if allfinds.__len__() == 1:
+                self._labels[key] = allfinds[0]
+            else:
+                print(f"multiple match found for {sectionString}:\n {allfinds}")
+                allfinds.sort(key=lambda r: r[0])
+                self._labels[key] = [af for af in allfinds if af[0] < xmax][0]
+        return self._labels[key]
+
+    def bandAt(self, y):
+        """ the closest separators above and below y
+        :return: (Y_before, Y_after)
+        """
+        ib = bisect_left(self.separatorsY, y)
+        ia = bisect_right(self.separatorsY, y)
+        if (ib == 0) or (ia == len(self.separatorsY)):
+            raise ValueError(f"no section separator found around y = {y}")
+        return self.separatorsY[ib - 1], self.separatorsY[ia]
+
+    def band(self, sectionString, xmax=1000, usemid=True):
+        """ the y range of the section containing the label sectionString
+        :param usemid: use the vertical middle of the label as pivot, otherwise its bottom
+        :return: (Y_before, Y_after)
+        """
+        label_coords = self.findLabel(sectionString, xmax=xmax)
+        print(f"coordinates of label {sectionString} : {label_coords}")
+        if usemid:  ## the pivot Y point: extracted from the label
+            Ylabel = (label_coords[1] + label_coords[3]) / 2.0
+        else:  # use the bottom-right point
+            Ylabel = label_coords[-1]
+        return self.bandAt(Ylabel)
@@ -0,0 +1,439 @@
+#  Copyright (c) 2023.   Adam Buruzs
+## Local HTTP service: upload a pdf, and get the results of the pages as they are finished.
+## Only the python standard library is used (asyncio streams, a minimal HTTP/1.1 implementation), the pages are
+## processed by a warm process pool: the workers import the processing modules and process a synthetic page at start.
+##
+##   POST /documents                          upload a pdf (raw body or multipart/form-data), optional ?pages=1-5.
+##                                            The page records (see ndjsonWriter) are streamed as server-sent events
+##                                            if the request accepts text/event-stream, otherwise as chunked NDJSON.
+##   GET  /documents/<id>                     status of an uploaded document
+##   GET  /documents/<id>/pages/<n>           the record of a page, processed if needed
+##   GET  /documents/<id>/pages/<n>/diagram   JointJS html diagram of a page, rendered on the first request and cached
+##   GET  /documents/<id>/diagrams            the diagrams of all the pages in one html bundle, see diagram2html
+##
+## usage: python -m src.service --port 8080 --jobs 4 --workdir ./service
+
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlsplit, parse_qs
+
+import fitz
+
+from src import baschema2model
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 411: "Length Required",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message=""):
+        super().__init__(message)
+        self.status = status
+
+
+def warmWorker(cacheDir=None, cacheMaxBytes=1 << 30, debugFields=False):
+    """ initializer of the service workers: ndjson output, and a synthetic page is processed, so the lazy imports
+    (scipy, opencv ...) are done before the first request """
+    baschema2model.initWorker(False, cacheDir, cacheMaxBytes, outputFormat="ndjson", debugFields=debugFields)
+    from src import fullProcess, syntheticPage
+    try:
+        doc, truths = syntheticPage.makeDocument([2])
+        fullProcess.processPage(doc, pagenum=1, doplot=False, **baschema2model.PAGE_PARAMS)
+    except Exception:
+        logging.exception("warm-up of the worker failed")
+
+
+def ping(delay=0.2):
+    """ start-up task. It keeps the worker busy for a moment, so the start pings reach all the workers """
+    time.sleep(delay)
+    return os.getpid()
+
+
+def renderDiagram(inpfile, pagenum, outfile):
+    """ worker task: process a page and write its JointJS diagram to the html file outfile """
+    from src import diagram2html, fullProcess
+    doc = baschema2model.getDocument(inpfile)
+    ifaces, controls = fullProcess.processPage(doc, pagenum=pagenum, doplot=False, **baschema2model.PAGE_PARAMS)
+    html = diagram2html.graphHtml(fullProcess.jointDiagramGraph(ifaces, controls, title=f"page {pagenum}"))
+    tmp = f"{outfile}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(html)
+    os.replace(tmp, outfile)
+    return outfile
+
+
+def renderBundle(inpfile, outfile, title):
+    """ worker task: write the diagrams of all the pages of a document to one html bundle """
+    from src import diagram2html
+    tmp = f"{outfile}.{os.getpid()}.tmp"
+    diagram2html.renderBundle(baschema2model.getDocument(inpfile), tmp, title=title, **baschema2model.PAGE_PARAMS)
+    os.replace(tmp, outfile)
+    return outfile
+
+
+class PageService:
+    """ the uploaded documents, their page records, and the process pool """
+
+    def __init__(self, workdir, jobs=None, cacheDir=None, cacheMaxBytes=1 << 30, debugFields=False,
+                 maxUpload=200 << 20):
+        """
+        :param workdir: the uploads are saved to workdir/uploads, the rendered diagrams to workdir/diagrams
+        :param jobs: number of worker processes, default: number of cpus
+        :param cacheDir, cacheMaxBytes: result cache of the workers, see baschema2model.runDocuments
+        :param debugFields: keep the debug fields of the page records
+        :param maxUpload: size limit of an upload in bytes
+        """
+        self.uploadDir = os.path.join(workdir, "uploads")
+        self.diagramDir = os.path.join(workdir, "diagrams")
+        os.makedirs(self.uploadDir, exist_ok=True)
+        os.makedirs(self.diagramDir, exist_ok=True)
+        self.jobs = jobs or os.cpu_count()
+        self.maxUpload = maxUpload
+        self._poolArgs = (cacheDir, cacheMaxBytes, debugFields)
+        self.pool = self._newPool()
+        self._pending = set()  # the submitted tasks of the pool that are not finished
+        self.documents = {}  # document id -> {"path", "name", "pageCount"}
+        self.records = {}  # (document id, page) -> future of the (record text, error)
+        self.diagrams = {}  # (document id, page) -> future of the html file
+
+    async def start(self):
+        """ start all the workers, and wait until they are warm """
+        pids = await asyncio.gather(*[self.submit(ping) for _ in range(self.jobs)])
+        logging.info(f"{len(set(pids))} of {self.jobs} workers warm")
+
+    def _newPool(self):
+        return ProcessPoolExecutor(max_workers=self.jobs, initializer=warmWorker, initargs=self._poolArgs)
+
+    def restartPool(self, broken):
+        """ replace the pool after a worker crash (for example in the pdf library on a bad upload): a broken pool
+        fails all the later tasks. The failed records and diagrams are dropped, they are submitted again when they
+        are requested.
+        :param broken: the pool that failed, it is only replaced once
+        """
+        if self.pool is not broken:
+            return
+        logging.error("worker process crashed, restarting the pool")
+        broken.shutdown(wait=False)
+        self.pool = self._newPool()
+        for futures in (self.records, self.diagrams):
+            for key, fut in list(futures.items()):
+                if fut.done() and (fut.cancelled() or fut.exception()):
+                    del futures[key]
+
+    def submit(self, fn, *args):
+        """ run fn(*args) in the process pool. A broken pool is replaced, see restartPool
+        :return: asyncio future of the result
+        """
+        pool = self.pool
+        try:
+            fut = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self.restartPool(pool)
+            pool = self.pool
+            fut = pool.submit(fn, *args)
+        self._pending.add(fut)
+        fut.add_done_callback(self._pending.discard)
+
+        def onDone(f):
+            if (not f.cancelled()) and isinstance(f.exception(), BrokenProcessPool):
+                loop.call_soon_threadsafe(self.restartPool, pool)
+        loop = asyncio.get_running_loop()
+        fut.add_done_callback(onDone)
+        return asyncio.wrap_future(fut)
+
+    def close(self):
+        """ cancel the tasks that are not started yet, and stop the workers """
+        ## shutdown(cancel_futures=True) needs python 3.9
+        for fut in list(self._pending):
+            fut.cancel()
+        self.pool.shutdown()
+
+    def addDocument(self, data, name="upload.pdf"):
+        """ save an uploaded pdf. The id is the hash of the content, an upload of the same file gets the same id
+        :return: document id
+        """
+        docId = hashlib.sha256(data).hexdigest()[:16]
+        if docId not in self.documents:
+            path = os.path.join(self.uploadDir, f"{docId}.pdf")
+            with open(path, "wb") as f:
+                f.write(data)
+            try:
+                with fitz.open(path) as doc:
+                    pageCount = doc.page_count
+            except Exception as e:
+                os.remove(path)
+                raise HttpError(400, f"not a pdf file: {e}")
+            self.documents[docId] = {"path": path, "name": name, "pageCount": pageCount}
+        return docId
+
+    def document(self, docId):
+        """ an uploaded document. The uploads of an earlier run of the service are found in the upload directory """
+        if docId not in self.documents:
+            path = os.path.join(self.uploadDir, f"{docId}.pdf")
+            if not (docId.isalnum() and os.path.exists(path)):
+                raise HttpError(404, f"unknown document {docId}")
+            with fitz.open(path) as doc:
+                self.documents[docId] = {"path": path, "name": f"{docId}.pdf", "pageCount": doc.page_count}
+        return self.documents[docId]
+
+    def pageRecord(self, docId, pagenum):
+        """ future of the (record text, error message) of a page. A page is processed only once """
+        doc = self.document(docId)
+        if not 1 <= pagenum <= doc["pageCount"]:
+            raise HttpError(404, f"page {pagenum} not found")
+        key = (docId, pagenum)
+        if key not in self.records:
+            fut = self.submit(baschema2model.processPageTask, doc["path"], pagenum)
+            self.records[key] = asyncio.ensure_future(self._record(key, fut))
+        return self.records[key]
+
+    async def _record(self, key, fut):
+        try:
+            inpfile, pagenum, outText, error, trace = await fut
+        except BrokenProcessPool:
+            ## the page is processed again when it is requested again
+            self.records.pop(key, None)
+            return None, "worker process crashed"
+        return outText, error
+
+    def diagram(self, docId, pagenum=None):
+        """ future of the html diagram file of a page, or of the bundle of all the pages if pagenum is None.
+        It is rendered once and kept in the diagram directory """
+        doc = self.document(docId)
+        if (pagenum is not None) and not 1 <= pagenum <= doc["pageCount"]:
+            raise HttpError(404, f"page {pagenum} not found")
+        key = (docId, pagenum)
+        if pagenum is None:
+            outfile = os.path.join(self.diagramDir, f"{docId}.html")
+            task = (renderBundle, doc["path"], outfile, doc["name"])
+        else:
+            outfile = os.path.join(self.diagramDir, f"{docId}_p{pagenum}.html")
+            task = (renderDiagram, doc["path"], pagenum, outfile)
+        fut = self.diagrams.get(key)
+        if (fut is None) or (fut.done() and (fut.cancelled() or fut.exception())):
+            ## a failed or cancelled render is submitted again
+            if os.path.exists(outfile):
+                fut = asyncio.get_running_loop().create_future()
+                fut.set_result(outfile)
+            else:
+                fut = self.submit(*task)
+            self.diagrams[key] = fut
+        return self.diagrams[key]
+
+
+def pageResult(docId, pagenum, outText, error):
+    """ json text of a streamed page result: the page record, or the error """
+    if error is None:
+        return f'{{"document":"{docId}","page":{pagenum},"record":{outText}}}'
+    return json.dumps({"document": docId, "page": pagenum, "error": error})
+
+
+async def readRequest(reader, maxBody):
+    """ read a HTTP request
+    :return: method, path, query dict, headers dict (lower case names), body bytes
+    """
+    requestLine = (await reader.readline()).decode("latin-1").strip()
+    if not requestLine:
+        raise ConnectionResetError()
+    try:
+        method, target, version = requestLine.split(" ", 2)
+    except ValueError:
+        raise HttpError(400, f"bad request line {requestLine!r}")
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1")
+        if line in ("\r\n", "\n", ""):
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = b""
+    if method in ("POST", "PUT"):
+        if "content-length" not in headers:
+            raise HttpError(411, "the Content-Length header is required")
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise HttpError(400, f"bad Content-Length {headers['content-length']!r}")
+        if length < 0:
+            raise HttpError(400, f"bad Content-Length {length}")
+        if length > maxBody:
+            raise HttpError(413, f"upload larger than {maxBody} bytes")
+        body = await reader.readexactly(length)
+    url = urlsplit(target)
+    return method, url.path, parse_qs(url.query), headers, body
+
+
+def uploadedFile(headers, body):
+    """ the pdf data and file name of an upload: the raw body, or the first file of a multipart/form-data body """
+    ctype = headers.get("content-type", "")
+    if not ctype.startswith("multipart/form-data"):
+        return body, "upload.pdf"
+    msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {ctype}\r\n\r\n".encode("latin-1") + body)
+    for part in msg.iter_parts():
+        if part.get_filename() is not None:
+            return part.get_payload(decode=True), part.get_filename()
+    raise HttpError(400, "no file in the multipart upload")
+
+
+class Response:
+    """ writes a HTTP response, a complete body or chunks """
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    async def start(self, status, contentType, length=None):
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {contentType}", "Connection: close",
+                "Cache-Control: no-cache"]
+        head.append(f"Content-Length: {length}" if length is not None else "Transfer-Encoding: chunked")
+        self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        await self.writer.drain()
+
+    async def send(self, status, body, contentType="application/json"):
+        body = body.encode("utf-8") if isinstance(body, str) else body
+        await self.start(status, contentType, length=len(body))
+        self.writer.write(body)
+        await self.writer.drain()
+
+    async def chunk(self, text):
+        data = text.encode("utf-8")
+        self.writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+        await self.writer.drain()
+
+    async def end(self):
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+
+async def streamPages(service, resp, docId, pages, sse):
+    """ send the results of the pages in the order they are finished """
+    await resp.start(200, "text/event-stream" if sse else "application/x-ndjson")
+    doc = service.documents[docId]
+    if sse:
+        await resp.chunk(f"event: document\ndata: {json.dumps(dict(id=docId, name=doc['name'], pages=pages))}\n\n")
+
+    async def pageWithNumber(pagenum):
+        return pagenum, await service.pageRecord(docId, pagenum)
+
+    failed = 0
+    for fut in asyncio.as_completed([pageWithNumber(p) for p in pages]):
+        pagenum, (outText, error) = await fut
+        failed += error is not None
+        line = pageResult(docId, pagenum, outText, error)
+        await resp.chunk(f"event: page\ndata: {line}\n\n" if sse else line + "\n")
+    summary = json.dumps({"document": docId, "pages": len(pages), "failed": failed})
+    await resp.chunk(f"event: done\ndata: {summary}\n\n" if sse else summary + "\n")
+    await resp.end()
+
+
+async def handle(service, method, path, query, headers, body, resp):
+    parts = [p for p in path.split("/") if p]
+    if (parts == ["documents"]) and (method == "POST"):
+        data, name = uploadedFile(headers, body)
+        docId = service.addDocument(data, name)
+        pageCount = service.documents[docId]["pageCount"]
+        try:
+            pages = baschema2model.parsePages(query.get("pages", [None])[0], pageCount)
+        except ValueError:
+            raise HttpError(400, f"bad page selection {query['pages'][0]}")
+        sse = ("text/event-stream" in headers.get("accept", "")) or (query.get("stream", [""])[0] == "sse")
+        await streamPages(service, resp, docId, pages, sse)
+    elif method != "GET":
+        raise HttpError(405, f"{method} is not supported")
+    elif not parts:
+        await resp.send(200, json.dumps({"documents": list(service.documents)}))
+    elif (len(parts) == 2) and (parts[0] == "documents"):
+        doc = service.document(parts[1])
+        done = sorted(p for (d, p), fut in service.records.items() if (d == parts[1]) and fut.done())
+        await resp.send(200, json.dumps({"id": parts[1], "name": doc["name"], "pages": doc["pageCount"],
+                                         "done": done}))
+    elif (len(parts) == 3) and (parts[0] == "documents") and (parts[2] == "diagrams"):
+        outfile = await service.diagram(parts[1])
+        with open(outfile, "rb") as f:
+            await resp.send(200, f.read(), contentType="text/html; charset=utf-8")
+    elif (len(parts) in (4, 5)) and (parts[0] == "documents") and (parts[2] == "pages") and parts[3].isdigit():
+        docId, pagenum = parts[1], int(parts[3])
+        if len(parts) == 4:
+            outText, error = await service.pageRecord(docId, pagenum)
+            await resp.send(200 if error is None else 500, pageResult(docId, pagenum, outText, error))
+        elif parts[4] == "diagram":
+            outfile = await service.diagram(docId, pagenum)
+            with open(outfile, "rb") as f:
+                await resp.send(200, f.read(), contentType="text/html; charset=utf-8")
+        else:
+            raise HttpError(404, f"not found: {path}")
+    else:
+        raise HttpError(404, f"not found: {path}")
+
+
+def makeHandler(service):
+    async def onConnection(reader, writer):
+        resp = Response(writer)
+        try:
+            method, path, query, headers, body = await readRequest(reader, service.maxUpload)
+            logging.info(f"{method} {path}")
+            await handle(service, method, path, query, headers, body, resp)
+        except HttpError as e:
+            await resp.send(e.status, json.dumps({"error": str(e)}))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # the client went away
+        except Exception as e:
+            logging.exception("request failed")
+            try:
+                await resp.send(500, json.dumps({"error": f"{type(e).__name__}: {e}"}))
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+    return onConnection
+
+
+async def serve(host="127.0.0.1", port=8080, **serviceArgs):
+    """ run the service until it is cancelled
+    :param serviceArgs: see PageService
+    """
+    service = PageService(**serviceArgs)
+    try:
+        await service.start()
+        server = await asyncio.start_server(makeHandler(service), host, port)
+        logging.info(f"listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="local HTTP service to process BACS schema pdf files")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="number of worker processes (default: all cpus)")
+    parser.add_argument("--workdir", default="service", help="directory of the uploads and the rendered diagrams")
+    parser.add_argument("--cache", default=None, help="result cache directory, unchanged pages are not processed again")
+    parser.add_argument("--cache-size", type=int, default=1024, help="size limit of the result cache in MB")
+    parser.add_argument("--max-upload", type=int, default=200, help="size limit of an upload in MB")
+    parser.add_argument("--debug-fields", action="store_true", help="keep the debug fields of the page records")
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stdout)
+    logging.getLogger().setLevel(logging.INFO)
+    try:
+        asyncio.run(serve(args.host, args.port, workdir=args.workdir, jobs=args.jobs, cacheDir=args.cache,
+                          cacheMaxBytes=args.cache_size << 20, debugFields=args.debug_fields,
+                          maxUpload=args.max_upload << 20))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#  Copyright (c) 2023.   Adam Buruzs
+## Timing of the processing stages of a page. The stages open nested spans on the trace of the PageContext:
+##     with ctx.trace.span("connectivity"):
+##         ...
+## By default the PageContext has the NULL_TRACE, its spans do nothing. The recorded traces of the pages can be
+## exported to the Chrome trace format (chrome://tracing, https://ui.perfetto.dev) and summarized per stage.
+
+import contextlib
+import json
+import os
+from time import perf_counter, time
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class PageTrace:
+    """ records the spans of one page. The spans are kept in the order they were opened, with their nesting depth."""
+    enabled = True
+
+    def __init__(self, label=""):
+        """
+        :param label: name of the page in the exports, for example "<file> p<pagenum>"
+        """
+        self.label = label
+        self.wallStart = time()
+        self._t0 = perf_counter()
+        self._depth = 0
+        self.spans = []
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        """ time the block of the with statement
+        :param args: additional information of the span, shown in the trace viewer
+        """
+        rec = {"name": name, "start": perf_counter() - self._t0, "duration": None, "depth": self._depth}
+        if args:
+            rec["args"] = args
+        self.spans.append(rec)
+        self._depth += 1
+        try:
+            yield rec
+        finally:
+            self._depth -= 1
+            rec["duration"] = perf_counter() - self._t0 - rec["start"]
+
+    def toDict(self):
+        """ json serializable form, the input of chromeTrace and stageSummary. Times are in seconds."""
+        return {"label": self.label, "wallStart": self.wallStart, "spans": self.spans}
+
+
+class _NullTrace:
+    """ trace that records nothing """
+    enabled = False
+
+    def span(self, name, **args):
+        return _NULL_SPAN
+
+    def toDict(self):
+        return None
+
+
+NULL_TRACE = _NullTrace()
+
+
+def chromeTrace(traces):
+    """ Chrome trace event format of the page traces. Each page is shown as a separate thread.
+    :param traces: list of PageTrace.toDict() dicts
+    """
+    traces = [tr for tr in traces if tr is not None]
+    t0 = min((tr["wallStart"] for tr in traces), default=0.0)
+    events = []
+    for tid, tr in enumerate(traces):
+        events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": tid, "args": {"name": tr["label"]}})
+        offset = tr["wallStart"] - t0
+        for sp in tr["spans"]:
+            if sp["duration"] is None:  # the span was not closed (the page failed)
+                continue
+            events.append({"name": sp["name"], "ph": "X", "pid": 0, "tid": tid,
+                           "ts": round((offset + sp["start"]) * 1e6, 1), "dur": round(sp["duration"] * 1e6, 1),
+                           "args": sp.get("args", {})})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def writeChromeTrace(path, traces):
+    """ write the traces to a Chrome trace json file """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(chromeTrace(traces), f)
+    os.replace(tmp, path)
+
+
+def stageSummary(traces):
+    """ total time of the stages over the pages
+    :param traces: list of PageTrace.toDict() dicts
+    :return: dict stage name -> {"count", "total", "mean", "max", "maxPage"}, times in seconds,
+        maxPage is the label of the page with the slowest span
+    """
+    summary = {}
+    for tr in traces:
+        if tr is None:
+            continue
+        for sp in tr["spans"]:
+            if sp["duration"] is None:
+                continue
+            st = summary.setdefault(sp["name"], {"count": 0, "total": 0.0, "max": 0.0, "maxPage": None})
+            st["count"] += 1
+            st["total"] += sp["duration"]
+            if sp["duration"] >= st["max"]:
+                st["max"], st["maxPage"] = sp["duration"], tr["label"]
+    for st in summary.values():
+        st["mean"] = st["total"] / st["count"]
+    return summary
+
+
+def formatSummary(summary):
+    """ text table of the stageSummary, sorted by the total time """
+    rows = [f"{'stage':<22}{'count':>7}{'total s':>10}{'mean ms':>10}{'max ms':>10}  slowest page"]
+    for name, st in sorted(summary.items(), key=lambda it: -it[1]["total"]):
+        rows.append(f"{name:<22}{st['count']:>7}{st['total']:>10.3f}{st['mean'] * 1e3:>10.1f}"
+                    f"{st['max'] * 1e3:>10.1f}  {st['maxPage']}")
+    return "\n".join(rows)
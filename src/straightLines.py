@@ -2,21 +2,14 @@
 
 import os, sys
 import numpy as np
-import cv2 as cv
-from matplotlib.patches import Rectangle
 
 import logging
-import matplotlib.pyplot as plt
 
 from src import plot_tools
 
-logging.basicConfig(stream = sys.stdout, level = logging.INFO)
-
-logging.getLogger('matplotlib.font_manager').disabled = True
-logging.getLogger('PIL.PngImagePlugin').disabled = True
-
 def imgResize(img, width):
     """ resizing an image"""
+    import cv2 as cv
     logging.debug(f"original image size {img.shape}")
     newheight = int(img.shape[0] * width/ img.shape[1])
     res_img = cv.resize(img, dsize = (width, newheight), interpolation = cv.INTER_AREA)
@@ -44,6 +37,8 @@ def showLines4(axis , edges :np.ndarray, lines :np.ndarray, color = "red", cmap
     #axis.set_title("cany edges & Prob-Hough segments")
 
 def showRectangles(axis , rectangles :np.ndarray, color = "#11BB13", alpha = 0.7):
+    from matplotlib.patches import Rectangle
+    plt = plot_tools.pyplot()
     for ri in rectangles:
         x_lt,y_lt, x_rb,y_rb = ri
         axis.add_patch(Rectangle((x_lt, y_lt),
@@ -78,6 +73,52 @@ def getHLines(bim, minlen = 50):
             hlines.append(np.array([li[0],hi, li[1], hi]))
     return np.array(hlines)
 
+def getHLineRuns(bim, minlen = 50):
+    """ get horizontal lines from binary image, the same result as getHLines, but the runs of all rows are
+    extracted at once, without a python loop over the rows
+    :param bim: image NXM of True or FAlse or 0 or 1 values
+    :return: int32 array of shape (N, 4) with the (x0, y0, x1, y1) corner points of the lines. x1 is the first pixel
+        after the run. Runs reaching the right border of the image are not returned (like in getHLines).
+    """
+    bim = np.asarray(bim, dtype = bool)
+    rowix = np.where(np.count_nonzero(bim, axis = 1) > minlen)[0]
+    width = bim.shape[1]
+    padded = np.zeros((rowix.__len__(), width + 1), dtype = np.int8)
+    padded[:, 1:] = bim[rowix]
+    ## +1 at the start of a run, -1 at the first pixel after the run
+    steps = np.diff(padded, axis = 1)
+    changes = np.flatnonzero(steps)
+    changeRow = changes // width
+    starts = np.where(steps.ravel()[changes] > 0)[0]
+    ## starts and ends alternate in a row. A run reaching the right border has no end, it is dropped
+    hasEnd = starts + 1 < changes.__len__()
+    hasEnd[hasEnd] = changeRow[starts[hasEnd] + 1] == changeRow[starts[hasEnd]]
+    starts = starts[hasEnd]
+    startIx = changes[starts] % width
+    endIx = changes[starts + 1] % width
+    longlines = (endIx - startIx) >= minlen
+    y = rowix[changeRow[starts[longlines]]]
+    return np.column_stack((startIx[longlines], y, endIx[longlines], y)).astype(np.int32)
+
+
+def getLines(bim, minlen = 50, engine = "runs"):
+    """ get the horizontal and vertical lines of a binary image
+    :param engine: "runs": vectorized run extraction of the whole image (getHLineRuns),
+        "rows": python loop over the rows (getHLines)
+    :return: int32 array of shape (N, 4) with the (x0, y0, x1, y1) corner points, first the horizontal lines,
+        then the vertical ones
+    """
+    if engine == "runs":
+        hlines = getHLineRuns
+    elif engine == "rows":
+        hlines = getHLines
+    else:
+        raise ValueError(f"unknown line engine {engine}")
+    hLines = np.asarray(hlines(bim, minlen = minlen), dtype = np.int32).reshape(-1, 4)
+    vLinesT = np.asarray(hlines(np.transpose(bim), minlen = minlen), dtype = np.int32).reshape(-1, 4)
+    return np.concatenate((hLines, vLinesT[:, [1, 0, 3, 2]]), axis = 0)
+
+
 def detecRectangles(lines : np.array, tol = 5):
     """ detect rectangles from a set of straight horizontal/vertical lines
     :param lines: array of rows [x1,y1,x2,y2]
@@ -108,21 +149,19 @@ def detecRectangles(lines : np.array, tol = 5):
                     rectangles.append(np.array([thisLine[0], thisLine[1], matchLine[2], matchLine[3] ]))
     return rectangles
 
-def getRectangles(edgesbin, minlen= 40 , tol = 15):
+def getRectangles(edgesbin, minlen= 40 , tol = 15, engine = "runs"):
     """ extract rectangles from inary image of
     :param edgesbin: binary image of edges
     :param minlen: minimum side length of a rectangle to be detected
     :param tol: tolerance in pixels
+    :param engine: line extraction engine, see getLines
     :return: numpy array of rectangles
     """
     print(f"getting rectangles with tol= {tol}")
-    hLines = getHLines(edgesbin, minlen=minlen)
-    vLinesT = getHLines(np.transpose(edgesbin), minlen=minlen)
-    if vLinesT.__len__() == 0 :
+    lines = getLines(edgesbin, minlen=minlen, engine=engine)
+    if not (lines[:, 0] == lines[:, 2]).any():
         logging.info(f"no vertical line found")
-        return [], hLines
-    vLines = vLinesT[:, [1, 0, 3, 2]]
-    lines = np.concatenate((hLines, vLines), axis=0)
+        return [], lines
     rectans = detecRectangles(lines, tol=tol)
     ## filter by the size
     rectans = [ri for ri in rectans if (abs(ri[2] - ri[0]) > minlen - 5) & (abs(ri[3] - ri[1]) > minlen - 5)]
@@ -140,6 +179,8 @@ def getRectangles(edgesbin, minlen= 40 , tol = 15):
     return rect_filtered, lines
 
 if __name__ == "__main__":
+    import cv2 as cv
+    logging.basicConfig(stream = sys.stdout, level = logging.INFO)
     #def linesFromImg(imgfile):
     re_width = 1000
     blurN = 3
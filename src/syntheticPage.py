@@ -0,0 +1,173 @@
+#  Copyright (c) 2023.   Adam Buruzs
+## Synthetic WSCAD style VDI 3814 pages, for testing and benchmarking without customer documents.
+## A page has the Anlage (hydraulic schema), Bezeichnung, Typ and Regelstruktur sections. Every Bezeichnung column has
+## a dashed hydraulic drop with a "-TF..." label, an interface terminal line going down to a control block, and the
+## neighbouring control blocks are connected by wires. The generator returns the ground truth of the page, that can be
+## compared to the output of fullProcess.processPage with checkGroundTruth.
+##
+## usage: python -m src.syntheticPage synth.pdf --columns 4,8,16
+
+import argparse
+import sys
+
+import fitz
+import numpy as np
+
+## y coordinates of the horizontal section separator lines
+SEPARATORS_Y = [40, 400, 480, 520, 760, 800]
+## left edge of the first column, and the left margin of the separator lines
+COLUMNS_X0 = 100
+MARGIN = 20
+
+
+def pageWidth(ncols, columnWidth=120):
+    """ width of a page with ncols columns: A3 landscape, or wider if the columns do not fit """
+    return max(1190, COLUMNS_X0 + columnWidth * ncols + 30 + 2 * MARGIN)
+
+
+def drawPage(doc, ncols=4, columnWidth=120, wires=True, height=842, schemaNumber="Z-0001"):
+    """ append a synthetic page to the document
+    :param doc: fitz document, for example fitz.open()
+    :param ncols: number of Bezeichnung columns. Every column has a hydraulic drop, an interface terminal and a
+        control block
+    :param columnWidth: width of a column
+    :param wires: connect the output "y" of every control block to the input "x2" of the next one
+    :param schemaNumber: text of the Zeichnungsnummer field
+    :return: the fitz page and the ground truth dict:
+        {"schemaNumber": .., "blocks": [[x0, y0, x1, y1], ..],
+         "interfaces": [{"x": .., "header": .., "label": .., "type": .., "hydraulic": .., "block": ..}, ..],
+         "connections": [[block1, label1, block2, label2], ..]}
+    """
+    width = pageWidth(ncols, columnWidth)
+    page = doc.new_page(width=width, height=height)
+    sh = page.new_shape()
+    page.insert_text((width - 190, 785), schemaNumber, fontsize=8)
+    for y in SEPARATORS_Y:
+        sh.draw_line((MARGIN, y), (width - MARGIN, y))
+        sh.finish(color=(0, 0, 0), width=0.8)
+    page.insert_text((22, 220), "Anlage", fontsize=8)
+    page.insert_text((22, 445), "Bezeichnung", fontsize=8)
+    page.insert_text((22, 503), "Typ", fontsize=8)
+    page.insert_text((22, 640), "Regelstruktur", fontsize=8)
+    page.insert_text((width - 490, 785), "Zeichnungsnummer", fontsize=8)
+    truth = {"schemaNumber": schemaNumber, "blocks": [], "interfaces": [], "connections": []}
+    blocks = []
+    for c in range(ncols):
+        left = COLUMNS_X0 + columnWidth * c
+        cx = left + columnWidth / 2
+        ## Bezeichnung column
+        sh.draw_quad(fitz.Rect(left, 400, left + columnWidth, 480).quad)
+        sh.finish(color=(0, 0, 0), width=0.5)
+        page.insert_text((left + 4, 415), f"=GRP{c}", fontsize=7)
+        page.insert_text((cx - 5, 460), f"Sensor{c}", fontsize=7)
+        page.insert_text((cx + 6, 514), "AI", fontsize=7)
+        ## dashed hydraulic drop
+        y = 150
+        while y < 396:
+            sh.draw_line((cx, y), (cx, min(y + 4, 398)))
+            sh.finish(color=(0, 0, 0), width=0.5)
+            y += 7
+        page.insert_text((cx + 4, 146), f"-TF{c:03d}", fontsize=7)
+        ## interface terminal line, and its wire to the input x1 of the control block
+        ix = cx + 10
+        sh.draw_line((ix, 500), (ix, 600))
+        sh.finish(color=(0, 0, 0), width=0.5)
+        block = fitz.Rect(ix + 20, 590, ix + 80, 630)
+        blocks.append(block)
+        sh.draw_rect(block)
+        sh.finish(color=(0, 0, 0), width=1)
+        sh.draw_line((ix, 600), (block.x0, 600))
+        sh.finish(color=(0, 0, 0), width=0.5)
+        page.insert_text((block.x0 + 3, 604), "x1", fontsize=6)
+        page.insert_text((block.x0 + 20, 615), f"PID{c}", fontsize=6)
+        page.insert_text((block.x0 + 52, 625), "y", fontsize=6)
+        truth["blocks"].append([block.x0, block.y0, block.x1, block.y1])
+        truth["interfaces"].append({"x": ix, "header": f"=GRP{c}", "label": f"Sensor{c}", "type": "AI",
+                                    "hydraulic": f"-TF{c:03d}", "block": c})
+    if wires:
+        for c in range(ncols - 1):
+            a, b = blocks[c], blocks[c + 1]
+            ## output y of block c to input x2 of block c+1, routed below the blocks
+            for p, q in [((a.x1, 622), (a.x1 + 15, 622)), ((a.x1 + 15, 622), (a.x1 + 15, 650)),
+                         ((a.x1 + 15, 650), (b.x0 - 5, 650)), ((b.x0 - 5, 650), (b.x0 - 5, 625)),
+                         ((b.x0 - 5, 625), (b.x0, 625))]:
+                sh.draw_line(p, q)
+                sh.finish(color=(0, 0, 0), width=0.5)
+            page.insert_text((b.x0 + 3, 627), "x2", fontsize=6)
+            truth["connections"].append([c, "y", c + 1, "x2"])
+    sh.commit()
+    return page, truth
+
+
+def makeDocument(columns=(4, 5)):
+    """ document with one synthetic page for each number of columns
+    :return: fitz document, list of the ground truths of the pages
+    """
+    doc = fitz.open()
+    truths = [drawPage(doc, ncols=n)[1] for n in columns]
+    return doc, truths
+
+
+def checkGroundTruth(ifaces, controls, truth, tol=1.0):
+    """ compare the output of fullProcess.processPage with the ground truth of drawPage
+    :param tol: tolerance of the coordinates
+    :return: list of the differences (error messages), empty if the page was extracted correctly
+    """
+    errors = []
+    if controls is None:
+        return ["no control diagram found"]
+    rects = np.asarray(controls["rectangles"], dtype=float).reshape(-1, 4)
+    blocks = np.asarray(truth["blocks"], dtype=float).reshape(-1, 4)
+    if len(rects) != len(blocks):
+        errors.append(f"{len(rects)} control blocks found instead of {len(blocks)}")
+    ## map the detected rectangles to the drawn blocks by their center points
+    rectMid = np.column_stack(((rects[:, 0] + rects[:, 2]) / 2, (rects[:, 1] + rects[:, 3]) / 2))
+    blockMid = np.column_stack(((blocks[:, 0] + blocks[:, 2]) / 2, (blocks[:, 1] + blocks[:, 3]) / 2))
+    rect2block = {}
+    for ri, mid in enumerate(rectMid):
+        dist = np.linalg.norm(blockMid - mid, axis=1)
+        if (len(dist) > 0) and (dist.min() < 5 * tol):
+            rect2block[ri] = int(np.argmin(dist))
+        else:
+            errors.append(f"rectangle {ri} at {rects[ri]} is not a drawn control block")
+    strip = lambda labels: [lab.strip() for lab in labels]
+    found = sorted(ifaces, key=lambda ifa: ifa["terminalPoint"][0])
+    if len(found) != len(truth["interfaces"]):
+        errors.append(f"{len(found)} interface terminals found instead of {len(truth['interfaces'])}")
+    for ifa, tr in zip(found, truth["interfaces"]):
+        name = f"interface {tr['label']}"
+        if abs(ifa["terminalPoint"][0] - tr["x"]) > tol:
+            errors.append(f"{name}: terminal at x={ifa['terminalPoint'][0]} instead of {tr['x']}")
+        if tr["label"] not in strip(ifa.get("matchingLabels", [])):
+            errors.append(f"{name}: labels {ifa.get('matchingLabels')}")
+        if tr["header"] not in strip(ifa.get("labelHeader", [])):
+            errors.append(f"{name}: header {ifa.get('labelHeader')} instead of {tr['header']}")
+        if tr["type"] not in strip(ifa.get("type", [])):
+            errors.append(f"{name}: type {ifa.get('type')} instead of {tr['type']}")
+        hydraulic = ifa.get("hydraulic", {}).get("mergedFirstLabels", "")
+        if hydraulic.strip() != tr["hydraulic"]:
+            errors.append(f"{name}: hydraulic label {hydraulic!r} instead of {tr['hydraulic']}")
+        connected = [rect2block.get(ri) for ri in ifa.get("ctrlBlockIndices", [])]
+        if connected != [tr["block"]]:
+            errors.append(f"{name}: connected to blocks {connected} instead of {[tr['block']]}")
+    foundConnections = set((rect2block.get(a), la.strip(), rect2block.get(b), lb.strip())
+                           for a, la, b, lb in controls.get("ctrl2ctrlConnections", []))
+    for con in truth["connections"]:
+        if tuple(con) not in foundConnections:
+            errors.append(f"connection {con} not found")
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="write a pdf with synthetic VDI 3814 pages")
+    parser.add_argument("outfile", help="output pdf file")
+    parser.add_argument("--columns", default="4,5", help="comma separated number of columns of the pages")
+    args = parser.parse_args(argv)
+    doc, truths = makeDocument([int(n) for n in args.columns.split(",")])
+    doc.save(args.outfile)
+    print(f"{doc.page_count} pages written to {args.outfile}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
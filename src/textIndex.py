@@ -0,0 +1,101 @@
+#  Copyright (c) 2023.   Adam Buruzs
+## Spatial index of the text of a page (words or blocks of page.get_text), to find the labels close to points,
+## within a distance, or inside a rectangle without scanning all the text boxes for every query.
+
+import numpy as np
+
+
+class TextIndex:
+    """ KD-tree over the center points of text boxes. The boxes are tuples (x0, y0, x1, y1, text, ...) as returned by
+    page.get_text("words") or page.get_text("blocks"). The queries take arrays of points / rectangles, and return
+    indices into self.items.
+    """
+
+    def __init__(self, items):
+        """
+        :param items: list of text boxes
+        """
+        self.items = list(items)
+        self.boxes = np.array([it[0:4] for it in self.items], dtype=float).reshape(-1, 4)
+        self.centers = np.column_stack(((self.boxes[:, 0] + self.boxes[:, 2]) / 2.0,
+                                        (self.boxes[:, 1] + self.boxes[:, 3]) / 2.0))
+        self.tree = None
+        if len(self.items) > 0:
+            from scipy.spatial import cKDTree  # slow import, only when a page has text
+            self.tree = cKDTree(self.centers)
+        self._sortedX0 = None
+        self._bands = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def inBand(self, ymin, ymax):
+        """ TextIndex of the text boxes with top ymin < y0 < ymax (memoized)"""
+        if (ymin, ymax) not in self._bands:
+            self._bands[(ymin, ymax)] = TextIndex([it for it in self.items if (it[1] > ymin) & (it[1] < ymax)])
+        return self._bands[(ymin, ymax)]
+
+    def nearest(self, points, k=1):
+        """ the k closest text boxes (by the center point) to each point. Equal distances are ordered by the index.
+        :param points: array of shape (Q, 2)
+        :return: distances and indices, arrays of shape (Q, k). k is reduced to the number of text boxes.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        k = min(k, len(self))
+        if (k == 0) or (len(points) == 0):
+            return np.zeros((len(points), k)), np.zeros((len(points), k), dtype=np.int64)
+        ## one more neighbour, to break the ties by index
+        kk = min(k + 1, len(self))
+        dist, ix = self.tree.query(points, k=kk)
+        dist, ix = dist.reshape(len(points), kk), ix.reshape(len(points), kk)
+        order = np.lexsort((ix, dist), axis=1)[:, :k] if kk > 1 else np.zeros((len(points), 1), dtype=np.int64)
+        return np.take_along_axis(dist, order, axis=1), np.take_along_axis(ix, order, axis=1)
+
+    def within(self, points, r):
+        """ text boxes with center closer than r (strictly) to the points
+        :param points: array of shape (Q, 2)
+        :param r: distance, scalar or one value per point
+        :return: list of sorted index arrays, one for each point
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(self) == 0:
+            return [np.zeros(0, dtype=np.int64) for p in points]
+        r = np.broadcast_to(np.asarray(r, dtype=float), (len(points),))
+        out = []
+        for p, ri, candidates in zip(points, r, self.tree.query_ball_point(points, r)):
+            candidates = np.sort(np.array(candidates, dtype=np.int64))
+            distances = ((self.centers[candidates] - p) ** 2.0).sum(axis=1) ** 0.5
+            out.append(candidates[distances < ri])
+        return out
+
+    def inside(self, rects):
+        """ text boxes that are completely (strictly) inside the rectangles
+        :param rects: array of rectangles [x1, y1, x2, y2] of shape (Q, 4), the corners can be in any order
+        :return: list of sorted index arrays, one for each rectangle
+        """
+        rects = np.asarray(rects, dtype=float).reshape(-1, 4)
+        lo = np.minimum(rects[:, [0, 1]], rects[:, [2, 3]])
+        hi = np.maximum(rects[:, [0, 1]], rects[:, [2, 3]])
+        if len(self) == 0:
+            return [np.zeros(0, dtype=np.int64) for ri in rects]
+        ## a box inside the rectangle has its center within the circumscribed circle
+        candidateLists = self.tree.query_ball_point((lo + hi) / 2.0, np.hypot(*(hi - lo).T) / 2.0)
+        boxLo = np.minimum(self.boxes[:, [0, 1]], self.boxes[:, [2, 3]])
+        boxHi = np.maximum(self.boxes[:, [0, 1]], self.boxes[:, [2, 3]])
+        out = []
+        for rlo, rhi, candidates in zip(lo, hi, candidateLists):
+            candidates = np.sort(np.array(candidates, dtype=np.int64))
+            isInside = np.all((boxLo[candidates] > rlo) & (boxHi[candidates] < rhi), axis=1)
+            out.append(candidates[isInside])
+        return out
+
+    def lastStartingBefore(self, xvals):
+        """ for each x value, the text box with the largest starting x (x0) smaller than the value.
+        Of boxes with the same x0 the last one is returned, like a stable sort by x0 would order them.
+        :return: array of indices, -1 where there is no such box
+        """
+        if self._sortedX0 is None:
+            self._order = np.argsort(self.boxes[:, 0], kind="stable")
+            self._sortedX0 = self.boxes[self._order, 0]
+        pos = np.searchsorted(self._sortedX0, np.asarray(xvals, dtype=float), side="left") - 1
+        return np.where(pos >= 0, self._order[np.maximum(pos, 0)] if len(self) > 0 else -1, -1)
@@ -2,26 +2,25 @@
 
 import logging, sys
 
-from src import exportRegelStruktur, lineConnects, readpdf
+from src import exportRegelStruktur, lineConnects, readpdf, plot_tools
+from src.pageContext import getPageContext
 
-logging.basicConfig(stream = sys.stdout, level = logging.DEBUG)
 import fitz
 import src.lineReader as lineReader
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use("Qt5Agg")
 from time import time
 
 
 def getTextBlocks( page, section_label = "ezeichnung"):
     """ get textblocks for section Bezeichnung. Extract rectangles from pdf, and find the main header labels based on that
+    :param page: fitz page or PageContext
     :param section_label: the text label to find the section on the WSCAD page
     for example "ezeichnung" - this finds "Bezeichnung" and "bezeichnung" also
     """
-    paths = page.get_drawings()
-    Y_before_bez, Y_after_bez, HSY = exportRegelStruktur.getSectionStrYLims(page, section_label, xmax=150)
-    textBlocks = page.get_text("blocks")
+    ctx = getPageContext(page)
+    paths = ctx.drawings
+    Y_before_bez, Y_after_bez = ctx.sectionLayout.band(section_label, xmax=150)
+    textBlocks = ctx.textBlocks
     textBlocks_filt = [tb for tb in textBlocks if (tb[1] > Y_before_bez) & (tb[1] < Y_after_bez) & (
         any(i.isalnum() for i in tb[4].replace("\n", " ")))]
     ### TODO : this will miss some text-boxes!
@@ -48,12 +47,13 @@ def getTextBlocks( page, section_label = "ezeichnung"):
 
 def getTextBlocksInSection( page, section_label = "Typ"):
     """ get text-blocks for any section.
+    :param page: fitz page or PageContext
     :param section_label: the text label to find the section on the WSCAD page
     for example "ezeichnung" - this finds "Bezeichnung" and "bezeichnung" also
     """
-    paths = page.get_drawings()
-    Y_before_bez, Y_after_bez, HSY = exportRegelStruktur.getSectionStrYLims(page, sectionString =section_label, xmax=150, usemid = True)
-    textBlocks = page.get_text("blocks")
+    ctx = getPageContext(page)
+    Y_before_bez, Y_after_bez = ctx.sectionLayout.band(section_label, xmax=150, usemid = True)
+    textBlocks = ctx.textBlocks
     textBlocks_filt = [tb for tb in textBlocks if (0.5*(tb[1]+ tb[3]) > Y_before_bez) & (0.5*(tb[1]+ tb[3]) < Y_after_bez) & (
         any(i.isalnum() for i in tb[4].replace("\n", " ")))]
     ### TODO : this will miss some text-boxes!
@@ -62,7 +62,8 @@ def getTextBlocksInSection( page, section_label = "Typ"):
 
 
 if __name__ == "__main__":
-
+    logging.basicConfig(stream = sys.stdout, level = logging.DEBUG)
+    plt = plot_tools.pyplot()
     inpfile = "C:/Users/BuruzsA/Documents/projects/Digiaktiv/220621_Beispielschemen digiaktiv.pdf"
     doc = fitz.open(inpfile) #Opens the document from a given path
     # pnr = 3        #Page number (page 1 has index 0)
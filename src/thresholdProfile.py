@@ -0,0 +1,111 @@
+#  Copyright (c) 2023.   Adam Buruzs
+## Per document calibration of the pixel gray threshold of the raster rectangle detection.
+## The pages of a document are drawn the same way, so the threshold that finds the control blocks on the first
+## pages is tried first on the later pages, and the other thresholds are only tried if it fails.
+
+import contextlib
+import json
+import os
+import time
+
+
+class ThresholdProfile:
+    """ calibration profile of a document: which gray thresholds found the rectangles on the first pages """
+
+    def __init__(self, thresholds=(200, 245), calibrationPages=3):
+        """
+        :param thresholds: the gray thresholds to try, in the default order
+        :param calibrationPages: number of pages to observe before choosing the threshold
+        """
+        self.thresholds = list(thresholds)
+        self.calibrationPages = calibrationPages
+        self.pages = 0
+        self.counts = {t: 0 for t in self.thresholds}  # number of pages where the threshold found the rectangles
+        self.threshold = None  # the calibrated threshold
+        self.lastThreshold = None  # the threshold of the last recorded page, not saved
+
+    def candidates(self):
+        """ the thresholds to try on the next page: the calibrated one first"""
+        if self.threshold is None:
+            return list(self.thresholds)
+        return [self.threshold] + [t for t in self.thresholds if t != self.threshold]
+
+    def record(self, threshold):
+        """ record the threshold that found the rectangles of a page (None: no rectangles found)"""
+        self.pages += 1
+        self.lastThreshold = threshold
+        if threshold is not None:
+            self.counts[threshold] = self.counts.get(threshold, 0) + 1
+        if (self.threshold is None) and (self.pages >= self.calibrationPages) and any(self.counts.values()):
+            ## the most frequent one, the first in the default order if equal
+            self.threshold = max(self.thresholds, key=lambda t: self.counts.get(t, 0))
+
+    @property
+    def calibrated(self):
+        return self.threshold is not None
+
+    def toDict(self):
+        return {"thresholds": self.thresholds, "calibrationPages": self.calibrationPages, "pages": self.pages,
+                "counts": {str(t): n for t, n in self.counts.items()}, "threshold": self.threshold}
+
+    @classmethod
+    def fromDict(cls, d):
+        profile = cls(thresholds=d["thresholds"], calibrationPages=d["calibrationPages"])
+        profile.pages = d["pages"]
+        profile.counts = {int(t): n for t, n in d["counts"].items()}
+        profile.threshold = d["threshold"]
+        return profile
+
+    def save(self, path):
+        """ write the profile to a json file (atomic replace, several processes can write it)"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.toDict(), f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """ read the profile from a json file, or create a new one with kwargs if the file does not exist"""
+        if not os.path.exists(path):
+            return cls(**kwargs)
+        with open(path) as f:
+            return cls.fromDict(json.load(f))
+
+
+@contextlib.contextmanager
+def fileLock(path, timeout=30.0, poll=0.01):
+    """ lock between processes: the lock file is created exclusively, and removed at the end.
+    A lock file older than timeout is left over by a killed process, it is removed.
+    """
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > timeout:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(poll)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(path)
+
+
+def recordShared(path, threshold, **kwargs):
+    """ record the threshold of a page in the profile file. The file is read, updated and written under a lock, so
+    the worker processes that calibrate the same document add up their pages instead of overwriting each other.
+    :param kwargs: parameters of a new profile, if the file does not exist
+    :return: the updated ThresholdProfile
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with fileLock(f"{path}.lock"):
+        profile = ThresholdProfile.load(path, **kwargs)
+        profile.record(threshold)
+        profile.save(path)
+    return profile
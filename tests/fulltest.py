@@ -20,6 +20,7 @@ import src.fullProcess as fullProcess
 from src.fullProcess import processPage
 from src.fullProcess import DataEncoder
 import src.diagram2html as diagram2html
+from src.ndjsonWriter import NdjsonWriter, compactRecord, toLine
 import json
 import jinja2
 import os
@@ -45,15 +46,15 @@ except:
     logging.error(sys.exc_info())
 
 #for pagenum in range(2, doc.page_count + 1):  # range(1, doc.page_count + 1):  # range(doc.page_count):
+## one compact record per page in schemaText/<fileTag>.ndjson, written on a background thread
+writer = NdjsonWriter()
 for pagenum in range(6,8):
     page = doc[pagenum - 1]
     try:
         ifaces, controls = fullProcess.processPage(doc, pagenum=pagenum)
         zeichungsNummer = src.readpdf.getSchemaNumber(page)
-        outText = json.dumps({"diagramNumber": zeichungsNummer, "interfaces": ifaces, "controlBlocks": controls},
-                             cls=fullProcess.DataEncoder)
-        with open(f'{outdir}/schemaText/{fileTag}_p{pagenum}.txt', 'w') as f:
-            f.write(outText)
+        writer.write(f'{outdir}/schemaText/{fileTag}.ndjson',
+                     toLine(compactRecord(ifaces, controls, pagenum, zeichungsNummer, debug=True)))
         outjsfile = f"{outdir}/diagrams/{fileTag}_p{pagenum}.js"
         znum =  zeichungsNummer.replace('\n', '')
         fullProcess.toJointDiagram(ifaces, controls, title=f"page {pagenum}, ZNum:{znum}", outfile=outjsfile)
@@ -71,9 +72,9 @@ for pagenum in range(6,8):
         pix = page.get_pixmap(matrix=mat)  # render page to an image
         pix.save(f"{outdir}/icons/{fileTag}-p{pagenum}.png")
 
-    except:
-        logging.error(f"Error on page {pagenum}")
-        logging.error(sys.exc_info())
+    except Exception:
+        logging.exception(f"Error on page {pagenum}")
+writer.close()
 
 
 # if __name__ == "__debug_page9__":
@@ -0,0 +1,58 @@
+# import time benchmark of the processing modules. Every import is measured in a fresh python process (cold import),
+# and the script fails if the median import time exceeds the budget, or a plotting / opencv module is imported.
+#
+# usage: python tests/importBenchmark.py --budget 0.5 --repeat 5
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+## modules that must not be imported by the headless processing path
+HEAVY_MODULES = ["matplotlib", "cv2", "PyQt5", "scipy", "pandas", "jinja2"]
+
+MEASURE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"time": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def coldImport(module, repoDir):
+    """ import time of module in a new python process
+    :return: (seconds, list of the heavy modules that were imported)
+    """
+    out = subprocess.run([sys.executable, "-c", MEASURE.format(module=module, heavy=HEAVY_MODULES)],
+                         cwd=repoDir, capture_output=True, text=True, check=True)
+    res = json.loads(out.stdout.strip().splitlines()[-1])
+    return res["time"], res["heavy"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="cold import time of the processing modules")
+    parser.add_argument("modules", nargs="*", default=["src.baschema2model", "src.batch"])
+    parser.add_argument("--budget", type=float, default=0.5, help="maximum median import time in seconds")
+    parser.add_argument("--repeat", type=int, default=5, help="number of fresh processes per module")
+    args = parser.parse_args(argv)
+    repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    failed = False
+    for module in args.modules:
+        results = [coldImport(module, repoDir) for i in range(args.repeat)]
+        times = [t for t, heavy in results]
+        heavy = sorted(set(m for t, heavy in results for m in heavy))
+        median = statistics.median(times)
+        ok = (median <= args.budget) and not heavy
+        failed = failed or not ok
+        print(f"{module}: median {median:.3f} s, min {min(times):.3f} s, max {max(times):.3f} s, "
+              f"budget {args.budget:.3f} s {'OK' if ok else 'FAILED'}")
+        if heavy:
+            print(f"  heavy modules imported: {', '.join(heavy)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+# end-to-end benchmark of fullProcess.processPage on synthetic pages (see src/syntheticPage.py) of growing size.
+# For every page size it reports the time of the page and of each processing stage, pages per second, the peak
+# python memory (tracemalloc, measured in a separate run), the scaling exponent of the stages (slope of log time vs
+# log size), and checks the extracted graph against the ground truth of the generator.
+# The script fails if any page does not match its ground truth.
+#
+# usage: python tests/pipelineBenchmark.py --sizes 2,4,8,16,32 --repeat 3 --json benchmark.json
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import statistics
+import sys
+import tracemalloc
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import fullProcess, syntheticPage
+from src.spanTrace import PageTrace, stageSummary
+
+
+def runPage(doc, pagenum, trace=None, rect_engine="raster"):
+    """ process and serialize a page
+    :return: ifaces, controls, json text
+    """
+    ifaces, controls = fullProcess.processPage(doc, pagenum=pagenum, doplot=False, trace=trace,
+                                               rect_engine=rect_engine)
+    with (trace.span("serialization") if trace is not None else contextlib.nullcontext()):
+        outText = fullProcess.toText(ifaces, controls)
+    return ifaces, controls, outText
+
+
+def benchmarkSize(ncols, repeat=3, rect_engine="raster"):
+    """ time a synthetic page with ncols columns
+    :return: dict with the median page time, pages per second, peak memory, the median time of the stages
+        and the ground truth differences
+    """
+    doc, truths = syntheticPage.makeDocument([ncols])
+    pageTimes = []
+    traces = []
+    for r in range(repeat):
+        trace = PageTrace(f"{ncols} columns, run {r}")
+        t0 = perf_counter()
+        ifaces, controls, outText = runPage(doc, 1, trace=trace, rect_engine=rect_engine)
+        pageTimes.append(perf_counter() - t0)
+        traces.append(trace.toDict())
+    errors = syntheticPage.checkGroundTruth(ifaces, controls, truths[0])
+    ## the memory is measured separately, tracemalloc slows down the processing
+    tracemalloc.start()
+    runPage(doc, 1, rect_engine=rect_engine)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    stages = {}
+    for tr in traces:
+        for name, st in stageSummary([tr]).items():
+            stages.setdefault(name, []).append(st["total"])
+    pageTime = statistics.median(pageTimes)
+    return {"columns": ncols, "pageTime": pageTime, "pagesPerSecond": 1.0 / pageTime, "peakMemory": peak,
+            "outputBytes": len(outText), "stages": {name: statistics.median(ts) for name, ts in stages.items()},
+            "errors": errors}
+
+
+def scalingExponent(sizes, times):
+    """ slope of log(time) vs log(size): 1 for linear, 2 for quadratic scaling """
+    if len(sizes) < 2 or min(times) <= 0:
+        return float("nan")
+    return float(np.polyfit(np.log(sizes), np.log(times), 1)[0])
+
+
+def formatReport(results):
+    sizes = [res["columns"] for res in results]
+    rows = [f"{'columns':>8}{'page ms':>10}{'pages/s':>10}{'peak MB':>10}{'out kB':>9}  ground truth"]
+    for res in results:
+        truthCheck = f"{len(res['errors'])} errors" if res["errors"] else "OK"
+        rows.append(f"{res['columns']:>8}{res['pageTime'] * 1e3:>10.1f}{res['pagesPerSecond']:>10.2f}"
+                    f"{res['peakMemory'] / 2 ** 20:>10.1f}{res['outputBytes'] / 1024:>9.1f}  {truthCheck}")
+    rows.append("")
+    rows.append(f"{'stage (ms)':<22}" + "".join(f"{n:>9}" for n in sizes) + f"{'exponent':>10}")
+    stageNames = sorted(set(name for res in results for name in res["stages"]),
+                        key=lambda name: -results[-1]["stages"].get(name, 0.0))
+    for name in stageNames:
+        times = [res["stages"].get(name, float("nan")) for res in results]
+        rows.append(f"{name:<22}" + "".join(f"{t * 1e3:>9.1f}" for t in times) +
+                    f"{scalingExponent(sizes, times):>10.2f}")
+    return "\n".join(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="end-to-end benchmark on synthetic VDI 3814 pages")
+    parser.add_argument("--sizes", default="2,4,8,16,32", help="comma separated number of columns of the pages")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs per page size")
+    parser.add_argument("--engine", default="raster", choices=["raster", "vector"], help="rectangle engine")
+    parser.add_argument("--json", default=None, help="write the results to this json file")
+    args = parser.parse_args(argv)
+    logging.disable(logging.CRITICAL)
+    results = []
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            ## warm-up: the first page pays for the lazy imports
+            runPage(syntheticPage.makeDocument([2])[0], 1, rect_engine=args.engine)
+        for ncols in [int(n) for n in args.sizes.split(",")]:
+            with contextlib.redirect_stdout(devnull):  # the debug prints of the processing modules
+                res = benchmarkSize(ncols, repeat=args.repeat, rect_engine=args.engine)
+            results.append(res)
+            for err in res["errors"]:
+                print(f"{ncols} columns: {err}")
+    print(formatReport(results))
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    return 1 if any(res["errors"] for res in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())